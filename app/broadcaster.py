@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections import deque
+
+import aiohttp
+
+from protocol import BinaryEventTypes
+
+# Events where only the newest state matters, consecutive ones are merged before they are sent
+COALESCED_EVENTS = {"status", "progress_state"}
+# Events a slow client can miss, the oldest pending ones are dropped when its queue is full
+DROPPABLE_EVENTS = {"progress", BinaryEventTypes.PREVIEW_IMAGE, BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA}
+
+
+class OutgoingMessage:
+    """A message encoded once and shared by the queues of all the sockets it is sent to."""
+    def __init__(self, event, payload, coalesce_key=None):
+        self.event = event
+        self.payload = payload
+        self.coalesce_key = coalesce_key
+        self.droppable = event in DROPPABLE_EVENTS
+
+    @classmethod
+    def json(cls, event, data):
+        coalesce_key = None
+        if event in COALESCED_EVENTS:
+            prompt_id = data.get("prompt_id", None) if isinstance(data, dict) else None
+            coalesce_key = (event, prompt_id)
+        return cls(event, json.dumps({"type": event, "data": data}), coalesce_key)
+
+    @classmethod
+    def binary(cls, event, message):
+        return cls(event, bytes(message))
+
+
+class SocketSender:
+    """
+    The send queue of one websocket, drained by its own task so a slow client only
+    delays itself. A newer coalesced message drops the pending one with the same key and
+    goes to the back of the queue, so it is never sent before the messages queued ahead of
+    it. Each droppable event type keeps at most max_droppable messages.
+    """
+    def __init__(self, ws, max_droppable=8):
+        self.ws = ws
+        self.max_droppable = max_droppable
+        self.queue: deque[OutgoingMessage] = deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def put(self, message: OutgoingMessage):
+        if message.coalesce_key is not None:
+            for pending in self.queue:
+                if pending.coalesce_key == message.coalesce_key:
+                    self.queue.remove(pending)
+                    break
+        if message.droppable:
+            same_event = [pending for pending in self.queue if pending.event == message.event]
+            if len(same_event) >= self.max_droppable:
+                self.queue.remove(same_event[0])
+                self.dropped += 1
+        self.queue.append(message)
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            while len(self.queue) > 0:
+                message = self.queue.popleft()
+                try:
+                    if isinstance(message.payload, str):
+                        await self.ws.send_str(message.payload)
+                    else:
+                        await self.ws.send_bytes(message.payload)
+                except (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError) as err:
+                    logging.warning("send error: {}".format(err))
+            self.ready.clear()
+
+    async def flush(self):
+        """Waits until everything queued so far was sent."""
+        while len(self.queue) > 0 or self.ready.is_set():
+            await asyncio.sleep(0.001)
+
+    def close(self):
+        self.task.cancel()
+
+
+class Broadcaster:
+    """
+    Delivers the server messages to the websockets. Runs of consecutive coalesced events
+    are held for coalesce_window seconds and only the newest message for every key is
+    sent; any other message flushes them first so the order between events is kept.
+    """
+    def __init__(self, coalesce_window=0.05, max_droppable=8):
+        self.coalesce_window = coalesce_window
+        self.max_droppable = max_droppable
+        self.senders: dict[str, SocketSender] = {}
+        self.held: dict[tuple, tuple[OutgoingMessage, str | None]] = {}
+        self.flush_handle = None
+
+    def add(self, sid, ws):
+        self.remove(sid)
+        self.senders[sid] = SocketSender(ws, self.max_droppable)
+
+    def remove(self, sid):
+        sender = self.senders.pop(sid, None)
+        if sender is not None:
+            sender.close()
+
+    def send(self, message: OutgoingMessage, sid=None):
+        if message.coalesce_key is not None and self.coalesce_window > 0:
+            self.held[(message.coalesce_key, sid)] = (message, sid)
+            if self.flush_handle is None:
+                self.flush_handle = asyncio.get_running_loop().call_later(self.coalesce_window, self.flush_held)
+            return
+        self.flush_held()
+        self.deliver(message, sid)
+
+    def flush_held(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        held = list(self.held.values())
+        self.held.clear()
+        for message, sid in held:
+            self.deliver(message, sid)
+
+    def deliver(self, message: OutgoingMessage, sid=None):
+        if sid is None:
+            for sender in list(self.senders.values()):
+                sender.put(message)
+        elif sid in self.senders:
+            self.senders[sid].put(message)
@@ -0,0 +1,201 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from typing import Optional
+
+from app.database.db import can_create_session, create_session
+from comfy.cli_args import args
+
+try:
+    from sqlalchemy import delete, func, select
+    from app.database.models import PromptHistory, PromptHistoryOutput
+except ImportError:
+    pass
+
+
+def persistent_history_available():
+    """
+    The history can only be persisted once the database has been initialized.
+    In memory databases are per connection so they are not usable from the writer thread.
+    """
+    return can_create_session() and ":memory:" not in args.database_url
+
+
+def iter_output_files(outputs):
+    for node_id, node_output in outputs.items():
+        if not isinstance(node_output, dict):
+            continue
+        for items in node_output.values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if isinstance(item, dict) and "filename" in item:
+                    yield node_id, item
+
+
+class HistoryStore:
+    """
+    Prompt history stored in the sqlite database.
+
+    Writes are queued and committed in batches by a background thread so the prompt
+    worker never waits on the disk. Reads flush the queue first so they always see
+    everything that was written before them, which blocks: the server calls them from
+    a thread instead of the event loop.
+    """
+    def __init__(self, max_items: int, batch_size: int = 64):
+        self.max_items = max_items
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.count = None
+        self.writer = None
+        self.writer_lock = threading.Lock()
+
+    def start(self):
+        with self.writer_lock:
+            if self.writer is not None:
+                return
+            with create_session() as session:
+                self.count = session.scalar(select(func.count()).select_from(PromptHistory))
+            self.writer = threading.Thread(target=self.write_loop, daemon=True, name="HistoryWriter")
+            self.writer.start()
+            atexit.register(self.flush)
+
+    def write_loop(self):
+        while True:
+            ops = [self.queue.get()]
+            while len(ops) < self.batch_size:
+                try:
+                    ops.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with create_session() as session:
+                    for op, op_args in ops:
+                        op(session, *op_args)
+                    self.prune(session)
+                    session.commit()
+            except Exception:
+                logging.exception("Error writing prompt history to the database:")
+            finally:
+                for _ in ops:
+                    self.queue.task_done()
+
+    def submit(self, op, *op_args):
+        self.start()
+        self.queue.put((op, op_args))
+
+    def flush(self):
+        if self.writer is not None:
+            self.queue.join()
+
+    def add(self, prompt_id: str, entry: dict, completed_at: float):
+        status = entry.get("status") or {}
+        data = json.dumps(entry, default=str)
+        self.submit(self._add, prompt_id, entry, data, status.get("status_str"), status.get("completed"), completed_at)
+
+    def _add(self, session, prompt_id, entry, data, status_str, completed, completed_at):
+        existing = session.scalar(select(PromptHistory.id).where(PromptHistory.prompt_id == prompt_id))
+        if existing is not None:
+            self._delete(session, prompt_id)
+
+        row = PromptHistory(
+            prompt_id=prompt_id,
+            number=entry["prompt"][0],
+            status=status_str,
+            completed=completed,
+            completed_at=completed_at,
+            data=data,
+        )
+        session.add(row)
+        session.flush()
+        for node_id, item in iter_output_files(entry.get("outputs", {})):
+            session.add(PromptHistoryOutput(
+                history_id=row.id,
+                node_id=node_id,
+                filename=item["filename"],
+                subfolder=item.get("subfolder", ""),
+                type=item.get("type"),
+            ))
+        self.count += 1
+
+    def prune(self, session):
+        # Allow some slack so the delete runs once per batch of prompts instead of every prompt
+        if self.count <= self.max_items + max(self.max_items // 100, 1):
+            return
+        oldest_kept = session.scalar(select(PromptHistory.id).order_by(PromptHistory.id.desc()).offset(self.max_items - 1).limit(1))
+        if oldest_kept is None:
+            return
+        session.execute(delete(PromptHistoryOutput).where(PromptHistoryOutput.history_id < oldest_kept))
+        session.execute(delete(PromptHistory).where(PromptHistory.id < oldest_kept))
+        self.count = self.max_items
+
+    def delete(self, prompt_id: str):
+        self.submit(self._delete, prompt_id)
+
+    def _delete(self, session, prompt_id):
+        row_id = session.scalar(select(PromptHistory.id).where(PromptHistory.prompt_id == prompt_id))
+        if row_id is None:
+            return
+        session.execute(delete(PromptHistoryOutput).where(PromptHistoryOutput.history_id == row_id))
+        session.execute(delete(PromptHistory).where(PromptHistory.id == row_id))
+        self.count -= 1
+
+    def wipe(self):
+        self.submit(self._wipe)
+
+    def _wipe(self, session):
+        session.execute(delete(PromptHistoryOutput))
+        session.execute(delete(PromptHistory))
+        self.count = 0
+
+    def get(self, prompt_id: str) -> Optional[dict]:
+        self.flush()
+        with create_session() as session:
+            data = session.scalar(select(PromptHistory.data).where(PromptHistory.prompt_id == prompt_id))
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def get_page(self, max_items=None, offset=-1) -> dict:
+        """
+        Same paging as the in memory history: entries in completion order, a negative
+        offset with max_items returns the latest max_items entries.
+        """
+        self.flush()
+        query = select(PromptHistory.prompt_id, PromptHistory.data)
+        reverse = False
+        if offset < 0:
+            if max_items is not None:
+                query = query.order_by(PromptHistory.id.desc()).limit(max_items)
+                reverse = True
+            else:
+                query = query.order_by(PromptHistory.id)
+        else:
+            query = query.order_by(PromptHistory.id).offset(offset)
+            if max_items is not None:
+                query = query.limit(max_items)
+
+        with create_session() as session:
+            rows = session.execute(query).all()
+        if reverse:
+            rows.reverse()
+        return {prompt_id: json.loads(data) for prompt_id, data in rows}
+
+    def find_by_output(self, filename: str, subfolder: Optional[str] = None, output_type: Optional[str] = None) -> dict:
+        """Returns the history entries of the prompts that produced a file with this name."""
+        self.flush()
+        query = (select(PromptHistory.prompt_id, PromptHistory.data)
+                 .join(PromptHistoryOutput, PromptHistoryOutput.history_id == PromptHistory.id)
+                 .where(PromptHistoryOutput.filename == filename))
+        if subfolder is not None:
+            query = query.where(PromptHistoryOutput.subfolder == subfolder)
+        if output_type is not None:
+            query = query.where(PromptHistoryOutput.type == output_type)
+        query = query.distinct().order_by(PromptHistory.id)
+
+        with create_session() as session:
+            rows = session.execute(query).all()
+        return {prompt_id: json.loads(data) for prompt_id, data in rows}
@@ -1,3 +1,4 @@
+from sqlalchemy import Boolean, Column, Float, Integer, String, Text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,4 +12,33 @@ def to_dict(obj):
         if (val := getattr(obj, field))
     }
 
-# TODO: Define models here
+
+class PromptHistory(Base):
+    """
+    A finished prompt. The full history entry (prompt, outputs, status, meta) is
+    stored as JSON in `data`, the other columns exist so they can be indexed.
+    `id` increases with completion order and is what /history pages over.
+    """
+    __tablename__ = "prompt_history"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    prompt_id = Column(String, nullable=False, unique=True, index=True)
+    number = Column(Float)
+    status = Column(String, index=True)
+    completed = Column(Boolean)
+    completed_at = Column(Float, index=True)
+    data = Column(Text, nullable=False)
+
+
+class PromptHistoryOutput(Base):
+    """
+    One file produced by a prompt, used to find the prompt that created an output.
+    """
+    __tablename__ = "prompt_history_output"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    history_id = Column(Integer, nullable=False, index=True)
+    node_id = Column(String)
+    filename = Column(String, index=True)
+    subfolder = Column(String)
+    type = Column(String)
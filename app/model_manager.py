@@ -2,26 +2,30 @@ from __future__ import annotations
 
 import os
 import base64
+import hashlib
 import json
-import time
 import logging
 import folder_paths
 import glob
 import comfy.utils
+import comfy.model_hash
 from aiohttp import web
-from PIL import Image
 from io import BytesIO
+from app.preview_manager import PreviewManager
 from folder_paths import map_legacy, filter_files_extensions, filter_files_content_types
 
 
 class ModelFileManager:
-    def __init__(self) -> None:
-        self.cache: dict[str, tuple[list[dict], dict[str, float], float]] = {}
+    def __init__(self, preview_manager: PreviewManager | None = None) -> None:
+        if preview_manager is None:
+            preview_manager = PreviewManager()
+        self.preview_manager = preview_manager
+        self.cache: dict[str, tuple[tuple[int, int], list[dict]]] = {}
 
-    def get_cache(self, key: str, default=None) -> tuple[list[dict], dict[str, float], float] | None:
+    def get_cache(self, key: str, default=None) -> tuple[tuple[int, int], list[dict]] | None:
         return self.cache.get(key, default)
 
-    def set_cache(self, key: str, value: tuple[list[dict], dict[str, float], float]):
+    def set_cache(self, key: str, value: tuple[tuple[int, int], list[dict]]):
         self.cache[key] = value
 
     def clear_cache(self):
@@ -68,11 +72,13 @@ class ModelFileManager:
                 return web.Response(status=404)
 
             try:
-                with Image.open(default_preview) as img:
-                    img_bytes = BytesIO()
-                    img.save(img_bytes, format="WEBP")
-                    img_bytes.seek(0)
-                    return web.Response(body=img_bytes.getvalue(), content_type="image/webp")
+                if isinstance(default_preview, str):
+                    stat = os.stat(default_preview)
+                    source_key = (os.path.abspath(default_preview), stat.st_mtime_ns, stat.st_size)
+                else:
+                    source_key = (hashlib.sha256(default_preview.getbuffer()).hexdigest(),)
+                _, (body, content_type) = await self.preview_manager.run(self.preview_manager.webp_preview, default_preview, source_key)
+                return web.Response(body=body, content_type=content_type)
             except:
                 return web.Response(status=404)
 
@@ -82,80 +88,42 @@ class ModelFileManager:
         output_list: list[dict] = []
 
         for index, folder in enumerate(folders[0]):
-            if not os.path.isdir(folder):
-                continue
-            out = self.cache_model_file_list_(folder)
-            if out is None:
-                out = self.recursive_search_models_(folder, index)
-                self.set_cache(folder, out)
-            output_list.extend(out[0])
+            output_list.extend(self.get_folder_model_files(folder, index))
 
         return output_list
 
-    def cache_model_file_list_(self, folder: str):
-        model_file_list_cache = self.get_cache(folder)
-
-        if model_file_list_cache is None:
-            return None
-        if not os.path.isdir(folder):
-            return None
-        if os.path.getmtime(folder) != model_file_list_cache[1]:
-            return None
-        for x in model_file_list_cache[1]:
-            time_modified = model_file_list_cache[1][x]
-            folder = x
-            if os.path.getmtime(folder) != time_modified:
-                return None
-
-        return model_file_list_cache
-
-    def recursive_search_models_(self, directory: str, pathIndex: int) -> tuple[list[str], dict[str, float], float]:
-        if not os.path.isdir(directory):
-            return [], {}, time.perf_counter()
-
-        excluded_dir_names = [".git"]
+    def get_folder_model_files(self, folder: str, path_index: int) -> list[dict]:
+        root = folder_paths.model_index.get_root(folder)
+        key = f"{path_index}:{root.directory}"
+        version = (root.version, comfy.model_hash.index.version)
+        cached = self.get_cache(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
         # TODO use settings
         include_hidden_files = False
 
-        result: list[str] = []
-        dirs: dict[str, float] = {}
-
-        for dirpath, subdirs, filenames in os.walk(directory, followlinks=True, topdown=True):
-            subdirs[:] = [d for d in subdirs if d not in excluded_dir_names]
-            if not include_hidden_files:
-                subdirs[:] = [d for d in subdirs if not d.startswith(".")]
-                filenames = [f for f in filenames if not f.startswith(".")]
-
-            filenames = filter_files_extensions(filenames, folder_paths.supported_pt_extensions)
-
-            for file_name in filenames:
-                try:
-                    full_path = os.path.join(dirpath, file_name)
-                    relative_path = os.path.relpath(full_path, directory)
-
-                    # Get file metadata
-                    file_info = {
-                        "name": relative_path,
-                        "pathIndex": pathIndex,
-                        "modified": os.path.getmtime(full_path),  # Add modification time
-                        "created": os.path.getctime(full_path),   # Add creation time
-                        "size": os.path.getsize(full_path)        # Add file size
-                    }
-                    result.append(file_info)
-
-                except Exception as e:
-                    logging.warning(f"Warning: Unable to access {file_name}. Error: {e}. Skipping this file.")
-                    continue
-
-            for d in subdirs:
-                path: str = os.path.join(dirpath, d)
-                try:
-                    dirs[path] = os.path.getmtime(path)
-                except FileNotFoundError:
-                    logging.warning(f"Warning: Unable to access {path}. Skipping this path.")
-                    continue
-
-        return result, dirs, time.perf_counter()
+        result: list[dict] = []
+        for name in filter_files_extensions(root.get_files(), folder_paths.supported_pt_extensions):
+            if not include_hidden_files and any(x.startswith(".") for x in name.split(os.sep)):
+                continue
+            try:
+                stat = root.get_stat(name)
+            except OSError as e:
+                logging.warning(f"Warning: Unable to access {name}. Error: {e}. Skipping this file.")
+                continue
+            hashes = comfy.model_hash.index.lookup(os.path.join(root.directory, name), stat)
+            result.append({
+                "name": name,
+                "pathIndex": path_index,
+                "modified": stat.st_mtime,
+                "created": stat.st_ctime,
+                "size": stat.st_size,
+                "fingerprint": hashes["fingerprint"] if hashes is not None else None,
+                "sha256": hashes["sha256"] if hashes is not None else None,
+            })
+
+        self.set_cache(key, (version, result))
+        return result
 
     def get_model_previews(self, filepath: str) -> list[str | BytesIO]:
         dirname = os.path.dirname(filepath)
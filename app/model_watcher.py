@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import folder_paths
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+# Seconds between two polls of the model folders that are watched
+FULL_POLL_INTERVAL = 300.0
+
+
+class Inotify:
+    """Minimal inotify binding, only available on Linux."""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, str] = {}
+        self.paths: dict[str, int] = {}
+        self.failed = False
+
+    def watch(self, path: str) -> bool:
+        """Watches a directory, False if it can't be watched."""
+        if path in self.paths:
+            return True
+        wd = self.add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            if not self.failed:
+                logging.warning("Failed to watch {} for model changes ({}), it will only be polled.".format(path, os.strerror(ctypes.get_errno())))
+                self.failed = True
+            return False
+        self.watches[wd] = path
+        self.paths[path] = wd
+        return True
+
+    def read(self, timeout: float) -> set[str] | None:
+        """Directories that had events in the next timeout seconds, None if events were lost."""
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                path = self.watches.get(wd, None)
+                if path is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    self.paths.pop(path, None)
+                changed.add(path)
+        return changed
+
+
+class ModelIndexWatcher(threading.Thread):
+    """
+    Keeps folder_paths.model_index up to date in the background so looking up the model
+    files doesn't have to check the disk. Changes are picked up immediately through inotify
+    (Linux). The model folders that can't be watched (and every folder on other platforms)
+    are polled every interval seconds. Every folder is also polled every FULL_POLL_INTERVAL
+    seconds for network storage that accepts watches but doesn't report remote changes.
+    """
+    def __init__(self, index: folder_paths.ModelIndex, interval: float):
+        super().__init__(name="ModelIndexWatcher", daemon=True)
+        self.index = index
+        self.interval = interval
+        self.inotify = None
+        # Roots with directories that couldn't be watched
+        self.polled_roots: set[str] = set()
+        if sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logging.info("inotify not available, model folders will only be polled: {}".format(e))
+
+    def folder_paths(self):
+        paths = []
+        for folder_name, (folders, _) in list(folder_paths.folder_names_and_paths.items()):
+            if folder_name in ("custom_nodes", "configs"):
+                continue
+            for folder in folders:
+                if folder not in paths:
+                    paths.append(folder)
+        return paths
+
+    def needs_polling(self, root: folder_paths.ModelIndexRoot):
+        # A folder that doesn't exist yet has nothing to watch
+        return self.inotify is None or root.directory in self.polled_roots or root.directory not in root.dirs
+
+    def poll(self, full=True):
+        for folder in self.folder_paths():
+            root = self.index.get_root(folder, refresh=False)
+            if full or self.needs_polling(root):
+                with root.lock:
+                    root.refresh()
+        self.sync_watches()
+
+    def sync_watches(self):
+        if self.inotify is None:
+            return
+        for root in self.index.get_roots():
+            with root.lock:
+                directories = list(root.dirs)
+            watched = all([self.inotify.watch(directory) for directory in directories])
+            if watched:
+                self.polled_roots.discard(root.directory)
+            else:
+                self.polled_roots.add(root.directory)
+
+    def run(self):
+        start_time = time.perf_counter()
+        self.poll()
+        self.index.watched = True
+        logging.info("Indexed model folders in {:.2f} seconds".format(time.perf_counter() - start_time))
+        next_poll = time.monotonic() + self.interval
+        next_full_poll = time.monotonic() + max(FULL_POLL_INTERVAL, self.interval)
+        while True:
+            timeout = max(min(next_poll, next_full_poll) - time.monotonic(), 0)
+            try:
+                if self.inotify is not None:
+                    changed = self.inotify.read(timeout)
+                else:
+                    time.sleep(timeout)
+                    changed = set()
+                if changed is None or time.monotonic() >= next_full_poll:
+                    self.poll()
+                    next_poll = time.monotonic() + self.interval
+                    next_full_poll = time.monotonic() + max(FULL_POLL_INTERVAL, self.interval)
+                else:
+                    for directory in changed:
+                        self.index.directory_changed(directory)
+                    if len(changed) > 0:
+                        self.sync_watches()
+                    if time.monotonic() >= next_poll:
+                        self.poll(full=False)
+                        next_poll = time.monotonic() + self.interval
+            except Exception as e:
+                logging.error("Error while updating the model index: {}".format(e))
+                time.sleep(self.interval)
+
+
+def start_model_watcher(interval: float) -> ModelIndexWatcher | None:
+    if interval <= 0:
+        return None
+    watcher = ModelIndexWatcher(folder_paths.model_index, interval)
+    watcher.start()
+    return watcher
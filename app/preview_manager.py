@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+import folder_paths
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/webp": ".webp",
+    "image/jpeg": ".jpeg",
+    "image/png": ".png",
+}
+
+
+def hash_stream(hasher, f):
+    while True:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def same_file_content(hash_function, filepath, upload_file):
+    """Compares a file on disk with an uploaded file without reading either completely into memory."""
+    upload_file.seek(0, os.SEEK_END)
+    upload_size = upload_file.tell()
+    upload_file.seek(0)
+    if os.path.getsize(filepath) != upload_size:
+        return False
+    with open(filepath, "rb") as f:
+        a = hash_stream(hash_function(), f)
+    b = hash_stream(hash_function(), upload_file)
+    upload_file.seek(0)
+    return a == b
+
+
+def convert_image(file, preview=None, channel=None, max_dim=None):
+    """
+    The conversions done by /view, preview is "format;quality", channel is rgb or a and
+    max_dim limits the width and height of previews.
+    Returns (body, content type) or None when the file can be returned unchanged.
+    """
+    if preview is not None:
+        with Image.open(file) as img:
+            preview_info = preview.split(';')
+            image_format = preview_info[0]
+            if image_format not in ['webp', 'jpeg'] or 'a' in (channel or ''):
+                image_format = 'webp'
+
+            quality = 90
+            if preview_info[-1].isdigit():
+                quality = int(preview_info[-1])
+
+            if max_dim is not None and max(img.size) > max_dim:
+                img.thumbnail((max_dim, max_dim))
+
+            buffer = BytesIO()
+            if image_format in ['jpeg'] or channel == 'rgb':
+                img = img.convert("RGB")
+            img.save(buffer, format=image_format, quality=quality)
+            return buffer.getvalue(), f'image/{image_format}'
+
+    if channel == 'rgb':
+        with Image.open(file) as img:
+            if img.mode == "RGBA":
+                r, g, b, a = img.split()
+                new_img = Image.merge('RGB', (r, g, b))
+            else:
+                new_img = img.convert("RGB")
+
+            buffer = BytesIO()
+            new_img.save(buffer, format='PNG')
+            return buffer.getvalue(), 'image/png'
+
+    elif channel == 'a':
+        with Image.open(file) as img:
+            if img.mode == "RGBA":
+                _, _, _, a = img.split()
+            else:
+                a = Image.new('L', img.size, 255)
+
+            # alpha img
+            alpha_img = Image.new('RGBA', img.size)
+            alpha_img.putalpha(a)
+            alpha_buffer = BytesIO()
+            alpha_img.save(alpha_buffer, format='PNG')
+            return alpha_buffer.getvalue(), 'image/png'
+
+    return None
+
+
+class DerivativeStore:
+    """
+    Converted images on disk, one file per derivative named after its etag.
+    The total size is capped, the least recently used files are deleted first.
+    """
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.index: OrderedDict[str, int] | None = None
+        self.size = 0
+
+    def load_index(self):
+        if self.index is not None:
+            return
+        self.index = OrderedDict()
+        files = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and os.path.splitext(entry.name)[1] in CONTENT_TYPE_EXTENSIONS.values():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.index[name] = size
+            self.size += size
+        self.evict(self.max_size)
+
+    def evict(self, size):
+        while self.size > size and len(self.index) > 0:
+            name, file_size = self.index.popitem(last=False)
+            self.size -= file_size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def get(self, etag: str):
+        self.load_index()
+        for content_type, extension in CONTENT_TYPE_EXTENSIONS.items():
+            name = etag + extension
+            if name in self.index:
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path, "rb") as f:
+                        body = f.read()
+                    os.utime(path)
+                except OSError:
+                    self.size -= self.index.pop(name)
+                    return None
+                self.index.move_to_end(name)
+                return body, content_type
+        return None
+
+    def put(self, etag: str, value: tuple[bytes, str]):
+        body, content_type = value
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type, None)
+        if extension is None or len(body) > self.max_size:
+            return
+        self.load_index()
+        name = etag + extension
+        if name in self.index:
+            return
+        self.evict(self.max_size - len(body))
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logging.warning(f"Failed to write preview to the cache: {e}")
+            return
+        self.index[name] = len(body)
+        self.size += len(body)
+
+
+class PreviewManager:
+    """
+    Runs the image decoding/encoding of the server routes on a bounded thread pool so it
+    doesn't block the event loop. Converted images (derivatives) are kept in a LRU cache
+    in RAM and optionally in a size capped store on disk, both keyed by the source file
+    (path, mtime, size) and the conversion parameters. The etag of a derivative is a hash
+    of that key so it can be checked without converting anything.
+    """
+    def __init__(self, max_workers: int | None = None, cache_size: int = 256 * 1024 * 1024, directory: str | None = None, disk_size: int = 0) -> None:
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ImageWorker")
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self.cache_used = 0
+        self.lock = threading.Lock()
+        self.store = DerivativeStore(directory, disk_size) if directory is not None and disk_size > 0 else None
+        # Conversion parameters that were requested recently, new outputs are converted with them ahead of time
+        self.recent_params: OrderedDict[tuple, None] = OrderedDict()
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    def etag(self, file: str, *params) -> str:
+        stat = os.stat(file)
+        key = (os.path.abspath(file), stat.st_mtime_ns, stat.st_size) + params
+        return hashlib.sha256(repr(key).encode()).hexdigest()[:40]
+
+    def get_cached(self, etag):
+        with self.lock:
+            value = self.cache.get(etag, None)
+            if value is not None:
+                self.cache.move_to_end(etag)
+                return value
+            if self.store is not None:
+                value = self.store.get(etag)
+                if value is not None:
+                    self.set_memory(etag, value)
+            return value
+
+    def set_memory(self, etag, value):
+        size = len(value[0])
+        if size > self.cache_size or etag in self.cache:
+            return
+        self.cache[etag] = value
+        self.cache_used += size
+        while self.cache_used > self.cache_size:
+            _, old = self.cache.popitem(last=False)
+            self.cache_used -= len(old[0])
+
+    def set_cached(self, etag, value):
+        with self.lock:
+            self.set_memory(etag, value)
+            if self.store is not None:
+                self.store.put(etag, value)
+
+    def get_derivative(self, etag, render):
+        value = self.get_cached(etag)
+        if value is None:
+            value = render()
+            if value is not None:
+                self.set_cached(etag, value)
+        return value
+
+    def convert_image(self, file: str, preview: str | None = None, channel: str | None = None, max_dim: int | None = None):
+        etag = self.etag(file, preview, channel, max_dim)
+        return self.get_derivative(etag, lambda: convert_image(file, preview, channel, max_dim))
+
+    async def convert_image_async(self, file: str, preview: str | None = None, channel: str | None = None, max_dim: int | None = None):
+        with self.lock:
+            params = (preview, channel, max_dim)
+            self.recent_params[params] = None
+            self.recent_params.move_to_end(params)
+            while len(self.recent_params) > 4:
+                self.recent_params.popitem(last=False)
+        return await self.run(self.convert_image, file, preview, channel, max_dim)
+
+    def webp_preview(self, source, source_key: tuple):
+        """WEBP version of an image file or file like object, source_key identifies its content."""
+        etag = hashlib.sha256(repr(source_key + ("webp",)).encode()).hexdigest()[:40]
+        def render():
+            with Image.open(source) as img:
+                img_bytes = BytesIO()
+                img.save(img_bytes, format="WEBP")
+                return img_bytes.getvalue(), "image/webp"
+        return etag, self.get_derivative(etag, render)
+
+    def warm_outputs(self, outputs: dict):
+        """Converts the images of a finished prompt in the background with the recently requested parameters."""
+        from app.database.history import iter_output_files
+
+        with self.lock:
+            params = list(self.recent_params)
+        if len(params) == 0:
+            return
+        for _, item in iter_output_files(outputs):
+            output_dir = folder_paths.get_directory_by_type(item.get("type", "output"))
+            if output_dir is None:
+                continue
+            file = os.path.join(output_dir, item.get("subfolder", ""), item["filename"])
+            if os.path.splitext(file)[1].lower() not in (".png", ".jpg", ".jpeg", ".webp"):
+                continue
+            for preview, channel, max_dim in params:
+                self.executor.submit(self.warm, file, preview, channel, max_dim)
+
+    def warm(self, file, preview, channel, max_dim):
+        try:
+            self.convert_image(file, preview, channel, max_dim)
+        except Exception as e:
+            logging.debug(f"Failed to generate preview for {file}: {e}")
@@ -47,10 +47,16 @@ parser.add_argument("--extra-model-paths-config", type=str, default=None, metava
 parser.add_argument("--output-directory", type=str, default=None, help="Set the ComfyUI output directory. Overrides --base-directory.")
 parser.add_argument("--temp-directory", type=str, default=None, help="Set the ComfyUI temp directory (default is in the ComfyUI directory). Overrides --base-directory.")
 parser.add_argument("--input-directory", type=str, default=None, help="Set the ComfyUI input directory. Overrides --base-directory.")
+parser.add_argument("--cache-directory", type=str, default=None, help="Set the ComfyUI cache directory, used by the caches that are kept on disk between runs. Overrides --base-directory.")
 parser.add_argument("--auto-launch", action="store_true", help="Automatically launch ComfyUI in the default browser.")
 parser.add_argument("--disable-auto-launch", action="store_true", help="Disable auto launching the browser.")
 parser.add_argument("--cuda-device", type=int, default=None, metavar="DEVICE_ID", help="Set the id of the cuda device this instance will use. All other devices will not be visible.")
 parser.add_argument("--default-device", type=int, default=None, metavar="DEFAULT_DEVICE_ID", help="Set the id of the default device, all other devices will stay visible.")
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="COUNT", help="Number of prompts executed at the same time. Each worker has its own node cache and its own device, so there are at most as many workers as devices in --prompt-worker-devices.")
+parser.add_argument("--prompt-worker-devices", type=str, default=None, metavar="DEVICE_IDS", help="Comma separated device ids, one per prompt worker, for example 0,1 to run the first worker on device 0 and the second on device 1. By default a single worker runs on the default device.")
+parser.add_argument("--queue-client-weight", type=str, default=[], metavar="CLIENT_ID=WEIGHT", action='append', help="Share of the queue given to a client_id when several clients have prompts waiting, relative to the default weight of 1. Can be used multiple times.")
+parser.add_argument("--queue-model-affinity", type=int, default=0, metavar="WINDOW", help="Reorder the queue to run prompts that use the same checkpoint/unet/text encoder/lora files back to back to avoid swapping models. Each time, the prompt sharing the most model bytes with the previous prompt is picked among the next WINDOW prompts. A prompt is passed over at most WINDOW times. 0 (default) disables it.")
+parser.add_argument("--sampler-batch-fusion", type=int, default=0, metavar="MAX_PROMPTS", help="When a prompt starts, take up to MAX_PROMPTS - 1 queued prompts of the same client that only differ in the seed or CLIPTextEncode text of their KSampler nodes and sample them as one batch with it. Only samplers that don't draw noise from the seed at every step (euler, dpmpp_2m, uni_pc...) are fused. 0 (default) disables it.")
 cm_group = parser.add_mutually_exclusive_group()
 cm_group.add_argument("--cuda-malloc", action="store_true", help="Enable cudaMallocAsync (enabled by default for torch 2.0 and up).")
 cm_group.add_argument("--disable-cuda-malloc", action="store_true", help="Disable cudaMallocAsync.")
@@ -100,12 +106,28 @@ class LatentPreviewMethod(enum.Enum):
 parser.add_argument("--preview-method", type=LatentPreviewMethod, default=LatentPreviewMethod.NoPreviews, help="Default preview method for sampler nodes.", action=EnumAction)
 
 parser.add_argument("--preview-size", type=int, default=512, help="Sets the maximum preview size for sampler nodes.")
+parser.add_argument("--preview-interval", type=float, default=0.25, help="Minimum time in seconds between two sampler previews. 0 previews every step.")
 
 cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 cache_group.add_argument("--cache-ram", nargs='?', const=4.0, type=float, default=0, help="Use RAM pressure caching with the specified headroom threshold. If available RAM drops below the threhold the cache remove large items to free RAM. Default 4GB")
+parser.add_argument("--cache-disk", nargs='?', const=32.0, type=float, default=0, help="Spill node results evicted from the RAM cache to the disk (in the cache directory) instead of dropping them, with the specified size limit in GB. They are loaded back when needed and kept between runs. Default 32GB")
+
+parser.add_argument("--cache-tensor-hash", type=str, choices=["full", "sampled", "none"], default="full", help="How tensor and array inputs are hashed for the node cache. full hashes all the bytes, sampled only hashes evenly spaced blocks of large tensors, none never caches nodes with tensor inputs.")
+parser.add_argument("--text-encoder-cache", type=float, default=1.0, help="RAM budget in GB for the outputs of text encoders, shared by every CLIP model and workflow so encoding the same prompt with the same text encoder weights again is only a lookup. 0 disables it.")
+parser.add_argument("--text-encoder-cache-disk", nargs='?', const=4.0, type=float, default=0, help="Also keep the text encoder outputs on disk (in the cache directory) between runs, with the specified size limit in GB. Default 4GB")
+parser.add_argument("--state-dict-cache", type=float, default=0, help="RAM budget in GB for the state dicts read by the checkpoint, diffusion model, text encoder and VAE loaders, so loading the same unchanged file again doesn't read and parse it. 0 (the default) disables it.")
+parser.add_argument("--lora-cache", type=float, default=1.0, help="RAM budget in GB for the parsed LoRA files shared by the LoRA loader nodes. 0 disables it.")
+parser.add_argument("--disable-batched-lora-patching", action="store_true", help="Merge the LoRA patches into the model weights one key at a time instead of batching the LoRA products of the weights with the same shapes.")
+parser.add_argument("--merged-weight-cache", type=float, default=0, help="RAM budget in GB for the merged weights of LoRA patched models, so loading the same model with the same patches again copies the merged weights back instead of merging the patches again. 0 (the default) disables it.")
+parser.add_argument("--merged-weight-cache-dir", type=str, default=None, help="Also store the merged weights of LoRA patched models in this directory as safetensors files, so they are reused across restarts.")
+parser.add_argument("--merged-weight-cache-disk-size", type=float, default=50.0, help="Disk budget in GB for --merged-weight-cache-dir.")
+parser.add_argument("--preview-cache-size", type=float, default=1.0, help="Size limit in GB of the image previews and thumbnails served by /view that are kept on disk (in the cache directory) between runs. 0 keeps them in RAM only.")
+parser.add_argument("--model-watch-interval", type=float, default=5.0, help="The model folders are indexed once in the background and kept up to date by watching them for changes (inotify on Linux). The folders that can't be watched (and every folder on other platforms) are polled every this many seconds. 0 disables the watcher, the folders are then checked for changes every time the model lists are requested.")
+parser.add_argument("--prefetch-models", type=int, default=2, metavar="PROMPTS", help="Read the model files used by the next PROMPTS queued prompts while the current prompt runs: into the --state-dict-cache (pinned) when it has room for them, into the OS page cache otherwise. 0 disables it.")
+parser.add_argument("--disable-model-hasher", action="store_true", help="Don't hash the model files in the background while the queue is idle. The hashes are used to share one loaded model between identical files with different names and are shown by /view_metadata and /experiment/models.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -138,6 +160,7 @@ parser.add_argument("--force-non-blocking", action="store_true", help="Force Com
 parser.add_argument("--default-hashing-function", type=str, choices=['md5', 'sha1', 'sha256', 'sha512'], default='sha256', help="Allows you to choose the hash function to use for duplicate filename / contents comparison. Default is sha256.")
 
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
+parser.add_argument("--model-eviction-policy", type=str, default="default", choices=["default", "lru", "lfu", "greedy-dual-size"], help="How the models to unload are picked when memory is needed. default: the most offloaded, least referenced and smallest first. lru: least recently used first. lfu: least frequently used first. greedy-dual-size: the ones with the lowest measured reload time per byte first, aging out the ones that aren't used again.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
 class PerformanceFeature(enum.Enum):
@@ -152,6 +175,8 @@ parser.add_argument("--disable-pinned-memory", action="store_true", help="Disabl
 
 parser.add_argument("--mmap-torch-files", action="store_true", help="Use mmap when loading ckpt/pt files.")
 parser.add_argument("--disable-mmap", action="store_true", help="Don't use mmap when loading safetensors.")
+parser.add_argument("--safetensors-loader", type=str, choices=["safe_open", "mmap", "parallel"], default="safe_open", help="How safetensors files are loaded. safe_open uses the safetensors library. mmap maps the file and returns tensors that are views of it (with --disable-mmap or a GPU target device it reads like parallel). parallel reads the whole file into memory with multiple threads, through pinned buffers when loading directly to a GPU.")
+parser.add_argument("--safetensors-load-threads", type=int, default=8, help="Number of threads used by the parallel safetensors loader.")
 
 parser.add_argument("--dont-print-server", action="store_true", help="Don't print server output.")
 parser.add_argument("--quick-test-for-ci", action="store_true", help="Quick test for CI.")
@@ -413,3 +413,57 @@ def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, ori
             weight = old_weight
 
     return weight
+
+BATCH_SCRATCH_MEMORY = 256 * 1024 * 1024
+
+def lora_patches_batchable(patches):
+    """True when all the patches are plain LoRAs (no mid, dora, reshape, offset or function) that calculate_weights_batched can merge."""
+    for p in patches:
+        v = p[1]
+        if type(v) is not weight_adapter.LoRAAdapter or p[2] != 1.0 or p[3] is not None or p[4] is not None:
+            return False
+        if v.weights[3] is not None or v.weights[4] is not None or v.weights[5] is not None:
+            return False
+    return True
+
+def calculate_weights_batched(weights, intermediate_dtype=torch.float32):
+    """
+    Same as calculate_weight on every {key: (patches, weight)} where the patches pass lora_patches_batchable.
+    The up @ down products of the patches with the same shapes are computed with one bmm per chunk of
+    BATCH_SCRATCH_MEMORY, into one scratch buffer per product shape, instead of one mm per key and patch.
+    The patches of each key are still added in order. The weights are updated in place and returned.
+    """
+    scratch = {}
+    depth = max((len(patches) for patches, _ in weights.values()), default=0)
+    for i in range(depth):
+        groups = {}
+        for key, (patches, weight) in weights.items():
+            if i >= len(patches) or patches[i][0] == 0.0:
+                continue
+            up, down, alpha = patches[i][1].weights[:3]
+            up = up.flatten(start_dim=1)
+            down = down.flatten(start_dim=1)
+            if up.shape[1] != down.shape[0] or up.shape[0] * down.shape[1] != weight.numel():
+                calculate_weight(patches[i:i + 1], weight, key, intermediate_dtype=intermediate_dtype)  # logs the error
+                continue
+            scale = patches[i][0] * (float(alpha) / down.shape[0] if alpha is not None else 1.0)
+            groups.setdefault((up.shape, down.shape, up.device, down.device, weight.device), []).append((weight, up, down, scale))
+
+        for (up_shape, down_shape, _, _, device), items in groups.items():
+            product_shape = (up_shape[0], down_shape[1])
+            chunk = max(1, min(len(items), BATCH_SCRATCH_MEMORY // (product_shape[0] * product_shape[1] * intermediate_dtype.itemsize)))
+            buffer = scratch.get((product_shape, device), None)
+            if buffer is None or buffer.shape[0] < chunk:
+                buffer = torch.empty((chunk,) + product_shape, dtype=intermediate_dtype, device=device)
+                scratch[(product_shape, device)] = buffer
+
+            for start in range(0, len(items), chunk):
+                part = items[start:start + chunk]
+                up = comfy.model_management.cast_to_device(torch.stack([x[1] for x in part]), device, intermediate_dtype)
+                down = comfy.model_management.cast_to_device(torch.stack([x[2] for x in part]), device, intermediate_dtype)
+                up = up * torch.tensor([x[3] for x in part], dtype=intermediate_dtype, device=device).view(-1, 1, 1)
+                diffs = torch.bmm(up, down, out=buffer[:len(part)])
+                for (weight, _, _, _), diff in zip(part, diffs):
+                    weight += diff.view(weight.shape).to(weight.dtype)
+
+    return {key: weight for key, (_, weight) in weights.items()}
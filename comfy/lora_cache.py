@@ -0,0 +1,88 @@
+"""
+Cache of parsed LoRA patch dicts shared by every LoRA loader node.
+
+The patch dict of a LoRA depends on the file and on the key map of the model it is
+applied to, entries are keyed by both: (path, size, mtime) of the file and a digest of
+the key map. Chained LoRA loaders sweeping through a small set of LoRAs only read and
+parse each file once.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+import comfy.lora
+import comfy.lora_convert
+import comfy.utils
+from comfy.cli_args import args
+
+
+def key_map_digest(key_map):
+    hasher = hashlib.sha256()
+    for k in sorted(key_map):
+        hasher.update("{}\0{}\0".format(k, key_map[k]).encode())
+    return hasher.digest()
+
+
+class LoraCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries: OrderedDict[tuple, tuple[dict, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.max_size > 0
+
+    def load_patches(self, lora_path, key_map):
+        """comfy.lora.load_lora on the file at lora_path, served from the cache when possible."""
+        stat = os.stat(lora_path)
+        key = (os.path.realpath(lora_path), stat.st_size, stat.st_mtime_ns, key_map_digest(key_map))
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+        lora = comfy.lora_convert.convert_lora(lora)
+        patches = comfy.lora.load_lora(lora, key_map)
+        size = sum(v.nbytes for v in lora.values() if isinstance(v, torch.Tensor))
+        logging.debug("lora cache miss {} ({:.1f} MB)".format(lora_path, size / (1024 ** 2)))
+
+        if size <= self.max_size:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = (patches, size)
+                    self.size += size
+                while self.size > self.max_size:
+                    _, (_, old_size) = self.entries.popitem(last=False)
+                    self.size -= old_size
+        return patches
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
+
+
+cache = LoraCache(int(args.lora_cache * (1024 ** 3)))
@@ -0,0 +1,242 @@
+"""
+Store of the merged weights of patched models.
+
+When a patched model is loaded again after being unloaded, ModelPatcher.load merges all its
+patches into the weights again. With this store enabled the merged weights of a model are kept
+after the first load, in RAM and/or as a safetensors file on disk, and copied straight back on
+the next loads.
+
+An entry holds the final (rounded) value of every patched weight of a model. It is keyed by the
+source of the base weights, set by the loaders with set_weight_source (the content hash of the
+files from comfy.model_hash when it is known), and by the ordered list of
+patches of each key with their strengths. Patches are identified by a hash of their tensors, so
+the same LoRA file at the same strength maps to the same entry across restarts. Models without a
+known source and patches that can't be identified (model merges, patch functions) are not stored.
+"""
+import hashlib
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import safetensors.torch
+import torch
+
+import comfy.model_hash
+import comfy.utils
+import comfy.weight_adapter
+from comfy.cli_args import args
+
+
+def file_fingerprint(path, *params):
+    return hashlib.sha256(repr(comfy.model_hash.index.identity(path) + params).encode()).hexdigest()
+
+
+def set_weight_source(model, *paths, model_options={}):
+    """Records the files the base weights of model (a ModelPatcher or anything with a .patcher) were loaded from."""
+    patcher = getattr(model, "patcher", model)
+    if patcher is None:
+        return
+    try:
+        sources = [file_fingerprint(path) for path in paths]
+    except OSError:
+        return
+    options = sorted((k, str(v)) for k, v in model_options.items())
+    patcher.model.weight_source = hashlib.sha256(repr((type(patcher.model).__name__, sources, options)).encode()).hexdigest()
+
+
+def tensor_bytes(tensor):
+    return tensor.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+class MergedWeightCache:
+    def __init__(self, max_size, directory=None, disk_size=0):
+        self.max_size = max_size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.entries: OrderedDict[str, tuple[dict[str, torch.Tensor], int]] = OrderedDict()
+        self.size = 0
+        self.disk_index: OrderedDict[str, int] | None = None
+        self.disk_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.patch_fingerprints = weakref.WeakKeyDictionary()
+        self.lock = threading.RLock()
+        self.writer = None
+
+    def enabled(self):
+        return self.max_size > 0 or (self.directory is not None and self.disk_size > 0)
+
+    def patch_fingerprint(self, v):
+        if not isinstance(v, comfy.weight_adapter.WeightAdapterBase) or isinstance(v, torch.nn.Module):
+            return None
+        fingerprint = self.patch_fingerprints.get(v, None)
+        if fingerprint is None:
+            hasher = hashlib.sha256(type(v).__name__.encode())
+            for w in v.weights:
+                if isinstance(w, torch.Tensor):
+                    hasher.update("{} {}".format(w.dtype, tuple(w.shape)).encode())
+                    hasher.update(tensor_bytes(w))
+                else:
+                    hasher.update(repr(w).encode())
+            fingerprint = hasher.hexdigest()
+            self.patch_fingerprints[v] = fingerprint
+        return fingerprint
+
+    def patches_fingerprint(self, source, patches):
+        hasher = hashlib.sha256(source.encode())
+        for k in sorted(patches):
+            hasher.update(k.encode())
+            for p in patches[k]:
+                strength, v, strength_model, offset, function = p[:5]
+                fingerprint = self.patch_fingerprint(v)
+                if fingerprint is None or function is not None:
+                    return None
+                hasher.update(repr((fingerprint, float(strength), float(strength_model), offset)).encode())
+        return hasher.hexdigest()
+
+    def weights_key(self, patcher):
+        """The key of the merged weights of the patches of patcher, None when they can't be stored."""
+        source = getattr(patcher.model, "weight_source", None)
+        if source is None or len(patcher.patches) == 0:
+            return None
+        cached = getattr(patcher, "merged_weights_key", None)
+        if cached is not None and cached[0] == patcher.patches_uuid:
+            return cached[1]
+
+        key = self.patches_fingerprint(source, patcher.patches)
+        patcher.merged_weights_key = (patcher.patches_uuid, key)
+        return key
+
+    def get(self, key):
+        """{weight key: merged weight} or None."""
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            path = self.disk_path(key)
+            if path is None:
+                self.misses += 1
+                return None
+            self.disk_index.move_to_end(key)
+
+        try:
+            weights = comfy.utils.load_torch_file(path, safe_load=True)
+            os.utime(path)
+        except Exception as e:
+            logging.warning("Failed to read merged weights {}: {}".format(path, e))
+            with self.lock:
+                self.misses += 1
+                self.disk_used -= self.disk_index.pop(key, 0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        with self.lock:
+            self.hits += 1
+        self.put_ram(key, weights)
+        return weights
+
+    def fits(self, size):
+        """Whether merged weights of size bytes would be kept, in RAM or on disk."""
+        return size <= self.max_size or (self.directory is not None and size <= self.disk_size)
+
+    def put(self, key, weights):
+        self.put_ram(key, weights)
+        if self.directory is not None and self.disk_size > 0:
+            if self.writer is None:
+                self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MergedWeightWriter")
+            self.writer.submit(self.put_disk, key, weights)
+
+    def put_ram(self, key, weights):
+        size = sum(w.nbytes for w in weights.values())
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (weights, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+
+    def load_disk_index(self):
+        if self.disk_index is not None:
+            return
+        self.disk_index = OrderedDict()
+        files = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".safetensors"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name[:-len(".safetensors")], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk_index[key] = size
+            self.disk_used += size
+        self.evict_disk(self.disk_size)
+
+    def evict_disk(self, size):
+        while self.disk_used > size and len(self.disk_index) > 0:
+            key, file_size = self.disk_index.popitem(last=False)
+            self.disk_used -= file_size
+            try:
+                os.remove(os.path.join(self.directory, key + ".safetensors"))
+            except OSError:
+                pass
+
+    def disk_path(self, key):
+        if self.directory is None or self.disk_size <= 0:
+            return None
+        self.load_disk_index()
+        if key not in self.disk_index:
+            return None
+        return os.path.join(self.directory, key + ".safetensors")
+
+    def put_disk(self, key, weights):
+        size = sum(w.nbytes for w in weights.values())
+        with self.lock:
+            self.load_disk_index()
+            if key in self.disk_index or size > self.disk_size:
+                return
+            self.evict_disk(self.disk_size - size)
+        path = os.path.join(self.directory, key + ".safetensors")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            safetensors.torch.save_file(weights, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logging.warning("Failed to write merged weights {}: {}".format(path, e))
+            return
+        with self.lock:
+            self.disk_index[key] = os.path.getsize(path)
+            self.disk_used += self.disk_index[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "disk_entries": len(self.disk_index) if self.disk_index is not None else 0,
+                "disk_size": self.disk_used,
+                "max_disk_size": self.disk_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            }
+
+
+cache = MergedWeightCache(int(args.merged_weight_cache * (1024 ** 3)), args.merged_weight_cache_dir, int(args.merged_weight_cache_disk_size * (1024 ** 3)))
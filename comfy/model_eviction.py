@@ -0,0 +1,161 @@
+"""
+Eviction policies used by model_management.free_memory to pick the models unloaded first.
+
+Every model gets statistics that outlive its LoadedModel: size, last use, number of uses and
+the measured time it takes to load it back (weight transfer plus LoRA patching, scaled to the
+full model when it was only partially loaded). The policy turns them into a sort key, the model
+with the lowest key is unloaded first:
+
+- default: the models with the most memory already offloaded first, then the least referenced
+  ones, then the smallest ones (the original behavior).
+- lru: the model used the longest time ago first.
+- lfu: the model used the least often first, ties broken by last use.
+- greedy-dual-size: every use sets the priority of a model to L + reload cost / size, the
+  model with the lowest priority goes first and L becomes its priority. Models that are cheap
+  to bring back per byte go before expensive ones and models that aren't used again age out.
+
+The last decisions are kept with the statistics the choice was based on, see summary().
+"""
+import logging
+import sys
+import time
+import weakref
+from collections import deque
+
+DECISION_LOG_SIZE = 64
+# Used as the reload speed of models that were never timed
+DEFAULT_LOAD_BANDWIDTH = 4 * 1024 ** 3
+# Loads smaller than this are too short to time reliably
+MIN_TIMED_LOAD = 16 * 1024 * 1024
+
+
+class ModelStats:
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+        self.uses = 0
+        self.last_use = 0.0
+        self.reload_time = None
+        self.priority = 0.0
+
+    def reload_cost(self):
+        if self.reload_time is not None:
+            return self.reload_time
+        return self.size / DEFAULT_LOAD_BANDWIDTH
+
+    def as_dict(self, now):
+        return {
+            "model": self.name,
+            "size": self.size,
+            "uses": self.uses,
+            "last_use_age": now - self.last_use if self.uses > 0 else None,
+            "reload_time": self.reload_time,
+        }
+
+
+class EvictionPolicy:
+    name = "default"
+
+    def __init__(self):
+        self.stats = weakref.WeakKeyDictionary()
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+
+    def model_stats(self, loaded_model):
+        # The torch module is shared by the clones of a ModelPatcher so they share their statistics
+        module = loaded_model.model.model
+        stats = self.stats.get(module, None)
+        if stats is None:
+            stats = ModelStats(module.__class__.__name__)
+            self.stats[module] = stats
+        stats.size = loaded_model.model_memory()
+        return stats
+
+    def record_use(self, loaded_model):
+        stats = self.model_stats(loaded_model)
+        stats.uses += 1
+        stats.last_use = time.monotonic()
+        self.on_use(stats)
+
+    def record_load(self, loaded_model, duration, loaded_bytes):
+        if loaded_bytes < MIN_TIMED_LOAD:
+            return
+        stats = self.model_stats(loaded_model)
+        reload_time = duration * stats.size / loaded_bytes
+        if stats.reload_time is None:
+            stats.reload_time = reload_time
+        else:
+            stats.reload_time = 0.5 * (stats.reload_time + reload_time)
+        self.on_use(stats)
+
+    def record_unload(self, loaded_model, device, memory_required, freed, unloaded):
+        stats = self.model_stats(loaded_model)
+        self.on_evict(stats)
+        decision = {
+            "time": time.time(),
+            "policy": self.name,
+            "device": str(device),
+            "memory_required": memory_required,
+            "freed": freed,
+            "unloaded": unloaded,
+        }
+        decision.update(stats.as_dict(time.monotonic()))
+        self.decisions.append(decision)
+        logging.debug("{} unloading {}: {:.1f} MB freed, reload {:.2f}s, {} uses".format(self.name, stats.name, freed / (1024 * 1024), stats.reload_cost(), stats.uses))
+
+    def on_use(self, stats):
+        pass
+
+    def on_evict(self, stats):
+        pass
+
+    def sort_key(self, loaded_model):
+        """The models with the lowest keys are unloaded first."""
+        return (-loaded_model.model_offloaded_memory(), sys.getrefcount(loaded_model.model), loaded_model.model_memory())
+
+    def summary(self):
+        now = time.monotonic()
+        return {
+            "policy": self.name,
+            "models": [stats.as_dict(now) for stats in list(self.stats.values())],
+            "decisions": list(self.decisions),
+        }
+
+
+class LRUPolicy(EvictionPolicy):
+    name = "lru"
+
+    def sort_key(self, loaded_model):
+        return (self.model_stats(loaded_model).last_use,)
+
+
+class LFUPolicy(EvictionPolicy):
+    name = "lfu"
+
+    def sort_key(self, loaded_model):
+        stats = self.model_stats(loaded_model)
+        return (stats.uses, stats.last_use)
+
+
+class GreedyDualSizePolicy(EvictionPolicy):
+    name = "greedy-dual-size"
+
+    def __init__(self):
+        super().__init__()
+        self.inflation = 0.0
+
+    def on_use(self, stats):
+        stats.priority = self.inflation + stats.reload_cost() / max(stats.size, 1)
+
+    def on_evict(self, stats):
+        self.inflation = max(self.inflation, stats.priority)
+
+    def sort_key(self, loaded_model):
+        stats = self.model_stats(loaded_model)
+        return (stats.priority, stats.last_use)
+
+
+POLICIES = {policy.name: policy for policy in (EvictionPolicy, LRUPolicy, LFUPolicy, GreedyDualSizePolicy)}
+
+
+def create_policy(name):
+    return POLICIES[name]()
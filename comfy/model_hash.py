@@ -0,0 +1,307 @@
+"""
+Content identity of the model files.
+
+Every model file gets two hashes, stored in a sidecar index (model_hashes.json in the cache
+directory) so they are computed once per file version (path, size and mtime):
+
+- fingerprint: sha256 of the size and of SAMPLE_COUNT blocks spread over the file. It only
+  reads a few MB so it is computed on demand, files with different fingerprints are different.
+- sha256: the hash of the whole file, computed by the ModelHasher thread while no prompt runs.
+  Files that are loaded and files whose fingerprint matches another file are hashed first.
+
+Two files are only treated as the same weights when their full hashes are known and equal.
+SharedModels uses that to hand out the models already built from a copy of a file (the same
+file in checkpoints/ and diffusion_models/, or in an extra_model_paths.yaml folder) instead of
+loading it again as a separate model.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+import folder_paths
+
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+HASH_CHUNK = 16 * 1024 * 1024
+
+
+def sample_fingerprint(path, size):
+    hasher = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= SAMPLE_COUNT * SAMPLE_SIZE:
+            hasher.update(f.read())
+        else:
+            for i in range(SAMPLE_COUNT):
+                f.seek(i * (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1))
+                hasher.update(f.read(SAMPLE_SIZE))
+    return hasher.hexdigest()
+
+
+class HashIndex:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.dirty = False
+        self.version = 0
+        self.requested: dict[str, None] = {}
+        self.wakeup = threading.Event()
+
+    def set_path(self, path):
+        with self.lock:
+            self.path = path
+            self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Failed to read the model hash index {}: {}".format(self.path, e))
+            return
+        for key, entry in entries.items():
+            self.entries.setdefault(key, entry)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty or self.path is None:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logging.warning("Failed to write the model hash index {}: {}".format(self.path, e))
+
+    def lookup(self, path, stat=None):
+        """The index entry of the current version of the file, None when it wasn't hashed yet. Only stats the file."""
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        with self.lock:
+            self.load()
+            entry = self.entries.get(os.path.realpath(path), None)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                return None
+            return entry
+
+    def entry(self, path):
+        """The index entry of the file, its fingerprint is computed if needed."""
+        entry = self.lookup(path)
+        if entry is not None:
+            return entry
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "fingerprint": sample_fingerprint(path, stat.st_size), "sha256": None}
+        with self.lock:
+            self.entries[os.path.realpath(path)] = entry
+            self.dirty = True
+            self.version += 1
+        return entry
+
+    def fingerprint(self, path):
+        return self.entry(path)["fingerprint"]
+
+    def sha256(self, path):
+        """The full hash of the file if it is known."""
+        entry = self.lookup(path)
+        return entry["sha256"] if entry is not None else None
+
+    def compute_sha256(self, path, pause=None):
+        """Hashes the whole file, pause() is called between chunks and can block while the system is busy."""
+        entry = self.entry(path)
+        if entry["sha256"] is not None:
+            return entry["sha256"]
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                if pause is not None:
+                    pause()
+                data = f.read(HASH_CHUNK)
+                if not data:
+                    break
+                hasher.update(data)
+        stat = os.stat(path)
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return None  # Changed while it was hashed
+        with self.lock:
+            entry["sha256"] = hasher.hexdigest()
+            self.dirty = True
+            self.version += 1
+        return entry["sha256"]
+
+    def identity(self, path):
+        """The full hash of the file when known, its path and version otherwise."""
+        sha256 = self.sha256(path)
+        if sha256 is not None:
+            return ("sha256", sha256)
+        stat = os.stat(path)
+        return ("file", os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+    def request(self, path):
+        """Hashes this file before the others."""
+        with self.lock:
+            self.requested[os.path.realpath(path)] = None
+        self.wakeup.set()
+
+
+index = HashIndex()
+
+
+def model_files():
+    """All the files in the model folders."""
+    out = []
+    for folder_name, (_, extensions) in list(folder_paths.folder_names_and_paths.items()):
+        if ".safetensors" not in extensions:
+            continue
+        for name in folder_paths.get_filename_list(folder_name):
+            path = folder_paths.get_full_path(folder_name, name)
+            if path is not None:
+                out.append(path)
+    return out
+
+
+class ModelHasher(threading.Thread):
+    """Computes the fingerprints and the full hashes of the model files in the background while is_busy() is False."""
+    def __init__(self, hash_index, is_busy=None, idle_delay=2.0):
+        super().__init__(daemon=True, name="ModelHasher")
+        self.index = hash_index
+        self.is_busy = is_busy if is_busy is not None else (lambda: False)
+        self.idle_delay = idle_delay
+
+    def wait_idle(self):
+        while self.is_busy():
+            time.sleep(self.idle_delay)
+
+    def pending(self):
+        """The files without a full hash, requested ones first then the ones that may be duplicates."""
+        with self.index.lock:
+            requested = list(self.index.requested)
+            self.index.requested.clear()
+        files = {}
+        for path in requested + model_files():
+            files.setdefault(os.path.realpath(path), None)
+
+        fingerprints = {}
+        out = []
+        for path in files:
+            self.wait_idle()
+            try:
+                entry = self.index.entry(path)
+            except OSError:
+                continue
+            fingerprints.setdefault(entry["fingerprint"], []).append(path)
+            if entry["sha256"] is None:
+                out.append(path)
+        first = set(os.path.realpath(p) for p in requested)
+        first.update(p for paths in fingerprints.values() if len(paths) > 1 for p in paths)
+        return [p for p in out if p in first] + [p for p in out if p not in first]
+
+    def hash_all(self):
+        for path in self.pending():
+            with self.index.lock:
+                if len(self.index.requested) > 0:
+                    return  # Start over with the requested files
+            try:
+                if self.index.compute_sha256(path, pause=self.wait_idle) is not None:
+                    logging.debug("hashed {}".format(path))
+            except OSError as e:
+                logging.debug("Failed to hash {}: {}".format(path, e))
+            self.index.save()
+        self.index.save()
+
+    def run(self):
+        while True:
+            self.index.wakeup.clear()
+            try:
+                self.hash_all()
+            except Exception as e:
+                logging.warning("Model hasher error: {}".format(e))
+            self.index.wakeup.wait(timeout=60.0)
+
+
+def start_model_hasher(is_busy=None):
+    hasher = ModelHasher(index, is_busy)
+    hasher.start()
+    return hasher
+
+
+class SharedModels:
+    """
+    The objects built by the loaders from model files, weakly referenced. get returns the ones
+    built from the same files (same path and version, or same content) with the same options
+    while they are all alive. Entries built from a file that changed since are dropped.
+    """
+    def __init__(self, hash_index):
+        self.index = hash_index
+        self.entries: list[tuple[str, tuple, object, list]] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def version(path):
+        """(realpath, size, mtime) of the file, None if it can't be read."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+    def same_file(self, entry_version, version):
+        if entry_version == version:
+            return True
+        sha256 = self.index.sha256(entry_version[0])
+        return sha256 is not None and sha256 == self.index.sha256(version[0])
+
+    @staticmethod
+    def resolve(refs):
+        objects = [r() if r is not None else None for r in refs]
+        if any(r is not None and o is None for r, o in zip(refs, objects)):
+            return None
+        return objects
+
+    def current(self, entry):
+        """The entry is alive and its files weren't changed since it was added."""
+        return self.resolve(entry[3]) is not None and all(self.version(v[0]) == v for v in entry[1])
+
+    def get(self, kind, paths, options):
+        versions = [self.version(path) for path in paths]
+        if any(v is None for v in versions):
+            return None
+        with self.lock:
+            self.entries = [e for e in self.entries if self.current(e)]
+            for entry_kind, entry_versions, entry_options, refs in self.entries:
+                if entry_kind != kind or entry_options != options or len(entry_versions) != len(versions):
+                    continue
+                if all(self.same_file(a, b) for a, b in zip(entry_versions, versions)):
+                    objects = self.resolve(refs)
+                    if objects is not None:
+                        return objects
+        return None
+
+    def add(self, kind, paths, options, objects):
+        for path in paths:
+            self.index.request(path)
+        if all(o is None for o in objects):
+            return
+        versions = tuple(self.version(path) for path in paths)
+        if any(v is None for v in versions):
+            return
+        with self.lock:
+            self.entries.append((kind, versions, options, [weakref.ref(o) if o is not None else None for o in objects]))
+
+
+shared_models = SharedModels(index)
@@ -21,11 +21,14 @@ import logging
 from enum import Enum
 from comfy.cli_args import args, PerformanceFeature
 import torch
-import sys
 import importlib
 import platform
 import weakref
 import gc
+import threading
+import functools
+import time
+import comfy.model_eviction
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -167,6 +170,19 @@ def is_ixuca():
         return True
     return False
 
+def set_torch_device(device_id):
+    """Makes get_torch_device() return device_id in the calling thread, used to run prompt workers on different devices."""
+    if directml_enabled or cpu_state != CPUState.GPU:
+        return
+    if is_intel_xpu():
+        torch.xpu.set_device(device_id)
+    elif is_ascend_npu():
+        torch.npu.set_device(device_id)
+    elif is_mlu():
+        torch.mlu.set_device(device_id)
+    else:
+        torch.cuda.set_device(device_id)
+
 def get_torch_device():
     global directml_enabled
     global cpu_state
@@ -416,6 +432,8 @@ logging.info(f"Set vram state to: {vram_state.name}")
 
 DISABLE_SMART_MEMORY = args.disable_smart_memory
 
+eviction_policy = comfy.model_eviction.create_policy(args.model_eviction_policy)
+
 if DISABLE_SMART_MEMORY:
     logging.info("Disabling smart memory management")
 
@@ -577,6 +595,17 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
+# The list of loaded models is shared by all the prompt workers
+model_load_mutex = threading.RLock()
+
+def with_model_load_mutex(function):
+    @functools.wraps(function)
+    def wrapper(*function_args, **function_kwargs):
+        with model_load_mutex:
+            return function(*function_args, **function_kwargs)
+    return wrapper
+
+@with_model_load_mutex
 def free_memory(memory_required, device, keep_loaded=[]):
     cleanup_models_gc()
     unloaded_model = []
@@ -587,7 +616,7 @@ def free_memory(memory_required, device, keep_loaded=[]):
         shift_model = current_loaded_models[i]
         if shift_model.device == device:
             if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
+                can_unload.append((eviction_policy.sort_key(shift_model), i))
                 shift_model.currently_used = False
 
     for x in sorted(can_unload):
@@ -598,8 +627,12 @@ def free_memory(memory_required, device, keep_loaded=[]):
             if free_mem > memory_required:
                 break
             memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
+        shift_model = current_loaded_models[i]
+        logging.debug(f"Unloading {shift_model.model.model.__class__.__name__}")
+        loaded_memory = shift_model.model_loaded_memory()
+        unloaded = shift_model.model_unload(memory_to_free)
+        eviction_policy.record_unload(shift_model, device, memory_required, loaded_memory - shift_model.model_loaded_memory(), unloaded)
+        if unloaded:
             unloaded_model.append(i)
 
     for i in sorted(unloaded_model, reverse=True):
@@ -614,6 +647,7 @@ def free_memory(memory_required, device, keep_loaded=[]):
                 soft_empty_cache()
     return unloaded_models
 
+@with_model_load_mutex
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
     cleanup_models_gc()
     global vram_state
@@ -651,6 +685,9 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
                 logging.info(f"Requested to load {x.model.__class__.__name__}")
             models_to_load.append(loaded_model)
 
+    for loaded_model in models_to_load:
+        eviction_policy.record_use(loaded_model)
+
     for loaded_model in models_to_load:
         to_unload = []
         for i in range(len(current_loaded_models)):
@@ -694,7 +731,10 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
         if vram_set_state == VRAMState.NO_VRAM:
             lowvram_model_memory = 0.1
 
+        loaded_memory = loaded_model.model_loaded_memory()
+        load_start = time.perf_counter()
         loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+        eviction_policy.record_load(loaded_model, time.perf_counter() - load_start, loaded_model.model_loaded_memory() - loaded_memory)
         current_loaded_models.insert(0, loaded_model)
     return
 
@@ -732,6 +772,7 @@ def cleanup_models_gc():
 
 
 
+@with_model_load_mutex
 def cleanup_models():
     to_delete = []
     for i in range(len(current_loaded_models)):
@@ -1086,6 +1127,8 @@ def cast_to_device(tensor, device, dtype, copy=False):
 PINNED_MEMORY = {}
 TOTAL_PINNED_MEMORY = 0
 MAX_PINNED_MEMORY = -1
+# Weights are pinned by the prompt workers and by the state dict prefetch thread
+pinned_memory_mutex = threading.Lock()
 if not args.disable_pinned_memory:
     if is_nvidia() or is_amd():
         if WINDOWS:
@@ -1104,14 +1147,15 @@ def pin_memory(tensor):
         return False
 
     size = tensor.numel() * tensor.element_size()
-    if (TOTAL_PINNED_MEMORY + size) > MAX_PINNED_MEMORY:
-        return False
+    with pinned_memory_mutex:
+        if (TOTAL_PINNED_MEMORY + size) > MAX_PINNED_MEMORY:
+            return False
 
-    ptr = tensor.data_ptr()
-    if torch.cuda.cudart().cudaHostRegister(ptr, size, 1) == 0:
-        PINNED_MEMORY[ptr] = size
-        TOTAL_PINNED_MEMORY += size
-        return True
+        ptr = tensor.data_ptr()
+        if torch.cuda.cudart().cudaHostRegister(ptr, size, 1) == 0:
+            PINNED_MEMORY[ptr] = size
+            TOTAL_PINNED_MEMORY += size
+            return True
 
     return False
 
@@ -1124,11 +1168,12 @@ def unpin_memory(tensor):
         return False
 
     ptr = tensor.data_ptr()
-    if torch.cuda.cudart().cudaHostUnregister(ptr) == 0:
-        TOTAL_PINNED_MEMORY -= PINNED_MEMORY.pop(ptr)
-        if len(PINNED_MEMORY) == 0:
-            TOTAL_PINNED_MEMORY = 0
-        return True
+    with pinned_memory_mutex:
+        if torch.cuda.cudart().cudaHostUnregister(ptr) == 0:
+            TOTAL_PINNED_MEMORY -= PINNED_MEMORY.pop(ptr)
+            if len(PINNED_MEMORY) == 0:
+                TOTAL_PINNED_MEMORY = 0
+            return True
 
     return False
 
@@ -1457,30 +1502,41 @@ def unload_all_models():
 
 
 #TODO: might be cleaner to put this somewhere else
-import threading
-
 class InterruptProcessingException(Exception):
     pass
 
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
-def interrupt_current_processing(value=True):
+# Idents of the prompt worker threads asked to stop their current prompt
+interrupted_threads = set()
+def interrupt_current_processing(value=True, thread_id=None):
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        if thread_id is not None:
+            if value:
+                interrupted_threads.add(thread_id)
+            else:
+                interrupted_threads.discard(thread_id)
+            return
         interrupt_processing = value
+        if not value:
+            interrupted_threads.discard(threading.get_ident())
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        return interrupt_processing
+        return interrupt_processing or threading.get_ident() in interrupted_threads
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        if threading.get_ident() in interrupted_threads:
+            interrupted_threads.discard(threading.get_ident())
+            raise InterruptProcessingException()
         if interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
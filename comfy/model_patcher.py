@@ -23,6 +23,7 @@ import copy
 import inspect
 import logging
 import math
+import time
 import uuid
 from typing import Callable, Optional
 
@@ -31,12 +32,16 @@ import torch
 import comfy.float
 import comfy.hooks
 import comfy.lora
+import comfy.merged_weight_cache
 import comfy.model_management
 import comfy.patcher_extension
 import comfy.utils
+from comfy.cli_args import args
 from comfy.comfy_types import UnetWrapperFunction
 from comfy.patcher_extension import CallbacksMP, PatcherInjection, WrappersMP
 
+WEIGHT_PATCH_BATCH_MEMORY = 256 * 1024 * 1024
+
 
 def string_to_seed(data):
     crc = 0xFFFFFFFF
@@ -267,6 +272,9 @@ class ModelPatcher:
         if not hasattr(self.model, 'model_lowvram'):
             self.model.model_lowvram = False
 
+        if not hasattr(self.model, 'weight_patch_time'):
+            self.model.weight_patch_time = 0.0
+
         if not hasattr(self.model, 'current_weight_patches_uuid'):
             self.model.current_weight_patches_uuid = None
 
@@ -609,15 +617,14 @@ class ModelPatcher:
                         sd.pop(k)
             return sd
 
-    def patch_weight_to_device(self, key, device_to=None, inplace_update=False):
-        if key not in self.patches:
-            return
+    def _backup_weight(self, key, weight, inplace_update):
+        if key not in self.backup:
+            self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
+    def _cast_patch_weight(self, key, device_to=None, inplace_update=False):
         weight, set_func, convert_func = get_key_weight(self.model, key)
         inplace_update = self.weight_inplace_update or inplace_update
-
-        if key not in self.backup:
-            self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
+        self._backup_weight(key, weight, inplace_update)
 
         if device_to is not None:
             temp_weight = comfy.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
@@ -625,16 +632,92 @@ class ModelPatcher:
             temp_weight = weight.to(torch.float32, copy=True)
         if convert_func is not None:
             temp_weight = convert_func(temp_weight, inplace=True)
+        return weight, temp_weight, set_func, inplace_update
 
-        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+    def _set_patched_weight(self, key, weight, out_weight, set_func, inplace_update):
+        """Returns the new value of the weight, None when it was set by the set_func of the layer."""
         if set_func is None:
             out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
             if inplace_update:
                 comfy.utils.copy_to_param(self.model, key, out_weight)
             else:
                 comfy.utils.set_attr_param(self.model, key, out_weight)
+            return out_weight
         else:
             set_func(out_weight, inplace_update=inplace_update, seed=string_to_seed(key))
+            return None
+
+    def _restore_merged_weight(self, key, merged_weight, device_to=None):
+        weight, set_func, convert_func = get_key_weight(self.model, key)
+        if set_func is not None or merged_weight.dtype != weight.dtype or merged_weight.shape != weight.shape:
+            return False
+        inplace_update = self.weight_inplace_update
+        self._backup_weight(key, weight, inplace_update)
+        out_weight = merged_weight.to(device=device_to if device_to is not None else weight.device, copy=True)
+        if inplace_update:
+            comfy.utils.copy_to_param(self.model, key, out_weight)
+        else:
+            comfy.utils.set_attr_param(self.model, key, out_weight)
+        return True
+
+    def patch_weight_to_device(self, key, device_to=None, inplace_update=False):
+        if key not in self.patches:
+            return
+
+        weight, temp_weight, set_func, inplace_update = self._cast_patch_weight(key, device_to, inplace_update)
+        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+        self._set_patched_weight(key, weight, out_weight, set_func, inplace_update)
+
+    def patch_weights_to_device(self, keys, device_to=None, merged_weights=None, collect=None):
+        """
+        patch_weight_to_device for many keys. Keys with only plain LoRA patches are merged together with
+        comfy.lora.calculate_weights_batched, WEIGHT_PATCH_BATCH_MEMORY of upcasted weights at a time.
+        Keys found in merged_weights (from comfy.merged_weight_cache) are copied from there instead, the
+        merged weights are added to the collect dict (on the offload device) when it is given.
+        Returns the number of keys that were patched.
+        """
+        pending = {}
+        pending_size = 0
+        patched = 0
+
+        def store(k, out_weight):
+            if collect is not None and out_weight is not None:
+                collect[k] = out_weight.to(self.offload_device, copy=True)
+
+        def flush():
+            if len(pending) == 0:
+                return
+            out_weights = comfy.lora.calculate_weights_batched({k: (self.patches[k], v[1]) for k, v in pending.items()})
+            for k, (weight, _, set_func, inplace_update) in pending.items():
+                store(k, self._set_patched_weight(k, weight, out_weights[k], set_func, inplace_update))
+            pending.clear()
+
+        for key in keys:
+            if key not in self.patches:
+                continue
+            patched += 1
+            if merged_weights is not None and key in merged_weights and self._restore_merged_weight(key, merged_weights[key], device_to):
+                continue
+            if args.disable_batched_lora_patching or not comfy.lora.lora_patches_batchable(self.patches[key]):
+                weight, temp_weight, set_func, inplace_update = self._cast_patch_weight(key, device_to)
+                out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+                store(key, self._set_patched_weight(key, weight, out_weight, set_func, inplace_update))
+                continue
+
+            pending[key] = self._cast_patch_weight(key, device_to)
+            pending_size += pending[key][1].nbytes
+            if pending_size >= WEIGHT_PATCH_BATCH_MEMORY:
+                flush()
+                pending_size = 0
+        flush()
+        return patched
+
+    def patched_weights_size(self):
+        size = 0
+        for key in self.patches:
+            weight, set_func, convert_func = get_key_weight(self.model, key)
+            size += weight.nbytes
+        return size
 
     def pin_weight_to_device(self, key):
         weight, set_func, convert_func = get_key_weight(self.model, key)
@@ -741,6 +824,8 @@ class ModelPatcher:
                 mem_counter += move_weight_functions(m, device_to)
 
             load_completely.sort(reverse=True)
+            patch_keys = []
+            patch_modules = []
             for x in load_completely:
                 n = x[1]
                 m = x[2]
@@ -752,8 +837,29 @@ class ModelPatcher:
                 for param in params:
                     key = "{}.{}".format(n, param)
                     self.unpin_weight(key)
-                    self.patch_weight_to_device(key, device_to=device_to)
-
+                    patch_keys.append(key)
+                patch_modules.append((n, m))
+
+            patch_start = time.perf_counter()
+            merged_weights = None
+            collect = None
+            merged_key = comfy.merged_weight_cache.cache.weights_key(self) if len(patch_keys) > 0 and comfy.merged_weight_cache.cache.enabled() else None
+            if merged_key is not None:
+                merged_weights = comfy.merged_weight_cache.cache.get(merged_key)
+                # Don't copy the merged weights to the offload device when the cache won't keep them
+                if merged_weights is None and comfy.merged_weight_cache.cache.fits(self.patched_weights_size()):
+                    collect = {}
+            patched = self.patch_weights_to_device(patch_keys, device_to=device_to, merged_weights=merged_weights, collect=collect)
+            if collect is not None and len(collect) == len(self.patches):
+                comfy.merged_weight_cache.cache.put(merged_key, collect)
+            if patched > 0:
+                if device_to is not None and device_to.type == "cuda":
+                    torch.cuda.synchronize(device_to)
+                patch_time = time.perf_counter() - patch_start
+                self.model.weight_patch_time += patch_time
+                logging.info("patched {} weights of {} in {:.2f} seconds{}".format(patched, self.model.__class__.__name__, patch_time, " (merged weights from the cache)" if merged_weights is not None else ""))
+
+            for n, m in patch_modules:
                 logging.debug("lowvram: loaded module regularly {} {}".format(n, m))
                 m.comfy_patched_weights = True
 
@@ -826,6 +932,7 @@ class ModelPatcher:
                     comfy.utils.set_attr_param(self.model, k, bk.weight)
 
             self.model.current_weight_patches_uuid = None
+            self.model.weight_patch_time = 0.0
             self.backup.clear()
 
             if device_to is not None:
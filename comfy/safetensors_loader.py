@@ -0,0 +1,166 @@
+"""
+Safetensors loaders that don't go through safetensors.safe_open.
+
+load_mmap maps the file once and returns tensors that are views of the mapping, nothing is
+read until the weights are used. load_parallel reads the data with a pool of threads in
+chunks, which is what it takes to use the bandwidth of fast NVMe drives. When the target
+device is a CUDA GPU the chunks are read into pinned staging buffers and uploaded from there,
+other devices get the tensors read on the CPU and moved with .to(device).
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import comfy.model_management
+
+MAX_HEADER_SIZE = 100 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024 * 1024
+
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+for name, attr in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2"), ("F8_E8M0", "float8_e8m0fnu"), ("U16", "uint16"), ("U32", "uint32"), ("U64", "uint64")):
+    if hasattr(torch, attr):
+        DTYPES[name] = getattr(torch, attr)
+
+
+def read_header(path: str) -> tuple[dict, dict | None, int]:
+    """Returns ({key: (dtype, shape, begin, end)}, metadata, size of the file)."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        start = f.read(8)
+        if len(start) < 8:
+            raise ValueError("HeaderTooSmall")
+        header_size = struct.unpack("<Q", start)[0]
+        if header_size > MAX_HEADER_SIZE:
+            raise ValueError("HeaderTooLarge")
+        if 8 + header_size > file_size:
+            raise ValueError("InvalidHeaderLength")
+        header = json.loads(f.read(header_size))
+
+    data_start = 8 + header_size
+    metadata = header.pop("__metadata__", None)
+    tensors = {}
+    for key, info in header.items():
+        dtype = DTYPES.get(info["dtype"], None)
+        if dtype is None:
+            raise ValueError("Unsupported dtype {} for tensor {}".format(info["dtype"], key))
+        begin, end = info["data_offsets"]
+        if data_start + end > file_size:
+            raise ValueError("MetadataIncompleteBuffer")
+        tensors[key] = (dtype, info["shape"], data_start + begin, data_start + end)
+    return tensors, metadata, file_size
+
+
+def load_mmap(path: str) -> tuple[dict[str, torch.Tensor], dict | None]:
+    """Zero copy tensors over a private (copy on write) mapping of the file."""
+    tensors, metadata, _ = read_header(path)
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data = torch.frombuffer(mapping, dtype=torch.uint8)
+    sd = {}
+    for key, (dtype, shape, begin, end) in tensors.items():
+        tensor = data[begin:end]
+        try:
+            tensor = tensor.view(dtype)
+        except RuntimeError:
+            # The offset isn't aligned for this dtype
+            tensor = tensor.clone().view(dtype)
+        sd[key] = tensor.reshape(shape)
+    return sd, metadata
+
+
+class ChunkReader:
+    """Reads byte ranges of a file into tensors, one file handle (and staging buffer) per thread."""
+    def __init__(self, path: str, device: torch.device, chunk_size: int):
+        self.path = path
+        self.device = device
+        self.chunk_size = chunk_size
+        self.local = threading.local()
+        self.handles = []
+        self.lock = threading.Lock()
+
+    def file(self):
+        f = getattr(self.local, "file", None)
+        if f is None:
+            f = self.local.file = open(self.path, "rb", buffering=0)
+            with self.lock:
+                self.handles.append(f)
+        return f
+
+    def read_into(self, f, buffer, offset):
+        view = memoryview(buffer.numpy()).cast("B")
+        f.seek(offset)
+        read = 0
+        while read < len(view):
+            n = f.readinto(view[read:])
+            if not n:
+                raise ValueError("MetadataIncompleteBuffer")
+            read += n
+
+    def read(self, destination: torch.Tensor, offset: int):
+        f = self.file()
+        if destination.device.type == "cpu":
+            self.read_into(f, destination, offset)
+            return
+
+        staging = getattr(self.local, "staging", None)
+        if staging is None:
+            staging = self.local.staging = torch.empty(self.chunk_size, dtype=torch.uint8, pin_memory=True)
+            self.local.stream = torch.cuda.Stream(self.device)
+        staging = staging[:destination.numel()]
+        self.read_into(f, staging, offset)
+        with torch.cuda.stream(self.local.stream):
+            destination.copy_(staging, non_blocking=True)
+        self.local.stream.synchronize()
+
+    def close(self):
+        for f in self.handles:
+            f.close()
+
+
+def load_parallel(path: str, device: torch.device | None = None, threads: int = 8, chunk_size: int = CHUNK_SIZE) -> tuple[dict[str, torch.Tensor], dict | None]:
+    """Reads all the tensors into memory on device, large tensors are split in chunks read in parallel."""
+    if device is None:
+        device = torch.device("cpu")
+    if not comfy.model_management.is_device_cpu(device) and not comfy.model_management.is_device_cuda(device):
+        sd, metadata = load_parallel(path, torch.device("cpu"), threads, chunk_size)
+        return {k: v.to(device) for k, v in sd.items()}, metadata
+    tensors, metadata, _ = read_header(path)
+    reader = ChunkReader(path, device, chunk_size)
+    sd = {}
+    chunks = []
+    for key, (dtype, shape, begin, end) in tensors.items():
+        tensor = torch.empty(shape, dtype=dtype, device=device)
+        sd[key] = tensor
+        data = tensor.reshape(-1).view(torch.uint8)
+        for i in range(0, end - begin, chunk_size):
+            chunks.append((data[i:i + chunk_size], begin + i))
+
+    try:
+        if threads <= 1 or len(chunks) <= 1:
+            for destination, offset in chunks:
+                reader.read(destination, offset)
+        else:
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="SafetensorsLoader") as executor:
+                for future in [executor.submit(reader.read, destination, offset) for destination, offset in chunks]:
+                    future.result()
+    finally:
+        reader.close()
+    return sd, metadata
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import hashlib
 import json
 import torch
 from enum import Enum
@@ -25,6 +26,11 @@ import math
 import os
 
 import comfy.utils
+import comfy.state_dict_cache
+import comfy.lora_cache
+import comfy.merged_weight_cache
+import comfy.model_hash
+import comfy.vae_memory
 
 from . import clip_vision
 from . import gligen
@@ -54,6 +60,7 @@ import comfy.text_encoders.qwen_image
 import comfy.text_encoders.hunyuan_image
 
 import comfy.model_patcher
+import comfy.text_encoder_cache
 import comfy.lora
 import comfy.lora_convert
 import comfy.hooks
@@ -62,15 +69,26 @@ import comfy.taesd.taesd
 
 import comfy.ldm.flux.redux
 
-def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
+def lora_key_map(model, clip):
     key_map = {}
     if model is not None:
         key_map = comfy.lora.model_lora_keys_unet(model.model, key_map)
     if clip is not None:
         key_map = comfy.lora.model_lora_keys_clip(clip.cond_stage_model, key_map)
+    return key_map
 
+def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
+    key_map = lora_key_map(model, clip)
     lora = comfy.lora_convert.convert_lora(lora)
     loaded = comfy.lora.load_lora(lora, key_map)
+    return add_lora_patches(model, clip, loaded, strength_model, strength_clip)
+
+def load_lora_file_for_models(model, clip, lora_path, strength_model, strength_clip):
+    """Same as load_lora_for_models with the parsed patches of the file coming from the shared LoRA cache."""
+    loaded = comfy.lora_cache.cache.load_patches(lora_path, lora_key_map(model, clip))
+    return add_lora_patches(model, clip, loaded, strength_model, strength_clip)
+
+def add_lora_patches(model, clip, loaded, strength_model, strength_clip):
     if model is not None:
         new_modelpatcher = model.clone()
         k = new_modelpatcher.add_patches(loaded, strength_model)
@@ -131,6 +149,8 @@ class CLIP:
         self.use_clip_schedule = False
         logging.info("CLIP/text encoder model load device: {}, offload device: {}, current: {}, dtype: {}".format(load_device, offload_device, params['device'], dtype))
         self.tokenizer_options = {}
+        # Identity of the weights for the text encoder cache, set by the loaders that know the files they came from
+        self.weights_digest = None
 
     def clone(self):
         n = CLIP(no_init=True)
@@ -141,6 +161,7 @@ class CLIP:
         n.tokenizer_options = self.tokenizer_options.copy()
         n.use_clip_schedule = self.use_clip_schedule
         n.apply_hooks_to_conds = self.apply_hooks_to_conds
+        n.weights_digest = getattr(self, "weights_digest", None)
         return n
 
     def get_ram_usage(self):
@@ -226,35 +247,67 @@ class CLIP:
             all_hooks.reset()
         return all_cond_pooled
 
+    def encode_cache_key(self, tokens, unprojected):
+        """Key of these tokens in the shared text encoder cache, None when the result can't be cached."""
+        cache = comfy.text_encoder_cache.cache
+        weights_digest = getattr(self, "weights_digest", None)
+        if not cache.enabled() or not weights_digest:
+            return None
+        patcher = self.patcher
+        if patcher.forced_hooks is not None or len(patcher.hook_patches) > 0 or len(patcher.object_patches) > 0 or len(patcher.weight_wrapper_patches) > 0:
+            return None
+        patches_digest = comfy.text_encoder_cache.patches_digest(patcher)
+        if patches_digest is None:
+            return None
+
+        hasher = hashlib.sha256(weights_digest + patches_digest)
+        try:
+            comfy.text_encoder_cache.update_hash(hasher, (type(self.cond_stage_model).__qualname__, sorted(map(str, self.cond_stage_model.dtypes)), self.layer_idx, unprojected))
+            comfy.text_encoder_cache.update_hash(hasher, tokens)
+        except comfy.text_encoder_cache.NotHashable:
+            return None
+        return hasher.digest()
+
     def encode_from_tokens(self, tokens, return_pooled=False, return_dict=False):
-        self.cond_stage_model.reset_clip_options()
+        cache_key = self.encode_cache_key(tokens, return_pooled == "unprojected")
+        out = None
+        if cache_key is not None:
+            out = comfy.text_encoder_cache.cache.get(cache_key)
 
-        if self.layer_idx is not None:
-            self.cond_stage_model.set_clip_options({"layer": self.layer_idx})
+        if out is None:
+            self.cond_stage_model.reset_clip_options()
+
+            if self.layer_idx is not None:
+                self.cond_stage_model.set_clip_options({"layer": self.layer_idx})
 
-        if return_pooled == "unprojected":
-            self.cond_stage_model.set_clip_options({"projected_pooled": False})
+            if return_pooled == "unprojected":
+                self.cond_stage_model.set_clip_options({"projected_pooled": False})
 
-        self.load_model()
-        o = self.cond_stage_model.encode_token_weights(tokens)
-        cond, pooled = o[:2]
-        if return_dict:
+            self.load_model()
+            o = self.cond_stage_model.encode_token_weights(tokens)
+            cond, pooled = o[:2]
             out = {"cond": cond, "pooled_output": pooled}
             if len(o) > 2:
                 for k in o[2]:
                     out[k] = o[2][k]
+            if cache_key is not None:
+                comfy.text_encoder_cache.cache.put(cache_key, out)
+
+        if return_dict:
             self.add_hooks_to_dict(out)
             return out
 
         if return_pooled:
-            return cond, pooled
-        return cond
+            return out["cond"], out["pooled_output"]
+        return out["cond"]
 
     def encode(self, text):
         tokens = self.tokenize(text)
         return self.encode_from_tokens(tokens)
 
     def load_sd(self, sd, full_model=False):
+        # The weights no longer match the files they were loaded from
+        self.weights_digest = None
         if full_model:
             return self.cond_stage_model.load_state_dict(sd, strict=False)
         else:
@@ -274,6 +327,9 @@ class CLIP:
     def get_key_patches(self):
         return self.patcher.get_key_patches()
 
+# Upper bound of the tiles the tiled VAE encode/decode run in one batch
+VAE_MAX_TILE_BATCH = 16
+
 class VAE:
     def __init__(self, sd=None, device=None, config=None, dtype=None, metadata=None):
         if 'decoder.up_blocks.0.resnets.0.norm1.weight' in sd.keys(): #diffusers format
@@ -628,6 +684,18 @@ class VAE:
                 pixels = pixels.narrow(d + 1, x_offset, x)
         return pixels
 
+    def tile_batching(self, memory_per_tile, output_shape):
+        """Number of tiles per call and the device the tiles are blended on, for tiles of the 2D tiled encode/decode."""
+        if model_management.is_device_cpu(self.device):
+            return 1, self.output_device  # Batching tiles only pays off on GPUs
+        free_memory = model_management.get_free_memory(self.device)
+        accumulate_device = self.output_device
+        accumulate_memory = 2 * math.prod(output_shape) * 4  # float32 output and blending weights
+        if accumulate_memory < free_memory * 0.25:
+            accumulate_device = self.device
+            free_memory -= accumulate_memory
+        return max(1, min(VAE_MAX_TILE_BATCH, int(free_memory / max(memory_per_tile, 1)))), accumulate_device
+
     def decode_tiled_(self, samples, tile_x=64, tile_y=64, overlap = 16):
         steps = samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x, tile_y, overlap)
         steps += samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x // 2, tile_y * 2, overlap)
@@ -635,10 +703,13 @@ class VAE:
         pbar = comfy.utils.ProgressBar(steps)
 
         decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
+        output_shape = [self.output_channels, samples.shape[2] * self.spacial_compression_decode(), samples.shape[3] * self.spacial_compression_decode()]
+        batch, accumulate_device = self.tile_batching(self.memory_used_decode((1, samples.shape[1], tile_y, tile_x), self.vae_dtype), output_shape)
+        tile_args = {"output_device": self.output_device, "pbar": pbar, "max_tile_batch": batch, "accumulate_device": accumulate_device}
         output = self.process_output(
-            (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-            comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-             comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar))
+            (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, **tile_args) +
+            comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, **tile_args) +
+             comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, **tile_args))
             / 3.0)
         return output
 
@@ -663,9 +734,12 @@ class VAE:
         pbar = comfy.utils.ProgressBar(steps)
 
         encode_fn = lambda a: self.first_stage_model.encode((self.process_input(a)).to(self.vae_dtype).to(self.device)).float()
-        samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
+        output_shape = [self.latent_channels, pixel_samples.shape[2] // self.spacial_compression_encode(), pixel_samples.shape[3] // self.spacial_compression_encode()]
+        batch, accumulate_device = self.tile_batching(self.memory_used_encode((1, pixel_samples.shape[1], tile_y, tile_x), self.vae_dtype), output_shape)
+        tile_args = {"out_channels": self.latent_channels, "output_device": self.output_device, "pbar": pbar, "max_tile_batch": batch, "accumulate_device": accumulate_device}
+        samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), **tile_args)
+        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), **tile_args)
+        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), **tile_args)
         samples /= 3.0
         return samples
 
@@ -692,41 +766,109 @@ class VAE:
         encode_fn = lambda a: self.first_stage_model.encode((self.process_input(a)).to(self.vae_dtype).to(self.device)).float()
         return comfy.utils.tiled_scale_multidim(samples, encode_fn, tile=(tile_t, tile_x, tile_y), overlap=overlap, upscale_amount=self.downscale_ratio, out_channels=self.latent_channels, downscale=True, index_formulas=self.downscale_index_formula, output_device=self.output_device)
 
+    def run_batched(self, kind, inputs, memory_used, run):
+        """
+        Runs run(batch) over inputs in batches sized from the measured memory of this VAE (or the
+        memory_used estimate per sample). When a batch runs out of memory the batch size is halved
+        and it resumes from that batch. Returns the output and the number of samples done, which is
+        less than the number of inputs when a single sample doesn't fit.
+        """
+        key = comfy.vae_memory.profile_key(self.first_stage_model, kind, inputs.shape, self.vae_dtype)
+        elements = comfy.vae_memory.element_key(self.first_stage_model, kind, self.vae_dtype)
+        memory_per_sample = comfy.vae_memory.profile.estimate(key, memory_used)
+        model_management.load_models_gpu([self.patcher], memory_required=memory_per_sample, force_full_load=self.disable_offload)
+        free_memory = model_management.get_free_memory(self.device)
+        batch_number = max(1, min(inputs.shape[0], int(free_memory / max(1, memory_per_sample))))
+
+        output = None
+        x = 0
+        while x < inputs.shape[0]:
+            oom = False
+            try:
+                batch = inputs[x:x + batch_number]
+                with comfy.vae_memory.PeakMemory(self.device) as peak:
+                    out = run(batch)
+                if output is None:
+                    output = torch.empty((inputs.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
+                output[x:x + batch.shape[0]] = out
+                if peak.bytes is not None:
+                    comfy.vae_memory.profile.record(key, peak.bytes / batch.shape[0])
+                    comfy.vae_memory.profile.record(elements, peak.bytes / batch.numel())
+                x += batch.shape[0]
+            except model_management.OOM_EXCEPTION:
+                oom = True
+
+            if oom:
+                #NOTE: the tensors referenced by the exception are freed once we are out of the except block.
+                comfy.vae_memory.profile.record_oom(key, free_memory / batch_number)
+                model_management.soft_empty_cache()
+                if batch_number == 1:
+                    break
+                batch_number = max(1, batch_number // 2)
+                logging.warning("Ran out of memory when VAE {} a batch, retrying with a batch size of {}.".format("decoding" if kind == "decode" else "encoding", batch_number))
+                free_memory = model_management.get_free_memory(self.device)
+        return output, x
+
+    def tile_size_3d(self, kind, inputs, default_tile, min_tile, adapt_frames):
+        """(tile, tile_t) of the 3D tiled fallback, the largest tile that fits according to the memory measured per element."""
+        key = comfy.vae_memory.element_key(self.first_stage_model, kind, self.vae_dtype)
+        element_bytes = comfy.vae_memory.profile.estimate(key, 0)
+        if element_bytes == 0:
+            return default_tile, None
+        free_memory = model_management.get_free_memory(self.device)
+        tile, tile_t = comfy.vae_memory.tile_size_3d(element_bytes, free_memory, inputs.shape[1], inputs.shape[2], inputs.shape[3], inputs.shape[4], min_tile)
+        if not adapt_frames or tile_t >= inputs.shape[2]:
+            tile_t = None
+        return tile, tile_t
+
+    def decode_tiled_3d_adaptive(self, samples):
+        """decode_tiled_3d with the tile size picked from the memory profile, the tile shrinks when it runs out of memory."""
+        min_tile = max(1, 64 // self.spacial_compression_decode())
+        tile, tile_t = self.tile_size_3d("decode", samples, 256 // self.spacial_compression_decode(), min_tile, True)
+        key = comfy.vae_memory.element_key(self.first_stage_model, "decode", self.vae_dtype)
+        while True:
+            oom = False
+            args = {"tile_x": tile, "tile_y": tile, "overlap": (1, tile // 4, tile // 4)}
+            if tile_t is not None:
+                args["tile_t"] = tile_t
+            try:
+                return self.decode_tiled_3d(samples, **args)
+            except model_management.OOM_EXCEPTION:
+                if tile <= min_tile and (tile_t is not None and tile_t <= 2):
+                    raise
+                oom = True
+
+            if oom:
+                frames = tile_t if tile_t is not None else samples.shape[2]
+                free_memory = model_management.get_free_memory(self.device)
+                comfy.vae_memory.profile.record_oom(key, free_memory / (samples.shape[1] * frames * tile * tile))
+                model_management.soft_empty_cache()
+                if tile > min_tile:
+                    tile = max(min_tile, tile // 2)
+                else:
+                    tile_t = max(2, frames // 2)
+                logging.warning("Ran out of memory when tiled VAE decoding, retrying with tiles of {} x {}.".format(tile_t if tile_t is not None else frames, tile))
+
     def decode(self, samples_in, vae_options={}):
         self.throw_exception_if_invalid()
-        pixel_samples = None
-        do_tile = False
-        try:
-            memory_used = self.memory_used_decode(samples_in.shape, self.vae_dtype)
-            model_management.load_models_gpu([self.patcher], memory_required=memory_used, force_full_load=self.disable_offload)
-            free_memory = model_management.get_free_memory(self.device)
-            batch_number = int(free_memory / memory_used)
-            batch_number = max(1, batch_number)
-
-            for x in range(0, samples_in.shape[0], batch_number):
-                samples = samples_in[x:x+batch_number].to(self.vae_dtype).to(self.device)
-                out = self.process_output(self.first_stage_model.decode(samples, **vae_options).to(self.output_device).float())
-                if pixel_samples is None:
-                    pixel_samples = torch.empty((samples_in.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
-                pixel_samples[x:x+batch_number] = out
-        except model_management.OOM_EXCEPTION:
-            logging.warning("Warning: Ran out of memory when regular VAE decoding, retrying with tiled VAE decoding.")
-            #NOTE: We don't know what tensors were allocated to stack variables at the time of the
-            #exception and the exception itself refs them all until we get out of this except block.
-            #So we just set a flag for tiler fallback so that tensor gc can happen once the
-            #exception is fully off the books.
-            do_tile = True
+        memory_used = self.memory_used_decode(samples_in.shape, self.vae_dtype)
+        run = lambda samples: self.process_output(self.first_stage_model.decode(samples.to(self.vae_dtype).to(self.device), **vae_options).to(self.output_device).float())
+        pixel_samples, done = self.run_batched("decode", samples_in, memory_used, run)
 
-        if do_tile:
+        if done < samples_in.shape[0]:
+            logging.warning("Warning: Ran out of memory when regular VAE decoding, retrying with tiled VAE decoding.")
+            remaining = samples_in[done:]
             dims = samples_in.ndim - 2
             if dims == 1 or self.extra_1d_channel is not None:
-                pixel_samples = self.decode_tiled_1d(samples_in)
+                tiled = self.decode_tiled_1d(remaining)
             elif dims == 2:
-                pixel_samples = self.decode_tiled_(samples_in)
+                tiled = self.decode_tiled_(remaining)
             elif dims == 3:
-                tile = 256 // self.spacial_compression_decode()
-                overlap = tile // 4
-                pixel_samples = self.decode_tiled_3d(samples_in, tile_x=tile, tile_y=tile, overlap=(1, overlap, overlap))
+                tiled = self.decode_tiled_3d_adaptive(remaining)
+            if pixel_samples is None:
+                pixel_samples = tiled
+            else:
+                pixel_samples[done:] = tiled.to(pixel_samples.device)
 
         pixel_samples = pixel_samples.to(self.output_device).movedim(1,-1)
         return pixel_samples
@@ -760,47 +902,107 @@ class VAE:
             output = self.decode_tiled_3d(samples, **args)
         return output.movedim(1, -1)
 
+    def decode_stream(self, samples, tile_t=16, overlap_t=1, tile_x=None, tile_y=None, overlap=None):
+        """
+        Decodes a video latent in chunks of tile_t latent frames overlapping by overlap_t, blended
+        like decode_tiled_3d. Yields the decoded frames [frames, H, W, C] as soon as no later chunk
+        overlaps them so only a chunk of frames is in memory at a time. The frames of the samples
+        of the batch are yielded one sample after the other. The chunks are tiled spatially with
+        tile_x/tile_y (whole frames by default), the tiles are halved when they run out of memory.
+        """
+        self.throw_exception_if_invalid()
+        length = samples.shape[2]
+        tile_t = max(2, tile_t)
+        overlap_t = max(1, min(overlap_t, tile_t // 2))
+        tile_x = samples.shape[4] if tile_x is None else tile_x
+        tile_y = samples.shape[3] if tile_y is None else tile_y
+        min_tile = max(1, 64 // self.spacial_compression_decode())
+
+        memory_used = self.memory_used_decode((1,) + tuple(samples.shape[1:2]) + (min(tile_t, length), tile_y, tile_x), self.vae_dtype)
+        model_management.load_models_gpu([self.patcher], memory_required=memory_used, force_full_load=self.disable_offload)
+
+        def scale(formula, value):
+            return formula(value) if callable(formula) else formula * value
+        index_formulas = self.upscale_index_formula if self.upscale_index_formula is not None else self.upscale_ratio
+        feather_t = round(scale(self.upscale_ratio[0], overlap_t))
+        decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
+
+        positions = [max(0, min(length - overlap_t, p)) for p in range(0, length - overlap_t, tile_t - overlap_t)] if length > tile_t else [0]
+        pbar = comfy.utils.ProgressBar(samples.shape[0] * len(positions))
+        for b in range(samples.shape[0]):
+            out = None
+            out_div = None
+            out_start = 0
+            i = 0
+            while i < len(positions):
+                pos = positions[i]
+                chunk = samples[b:b + 1, :, pos:pos + min(tile_t, length - pos)]
+                oom = False
+                try:
+                    overlap_xy = overlap if overlap is not None else min(tile_x, tile_y) // 4
+                    frames = comfy.utils.tiled_scale_multidim(chunk, decode_fn, tile=(chunk.shape[2], tile_y, tile_x), overlap=(0, overlap_xy, overlap_xy), upscale_amount=self.upscale_ratio, out_channels=self.output_channels, index_formulas=self.upscale_index_formula, output_device=self.output_device)
+                except model_management.OOM_EXCEPTION:
+                    if max(tile_x, tile_y) <= min_tile:
+                        raise
+                    oom = True
+
+                if oom:
+                    tile_x = max(min_tile, tile_x // 2)
+                    tile_y = max(min_tile, tile_y // 2)
+                    model_management.soft_empty_cache()
+                    logging.warning("Ran out of memory when stream VAE decoding, retrying with tiles of {} x {}.".format(tile_y, tile_x))
+                    continue
+
+                start = round(scale(index_formulas[0], pos)) - out_start
+                ramp = comfy.utils.feather_ramp(frames.shape[2], feather_t).reshape((1, 1, -1) + (1,) * (frames.ndim - 3)).to(frames.device)
+                end = start + frames.shape[2]
+                if out is None:
+                    out = torch.zeros(frames.shape[:2] + (end,) + frames.shape[3:], device=frames.device)
+                    out_div = torch.zeros((1, 1, end) + (1,) * (frames.ndim - 3), device=frames.device)
+                elif end > out.shape[2]:
+                    out = torch.cat([out, torch.zeros(out.shape[:2] + (end - out.shape[2],) + out.shape[3:], device=out.device)], dim=2)
+                    out_div = torch.cat([out_div, torch.zeros((1, 1, end - out_div.shape[2]) + out_div.shape[3:], device=out_div.device)], dim=2)
+                out[:, :, start:end] += frames * ramp
+                out_div[:, :, start:end] += ramp
+
+                # The frames before the start of the next chunk are final
+                i += 1
+                done = out.shape[2] if i == len(positions) else round(scale(index_formulas[0], positions[i])) - out_start
+                if done > 0:
+                    yield self.process_output(out[:, :, :done] / out_div[:, :, :done]).movedim(1, -1)[0]
+                    out = out[:, :, done:]
+                    out_div = out_div[:, :, done:]
+                    out_start += done
+                pbar.update(1)
+
     def encode(self, pixel_samples):
         self.throw_exception_if_invalid()
         pixel_samples = self.vae_encode_crop_pixels(pixel_samples)
         pixel_samples = pixel_samples.movedim(-1, 1)
-        do_tile = False
         if self.latent_dim == 3 and pixel_samples.ndim < 5:
             if not self.not_video:
                 pixel_samples = pixel_samples.movedim(1, 0).unsqueeze(0)
             else:
                 pixel_samples = pixel_samples.unsqueeze(2)
-        try:
-            memory_used = self.memory_used_encode(pixel_samples.shape, self.vae_dtype)
-            model_management.load_models_gpu([self.patcher], memory_required=memory_used, force_full_load=self.disable_offload)
-            free_memory = model_management.get_free_memory(self.device)
-            batch_number = int(free_memory / max(1, memory_used))
-            batch_number = max(1, batch_number)
-            samples = None
-            for x in range(0, pixel_samples.shape[0], batch_number):
-                pixels_in = self.process_input(pixel_samples[x:x + batch_number]).to(self.vae_dtype).to(self.device)
-                out = self.first_stage_model.encode(pixels_in).to(self.output_device).float()
-                if samples is None:
-                    samples = torch.empty((pixel_samples.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
-                samples[x:x + batch_number] = out
-
-        except model_management.OOM_EXCEPTION:
-            logging.warning("Warning: Ran out of memory when regular VAE encoding, retrying with tiled VAE encoding.")
-            #NOTE: We don't know what tensors were allocated to stack variables at the time of the
-            #exception and the exception itself refs them all until we get out of this except block.
-            #So we just set a flag for tiler fallback so that tensor gc can happen once the
-            #exception is fully off the books.
-            do_tile = True
+        memory_used = self.memory_used_encode(pixel_samples.shape, self.vae_dtype)
+        run = lambda pixels: self.first_stage_model.encode(self.process_input(pixels).to(self.vae_dtype).to(self.device)).to(self.output_device).float()
+        samples, done = self.run_batched("encode", pixel_samples, memory_used, run)
 
-        if do_tile:
+        if done < pixel_samples.shape[0]:
+            logging.warning("Warning: Ran out of memory when regular VAE encoding, retrying with tiled VAE encoding.")
+            remaining = pixel_samples[done:]
             if self.latent_dim == 3:
-                tile = 256
+                tile, _ = self.tile_size_3d("encode", remaining, 256, 64, False)
                 overlap = tile // 4
-                samples = self.encode_tiled_3d(pixel_samples, tile_x=tile, tile_y=tile, overlap=(1, overlap, overlap))
+                tiled = self.encode_tiled_3d(remaining, tile_x=tile, tile_y=tile, overlap=(1, overlap, overlap))
             elif self.latent_dim == 1 or self.extra_1d_channel is not None:
-                samples = self.encode_tiled_1d(pixel_samples)
+                tiled = self.encode_tiled_1d(remaining)
             else:
-                samples = self.encode_tiled_(pixel_samples)
+                tiled = self.encode_tiled_(remaining)
+            if samples is None:
+                samples = tiled
+            else:
+                samples[done:] = tiled.to(samples.device)
 
         return samples
 
@@ -913,11 +1115,31 @@ class CLIPType(Enum):
     HUNYUAN_IMAGE = 19
 
 
+def clone_shared_models(objects):
+    """Clones of the objects returned by comfy.model_hash.shared_models, the ones that can be patched are cloned."""
+    return tuple(o.clone() if isinstance(o, (comfy.model_patcher.ModelPatcher, CLIP)) else o for o in objects)
+
 def load_clip(ckpt_paths, embedding_directory=None, clip_type=CLIPType.STABLE_DIFFUSION, model_options={}):
+    options = (embedding_directory, clip_type, repr(model_options))
+    # Instances are only shared by the prompt workers running on the same device
+    shared_options = options + (model_management.get_torch_device(),)
+    shared = comfy.model_hash.shared_models.get("clip", ckpt_paths, shared_options)
+    if shared is not None:
+        logging.info("Using the text encoder already loaded from the same weights as {}".format(ckpt_paths))
+        clip = clone_shared_models(shared)[0]
+        comfy.model_hash.shared_models.add("clip", ckpt_paths, shared_options, [clip])
+        return clip
+
     clip_data = []
     for p in ckpt_paths:
-        clip_data.append(comfy.utils.load_torch_file(p, safe_load=True))
-    return load_text_encoder_state_dicts(clip_data, embedding_directory=embedding_directory, clip_type=clip_type, model_options=model_options)
+        clip_data.append(comfy.state_dict_cache.load_torch_file(p, safe_load=True))
+    clip = load_text_encoder_state_dicts(clip_data, embedding_directory=embedding_directory, clip_type=clip_type, model_options=model_options)
+    clip.weights_digest = comfy.text_encoder_cache.files_digest(ckpt_paths, ("clip", repr(options)))
+    for p in ckpt_paths:
+        comfy.state_dict_cache.cache.add_users(p, clip, safe_load=True)
+    comfy.merged_weight_cache.set_weight_source(clip, *ckpt_paths, model_options=model_options)
+    comfy.model_hash.shared_models.add("clip", ckpt_paths, shared_options, [clip])
+    return clip
 
 
 class TEModel(Enum):
@@ -1189,10 +1411,25 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
     return (model, clip, vae)
 
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
-    sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True)
+    shared_options = (output_vae, output_clip, output_clipvision, embedding_directory, output_model, repr(model_options), repr(te_model_options), model_management.get_torch_device())
+    shared = comfy.model_hash.shared_models.get("checkpoint", [ckpt_path], shared_options)
+    if shared is not None:
+        logging.info("Using the checkpoint already loaded from the same weights as {}".format(ckpt_path))
+        out = clone_shared_models(shared)
+        comfy.model_hash.shared_models.add("checkpoint", [ckpt_path], shared_options, out)
+        return out
+
+    sd, metadata = comfy.state_dict_cache.load_torch_file(ckpt_path, return_metadata=True)
     out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
     if out is None:
         raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
+    comfy.state_dict_cache.cache.add_users(ckpt_path, *out)
+    if out[0] is not None:
+        comfy.merged_weight_cache.set_weight_source(out[0], ckpt_path, model_options=model_options)
+    if out[1] is not None:
+        out[1].weights_digest = comfy.text_encoder_cache.files_digest([ckpt_path], ("checkpoint", embedding_directory, repr(te_model_options)))
+        comfy.merged_weight_cache.set_weight_source(out[1], ckpt_path, model_options=te_model_options)
+    comfy.model_hash.shared_models.add("checkpoint", [ckpt_path], shared_options, out)
     return out
 
 def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, metadata=None):
@@ -1363,11 +1600,22 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
 
 
 def load_diffusion_model(unet_path, model_options={}):
-    sd, metadata = comfy.utils.load_torch_file(unet_path, return_metadata=True)
+    shared_options = (repr(model_options), model_management.get_torch_device())
+    shared = comfy.model_hash.shared_models.get("diffusion_model", [unet_path], shared_options)
+    if shared is not None:
+        logging.info("Using the diffusion model already loaded from the same weights as {}".format(unet_path))
+        model = clone_shared_models(shared)[0]
+        comfy.model_hash.shared_models.add("diffusion_model", [unet_path], shared_options, [model])
+        return model
+
+    sd, metadata = comfy.state_dict_cache.load_torch_file(unet_path, return_metadata=True)
     model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata)
     if model is None:
         logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
         raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
+    comfy.state_dict_cache.cache.add_users(unet_path, model)
+    comfy.merged_weight_cache.set_weight_source(model, unet_path, model_options=model_options)
+    comfy.model_hash.shared_models.add("diffusion_model", [unet_path], shared_options, [model])
     return model
 
 def load_unet(unet_path, dtype=None):
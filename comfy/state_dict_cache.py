@@ -0,0 +1,204 @@
+"""
+Process wide cache of the state dicts read by the model loaders.
+
+Entries are keyed by the path, size and mtime of the file so loading the same weights
+again through another loader node (or after the node output cache dropped the model)
+doesn't read and parse the file again. Each call gets its own shallow copy of the dict
+because the loaders add, rename and remove keys.
+
+The models built from an entry are tracked with weak references. An entry used by a live
+model is only evicted when the unused entries alone don't bring the cache under budget,
+its tensors are often shared with the model so dropping it frees little.
+
+Files can be loaded ahead of time with prefetch (see comfy_execution.prefetch), optionally
+pinning the tensors so the model built from them is copied to the GPU from pinned memory.
+Concurrent loads of the same file wait for each other instead of reading it twice.
+"""
+import contextlib
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import torch
+
+import comfy.model_management
+import comfy.utils
+from comfy.cli_args import args
+
+
+def state_dict_size(sd):
+    size = 0
+    for v in sd.values():
+        if isinstance(v, torch.Tensor):
+            size += v.nbytes
+    return size
+
+
+class CacheEntry:
+    def __init__(self, sd, metadata):
+        self.sd = sd
+        self.metadata = metadata
+        self.size = state_dict_size(sd)
+        self.users = weakref.WeakSet()
+        self.pinned = []
+
+    def pin(self):
+        if len(self.pinned) > 0:
+            return
+        for v in self.sd.values():
+            if isinstance(v, torch.Tensor) and comfy.model_management.pin_memory(v):
+                self.pinned.append(v)
+
+    def unpin(self):
+        for v in self.pinned:
+            comfy.model_management.unpin_memory(v)
+        self.pinned = []
+
+
+class StateDictCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.key_locks: dict[tuple, list] = {}
+
+    def key(self, path, safe_load):
+        stat = os.stat(path)
+        return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns, safe_load)
+
+    def load(self, path, safe_load=False, return_metadata=False):
+        """Same as comfy.utils.load_torch_file but served from the cache when the file didn't change."""
+        if self.max_size <= 0:
+            return comfy.utils.load_torch_file(path, safe_load=safe_load, return_metadata=return_metadata)
+
+        key = self.key(path, safe_load)
+        with self.key_lock(key):
+            with self.lock:
+                entry = self.entries.get(key, None)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+            if entry is None:
+                sd, metadata = comfy.utils.load_torch_file(path, safe_load=safe_load, return_metadata=True)
+                entry = CacheEntry(sd, metadata)
+                with self.lock:
+                    self.misses += 1
+                    self.put(key, entry)
+                logging.debug("state dict cache miss {} ({:.2f} GB)".format(path, entry.size / (1024 ** 3)))
+
+        sd = dict(entry.sd)
+        return (sd, entry.metadata) if return_metadata else sd
+
+    @contextlib.contextmanager
+    def key_lock(self, key):
+        """Serializes the loads of one file, the lock is dropped once nobody is loading it."""
+        with self.lock:
+            key_lock = self.key_locks.get(key, None)
+            if key_lock is None:
+                key_lock = self.key_locks[key] = [threading.Lock(), 0]
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self.key_locks[key]
+
+    def prefetch(self, path, safe_load=False, pin=False):
+        """Loads the file into the cache if it fits, returns False when it doesn't."""
+        if self.max_size <= 0:
+            return False
+        key = self.key(path, safe_load)
+        if key[1] > self.max_size:
+            return False
+        with self.key_lock(key):
+            with self.lock:
+                entry = self.entries.get(key, None)
+            if entry is None:
+                sd, metadata = comfy.utils.load_torch_file(path, safe_load=safe_load, return_metadata=True)
+                entry = CacheEntry(sd, metadata)
+                with self.lock:
+                    self.put(key, entry)
+                    if key not in self.entries:
+                        return False
+                logging.debug("state dict cache prefetched {} ({:.2f} GB)".format(path, entry.size / (1024 ** 3)))
+        if pin:
+            entry.pin()
+        return True
+
+    def put(self, key, entry):
+        if entry.size > self.max_size:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+            old.unpin()
+        self.entries[key] = entry
+        self.size += entry.size
+        self.evict(self.max_size)
+
+    def evict(self, max_size):
+        for unused_only in (True, False):
+            for key in list(self.entries.keys()):
+                if self.size <= max_size:
+                    return
+                entry = self.entries[key]
+                if unused_only and len(entry.users) > 0:
+                    continue
+                del self.entries[key]
+                self.size -= entry.size
+                entry.unpin()
+
+    def add_users(self, path, *users, safe_load=False):
+        """Tracks the objects (ModelPatcher, CLIP, VAE...) built from the state dict of this file."""
+        if self.max_size <= 0:
+            return
+        try:
+            key = self.key(path, safe_load)
+        except OSError:
+            return
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return
+            for user in users:
+                if user is None:
+                    continue
+                # The torch module is shared by all the clones of a ModelPatcher, CLIP or VAE
+                patcher = getattr(user, "patcher", user)
+                entry.users.add(getattr(patcher, "model", patcher))
+
+    def clear(self):
+        with self.lock:
+            for entry in self.entries.values():
+                entry.unpin()
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+                "live_users": sum(len(entry.users) for entry in self.entries.values()),
+                "pinned": sum(entry.size for entry in self.entries.values() if len(entry.pinned) > 0),
+            }
+
+
+cache = StateDictCache(int(args.state_dict_cache * (1024 ** 3)))
+
+
+def load_torch_file(path, safe_load=False, return_metadata=False):
+    return cache.load(path, safe_load=safe_load, return_metadata=return_metadata)
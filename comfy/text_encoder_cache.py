@@ -0,0 +1,292 @@
+"""
+Cache of text encoder outputs shared by every CLIP object.
+
+Entries are keyed by a digest of the text encoder weights (the identity of the files
+they were loaded from and the patches applied to them), the clip options and the token
+weight pairs, so the same prompt encoded by two separately loaded copies of the same
+text encoder is only computed once.
+The entries are kept in RAM up to a byte budget and can optionally also be written to
+disk so they survive restarts, by a background thread so the prompt workers don't wait on it.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import safetensors.torch
+import torch
+
+from comfy import model_management
+from comfy import model_hash
+from comfy.cli_args import args
+
+
+class NotHashable(Exception):
+    pass
+
+
+def update_tensor_hash(hasher, tensor):
+    """Hashes the dtype, shape and all the data of a tensor."""
+    hasher.update("{}{}".format(tensor.dtype, tuple(tensor.shape)).encode())
+    try:
+        data = tensor.detach().reshape(-1).view(torch.uint8)
+    except RuntimeError as e:
+        raise NotHashable() from e
+    hasher.update(data.cpu().numpy().data)
+
+
+def update_hash(hasher, obj):
+    """Canonical encoding of tokens, options and patches. Raises NotHashable for anything else."""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        hasher.update("{}:{!r};".format(type(obj).__name__, obj).encode())
+    elif isinstance(obj, torch.Tensor):
+        hasher.update(b"t")
+        update_tensor_hash(hasher, obj)
+    elif isinstance(obj, (list, tuple)):
+        hasher.update("{}{};".format(type(obj).__name__, len(obj)).encode())
+        for x in obj:
+            update_hash(hasher, x)
+    elif isinstance(obj, dict):
+        hasher.update("dict{};".format(len(obj)).encode())
+        for k in sorted(obj.keys(), key=str):
+            update_hash(hasher, k)
+            update_hash(hasher, obj[k])
+    elif isinstance(obj, (torch.dtype, torch.device)):
+        hasher.update("{}:{};".format(type(obj).__name__, obj).encode())
+    elif hasattr(obj, "weights") and hasattr(obj, "calculate_weight"):
+        # Weight adapters (LoRA, LoHa, ...) are defined by their type and weights
+        hasher.update("{}.{};".format(type(obj).__module__, type(obj).__qualname__).encode())
+        update_hash(hasher, obj.weights)
+    else:
+        raise NotHashable()
+
+
+def files_digest(paths, options):
+    """Identity of text encoder weights loaded from these files with these loader options, None if a file can't be read."""
+    hasher = hashlib.sha256()
+    try:
+        update_hash(hasher, options)
+        for path in paths:
+            # The full hash of the file when it is known, its path, size and mtime otherwise
+            update_hash(hasher, model_hash.index.identity(path))
+    except (OSError, NotHashable):
+        return None
+    return hasher.digest()
+
+
+patches_digests = OrderedDict()
+patches_digests_lock = threading.Lock()
+
+def patches_digest(patcher):
+    """Identity of the weight patches (LoRAs, merges) of a text encoder ModelPatcher or None if they can't be hashed."""
+    if len(patcher.patches) == 0:
+        return b""
+    with patches_digests_lock:
+        digest = patches_digests.get(patcher.patches_uuid, False)
+    if digest is False:
+        hasher = hashlib.sha256()
+        try:
+            for key in sorted(patcher.patches.keys()):
+                update_hash(hasher, key)
+                for strength_patch, value, strength_model, offset, function in patcher.patches[key]:
+                    if function is not None:
+                        raise NotHashable()
+                    update_hash(hasher, (strength_patch, strength_model, offset))
+                    update_hash(hasher, value)
+            digest = hasher.digest()
+        except NotHashable:
+            digest = None
+        with patches_digests_lock:
+            patches_digests[patcher.patches_uuid] = digest
+            while len(patches_digests) > 64:
+                patches_digests.popitem(last=False)
+    return digest
+
+
+def entry_size(entry):
+    return sum(v.nbytes for v in entry.values() if isinstance(v, torch.Tensor))
+
+
+class TextEncoderCache:
+    """Shared by the prompt workers, every method takes the lock. The disk writes happen without it."""
+    def __init__(self, max_size):
+        self.lock = threading.RLock()
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.directory = None
+        self.max_disk_size = 0
+        self.disk_index = OrderedDict()
+        self.disk_size = 0
+        self.pending = set()
+        self.writer = None
+
+    def enabled(self):
+        return self.max_size > 0 or self.directory is not None
+
+    def set_disk_directory(self, directory, max_disk_size):
+        self.flush()
+        with self.lock:
+            self._set_disk_directory(directory, max_disk_size)
+
+    def _set_disk_directory(self, directory, max_disk_size):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.disk_index.clear()
+        self.disk_size = 0
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".safetensors") and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".safetensors")], stat.st_size))
+        for _, name, size in sorted(files):
+            self.disk_index[name] = size
+            self.disk_size += size
+        self._evict_disk(self.max_disk_size)
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None:
+            entry = self._load(key)
+            if entry is not None:
+                self._put_memory(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(entry)
+
+    def put(self, key, entry):
+        with self.lock:
+            self._put_memory(key, entry)
+            if self.directory is None:
+                return
+            name = key.hex()
+            if name in self.disk_index or name in self.pending:
+                return
+            self.pending.add(name)
+            if self.writer is None:
+                self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TextEncoderCacheWriter")
+            directory = self.directory
+        tensors = {k: v.detach().to("cpu", copy=True).contiguous() for k, v in entry.items() if isinstance(v, torch.Tensor)}
+        others = {k: v for k, v in entry.items() if not isinstance(v, torch.Tensor)}
+        self.writer.submit(self._write, directory, name, tensors, others)
+
+    def flush(self):
+        """Waits until the pending entries are written."""
+        if self.writer is not None:
+            self.writer.submit(lambda: None).result()
+
+    def _put_memory(self, key, entry):
+        size = entry_size(entry)
+        if size > self.max_size or key in self.entries:
+            return
+        self.entries[key] = dict(entry)
+        self.size += size
+        while self.size > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.size -= entry_size(old)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".safetensors")
+
+    def _evict_disk(self, size):
+        for path in self._pop_disk(size):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _pop_disk(self, size):
+        """Drops the oldest disk entries from the index, returns the paths of their files."""
+        paths = []
+        while self.disk_size > size and len(self.disk_index) > 0:
+            name, file_size = self.disk_index.popitem(last=False)
+            self.disk_size -= file_size
+            paths.append(self._path(name))
+        return paths
+
+    def _write(self, directory, name, tensors, others):
+        try:
+            self._save(directory, name, tensors, others)
+        finally:
+            with self.lock:
+                self.pending.discard(name)
+
+    def _save(self, directory, name, tensors, others):
+        try:
+            metadata = {"others": json.dumps(others)}
+        except (TypeError, ValueError):
+            return
+        size = entry_size(tensors)
+        with self.lock:
+            if directory != self.directory or size > self.max_disk_size:
+                return
+            # Reserve the space until the file is written
+            evicted = self._pop_disk(self.max_disk_size - size)
+            self.disk_size += size
+        for path in evicted:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        path = os.path.join(directory, name + ".safetensors")
+        file_size = 0
+        try:
+            safetensors.torch.save_file(tensors, path + ".tmp", metadata=metadata)
+            os.replace(path + ".tmp", path)
+            file_size = os.path.getsize(path)
+        except OSError as e:
+            logging.warning("Failed to write text encoder cache entry: {}".format(e))
+        with self.lock:
+            if directory != self.directory:
+                return
+            self.disk_size -= size
+            if file_size > 0:
+                self.disk_index[name] = file_size
+                self.disk_size += file_size
+
+    def _load(self, key):
+        name = key.hex()
+        if name not in self.disk_index:
+            return None
+        path = self._path(name)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                entry = json.loads(f.metadata()["others"])
+                for k in f.keys():
+                    entry[k] = f.get_tensor(k).to(model_management.intermediate_device())
+        except Exception as e:
+            logging.debug("Dropping unreadable text encoder cache entry {}: {}".format(name, e))
+            self.disk_size -= self.disk_index.pop(name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        self.disk_index.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+
+cache = TextEncoderCache(int(args.text_encoder_cache * (1024 ** 3)))
+
+
+def enable_disk_cache(directory, max_size_gb):
+    cache.set_disk_directory(directory, int(max_size_gb * (1024 ** 3)))
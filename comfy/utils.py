@@ -21,17 +21,25 @@ import torch
 import math
 import struct
 import comfy.checkpoint_pickle
+import comfy.safetensors_loader
 import safetensors.torch
 import numpy as np
 from PIL import Image
 import logging
 import itertools
+import functools
 from torch.nn.functional import interpolate
 from einops import rearrange
 from comfy.cli_args import args
 
+try:
+    OOM_EXCEPTION = torch.cuda.OutOfMemoryError
+except AttributeError:
+    OOM_EXCEPTION = MemoryError
+
 MMAP_TORCH_FILES = args.mmap_torch_files
 DISABLE_MMAP = args.disable_mmap
+SAFETENSORS_LOADER = args.safetensors_loader
 
 ALWAYS_SAFE_LOAD = False
 if hasattr(torch.serialization, "add_safe_globals"):  # TODO: this was added in pytorch 2.4, the unsafe path should be removed once earlier versions are deprecated
@@ -60,15 +68,20 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
     metadata = None
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
         try:
-            with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
-                sd = {}
-                for k in f.keys():
-                    tensor = f.get_tensor(k)
-                    if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
-                        tensor = tensor.to(device=device, copy=True)
-                    sd[k] = tensor
-                if return_metadata:
-                    metadata = f.metadata()
+            if SAFETENSORS_LOADER == "mmap" and not DISABLE_MMAP and device.type == "cpu":
+                sd, metadata = comfy.safetensors_loader.load_mmap(ckpt)
+            elif SAFETENSORS_LOADER in ("mmap", "parallel"):
+                sd, metadata = comfy.safetensors_loader.load_parallel(ckpt, device, args.safetensors_load_threads)
+            else:
+                with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
+                    sd = {}
+                    for k in f.keys():
+                        tensor = f.get_tensor(k)
+                        if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
+                            tensor = tensor.to(device=device, copy=True)
+                        sd[k] = tensor
+                    if return_metadata:
+                        metadata = f.metadata()
         except Exception as e:
             if len(e.args) > 0:
                 message = e.args[0]
@@ -901,9 +914,37 @@ def get_tiled_scale_steps(width, height, tile_x, tile_y, overlap):
     cols = 1 if width <= tile_x else math.ceil((width - overlap) / (tile_x - overlap))
     return rows * cols
 
+@functools.lru_cache(maxsize=64)
+def feather_ramp(length, feather):
+    """Weights along one dimension of a tile: the first and last feather values ramp up from 1 / feather to 1."""
+    ramp = torch.ones(length)
+    if 0 < feather < length:
+        steps = torch.arange(1, feather + 1, dtype=torch.float32) / feather
+        ramp[:feather] *= steps
+        ramp[length - feather:] *= steps.flip(0)
+    return ramp
+
+@functools.lru_cache(maxsize=32)
+def feather_mask(shape, feathers, device):
+    """Blending mask of a tile of this spatial shape, [1, 1, *shape]. It is the product of one ramp per dimension."""
+    dims = len(shape)
+    mask = torch.ones([1] * dims)
+    for d in range(dims):
+        mask = mask * feather_ramp(shape[d], feathers[d]).reshape([shape[d] if i == d else 1 for i in range(dims)])
+    return mask.reshape([1, 1] + list(shape)).to(device)
+
 @torch.inference_mode()
-def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu", downscale=False, index_formulas=None, pbar=None):
+def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu", downscale=False, index_formulas=None, pbar=None, max_tile_batch=1, accumulate_device=None):
+    """
+    Runs function on overlapping tiles of samples and blends the results with feathered edges.
+    Up to max_tile_batch tiles of the same shape go through function in one call (function must
+    handle batches), the batch is halved when it runs out of memory. The tiles are blended on
+    accumulate_device (output_device by default), accumulating on the device function runs on
+    saves moving every tile to the output device.
+    """
     dims = len(tile)
+    if accumulate_device is None:
+        accumulate_device = output_device
 
     if not (isinstance(upscale_amount, (tuple, list))):
         upscale_amount = [upscale_amount] * dims
@@ -970,11 +1011,13 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_am
                 pbar.update(1)
             continue
 
-        out = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
-        out_div = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
+        out = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=accumulate_device)
+        out_div = torch.zeros([s.shape[0], 1] + mult_list_upscale(s.shape[2:]), device=accumulate_device)
 
         positions = [range(0, s.shape[d+2] - overlap[d], tile[d] - overlap[d]) if s.shape[d+2] > tile[d] else [0] for d in range(dims)]
 
+        # Tiles grouped by shape so they can be batched
+        groups = {}
         for it in itertools.product(*positions):
             s_in = s
             upscaled = []
@@ -985,35 +1028,46 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_am
                 s_in = s_in.narrow(d + 2, pos, l)
                 upscaled.append(round(get_pos(d, pos)))
 
-            ps = function(s_in).to(output_device)
-            mask = torch.ones_like(ps)
-
-            for d in range(2, dims + 2):
-                feather = round(get_scale(d - 2, overlap[d - 2]))
-                if feather >= mask.shape[d]:
+            groups.setdefault(tuple(s_in.shape), []).append((s_in, upscaled))
+
+        feathers = tuple(round(get_scale(d, overlap[d])) for d in range(dims))
+        for tiles in groups.values():
+            i = 0
+            while i < len(tiles):
+                batch = tiles[i:i + max_tile_batch]
+                oom = False
+                try:
+                    ps = function(torch.cat([t[0] for t in batch]) if len(batch) > 1 else batch[0][0]).to(accumulate_device)
+                except OOM_EXCEPTION:
+                    if len(batch) == 1:
+                        raise
+                    oom = True
+
+                if oom:
+                    max_tile_batch = max(1, len(batch) // 2)
+                    logging.warning("Ran out of memory with {} tiles per batch, retrying with {}.".format(len(batch), max_tile_batch))
                     continue
-                for t in range(feather):
-                    a = (t + 1) / feather
-                    mask.narrow(d, t, 1).mul_(a)
-                    mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
 
-            o = out
-            o_d = out_div
-            for d in range(dims):
-                o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
-                o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+                mask = feather_mask(tuple(ps.shape[2:]), feathers, ps.device)
+                for j, (_, upscaled) in enumerate(batch):
+                    o = out
+                    o_d = out_div
+                    for d in range(dims):
+                        o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+                        o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
 
-            o.add_(ps * mask)
-            o_d.add_(mask)
+                    o.add_(ps[j:j + 1] * mask)
+                    o_d.add_(mask)
 
-            if pbar is not None:
-                pbar.update(1)
+                i += len(batch)
+                if pbar is not None:
+                    pbar.update(len(batch))
 
-        output[b:b+1] = out/out_div
+        output[b:b+1] = (out / out_div).to(output_device)
     return output
 
-def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None):
-    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap=overlap, upscale_amount=upscale_amount, out_channels=out_channels, output_device=output_device, pbar=pbar)
+def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None, max_tile_batch=1, accumulate_device=None):
+    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap=overlap, upscale_amount=upscale_amount, out_channels=out_channels, output_device=output_device, pbar=pbar, max_tile_batch=max_tile_batch, accumulate_device=accumulate_device)
 
 PROGRESS_BAR_ENABLED = True
 def set_progress_bar_enabled(enabled):
@@ -0,0 +1,157 @@
+"""
+Measured peak memory of the VAE encode/decode calls, used to size their batches and tiles.
+
+VAE.encode/decode size their batches with memory_used_encode/memory_used_decode, static
+estimates per VAE type that are far off for some shapes (long video latents in particular):
+the decode either runs out of memory or uses a fraction of the device. The profile records what
+the calls really used on the device:
+
+- peak memory per sample, keyed by (VAE class, encode/decode, dtype, shape of one sample).
+  Once a shape was measured the batch size comes from the measurement instead of the estimate.
+- when a batch runs out of memory, a lower bound of the memory per sample (the free memory
+  divided by the batch size that failed), so the next run starts with a batch that fits.
+- peak memory per input element, keyed by (VAE class, encode/decode, dtype), used to pick the
+  largest tile that fits when even a single sample doesn't.
+
+The profile is stored in vae_memory_profile.json in the cache directory. Only CUDA devices
+report peak memory, on the other devices the static estimates are used.
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+import torch
+
+from comfy import model_management
+
+# Headroom kept on top of the measured peak memory
+MEMORY_MARGIN = 1.1
+# A measurement is only written to the profile when it differs this much from the stored one
+UPDATE_RATIO = 1.05
+
+
+def profile_key(model, kind, shape, dtype):
+    return "{}|{}|{}|{}".format(type(model).__name__, kind, str(dtype).replace("torch.", ""), "x".join(str(x) for x in shape[1:]))
+
+
+def element_key(model, kind, dtype):
+    return "{}|{}|{}|element".format(type(model).__name__, kind, str(dtype).replace("torch.", ""))
+
+
+class PeakMemory:
+    """Measures the peak memory allocated on the device while the block runs. bytes stays None on devices that don't report it."""
+    def __init__(self, device):
+        self.device = device
+        self.bytes = None
+
+    def __enter__(self):
+        self.start = None
+        if model_management.is_device_cuda(self.device):
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self.start = torch.cuda.memory_allocated(self.device)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.start is not None and exc_type is None:
+            self.bytes = max(torch.cuda.max_memory_allocated(self.device) - self.start, 1)
+
+
+class MemoryProfile:
+    def __init__(self, path=None):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self.lock = threading.RLock()
+        self.loaded = False
+
+    def set_path(self, path):
+        with self.lock:
+            self.path = path
+            self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Failed to read the VAE memory profile {}: {}".format(self.path, e))
+            return
+        for key, entry in entries.items():
+            self.entries.setdefault(key, entry)
+
+    def save(self):
+        with self.lock:
+            if self.path is None:
+                return
+            data = json.dumps(self.entries)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logging.warning("Failed to write the VAE memory profile {}: {}".format(self.path, e))
+
+    def get(self, key):
+        with self.lock:
+            self.load()
+            entry = self.entries.get(key, None)
+            return dict(entry) if entry is not None else None
+
+    def estimate(self, key, default):
+        """Memory per unit (sample or element) of this key: the measured peak if known, else the default raised to the out of memory bound."""
+        entry = self.get(key)
+        if entry is None:
+            return default
+        if entry.get("peak", None) is not None:
+            return max(entry["peak"] * MEMORY_MARGIN, entry.get("oom", 0))
+        return max(default, entry.get("oom", 0))
+
+    def record(self, key, peak):
+        """A call used peak bytes per unit (sample or element)."""
+        with self.lock:
+            self.load()
+            entry = self.entries.setdefault(key, {})
+            old = entry.get("peak", None)
+            if old is not None and max(old, peak) < min(old, peak) * UPDATE_RATIO:
+                return
+            entry["peak"] = peak
+            if entry.get("oom", 0) > peak * MEMORY_MARGIN:
+                entry["oom"] = peak * MEMORY_MARGIN
+        self.save()
+
+    def record_oom(self, key, bound):
+        """A call ran out of memory with bound bytes available per unit."""
+        with self.lock:
+            self.load()
+            entry = self.entries.setdefault(key, {})
+            entry["oom"] = max(entry.get("oom", 0), bound)
+            if entry.get("peak", None) is not None and entry["peak"] * MEMORY_MARGIN <= bound:
+                # The measurement is stale (other allocations, fragmentation)
+                del entry["peak"]
+        self.save()
+
+
+def tile_size_3d(element_bytes, budget, channels, frames, height, width, min_tile, min_frames=2):
+    """
+    The largest (tile, tile_t) square tile of frames x tile x tile input elements that fits in
+    budget. The spatial size is halved first, then the number of frames.
+    """
+    tile = max(height, width)
+    tile_t = frames
+    def size(tile, tile_t):
+        return element_bytes * channels * tile_t * tile * tile
+    while size(tile, tile_t) > budget and tile > min_tile:
+        tile = max(min_tile, tile // 2)
+    while size(tile, tile_t) > budget and tile_t > min_frames:
+        tile_t = max(min_frames, math.ceil(tile_t / 2))
+    return tile, tile_t
+
+
+profile = MemoryProfile()
@@ -1,7 +1,8 @@
-from .video_types import VideoFromFile, VideoFromComponents
+from .video_types import VideoFromFile, VideoFromComponents, VideoFromFrameStream
 
 __all__ = [
     # Implementations
     "VideoFromFile",
     "VideoFromComponents",
+    "VideoFromFrameStream",
 ]
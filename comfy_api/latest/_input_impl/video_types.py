@@ -2,13 +2,15 @@ from __future__ import annotations
 from av.container import InputContainer
 from av.subtitles.stream import SubtitleStream
 from fractions import Fraction
-from typing import Optional
+from typing import Callable, Iterable, Optional
 from comfy_api.latest._input import AudioInput, VideoInput
 import av
 import io
 import json
 import numpy as np
 import math
+import queue
+import threading
 import torch
 from comfy_api.latest._util import VideoContainer, VideoCodec, VideoComponents
 
@@ -238,6 +240,120 @@ class VideoFromFile(VideoInput):
                         packet.stream = stream_map[packet.stream]
                         output_container.mux(packet)
 
+class BackgroundMuxer:
+    """
+    Encodes and muxes uint8 frame chunks on a thread, so the frames of the next chunk can be
+    produced while the previous one is encoded. At most max_pending chunks wait in the queue.
+    """
+
+    def __init__(self, output, video_stream: av.VideoStream, max_pending: int = 2):
+        self.output = output
+        self.video_stream = video_stream
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.run, daemon=True, name="VideoMuxer")
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                for img in chunk:
+                    frame = av.VideoFrame.from_ndarray(img, format='rgb24')
+                    frame = frame.reformat(format='yuv420p')  # Convert to YUV420P as required by h264
+                    self.output.mux(self.video_stream.encode(frame))
+            except Exception as e:
+                self.error = e
+
+    def put(self, chunk: np.ndarray):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(chunk)
+
+    def close(self):
+        """Waits for the queued chunks to be muxed, raises the error of the encoder if it failed."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def frames_to_uint8(frames: torch.Tensor) -> np.ndarray:
+    return (frames * 255).clamp(0, 255).byte().cpu().numpy()
+
+
+def write_h264(
+    path: str | io.BytesIO,
+    chunks: Iterable[torch.Tensor],
+    width: int,
+    height: int,
+    frame_rate: Fraction,
+    audio: Optional[AudioInput] = None,
+    metadata: Optional[dict] = None,
+    background: bool = False,
+):
+    """
+    Writes frame chunks ([frames, H, W, 3] tensors with values between 0 and 1) to an h264 mp4.
+    With background the chunks are encoded on a thread while the next chunk is produced.
+    """
+    with av.open(path, mode='w', options={'movflags': 'use_metadata_tags'}) as output:
+        # Add metadata before writing any streams
+        if metadata is not None:
+            for key, value in metadata.items():
+                output.metadata[key] = json.dumps(value)
+
+        frame_rate = Fraction(round(frame_rate * 1000), 1000)
+        # Create a video stream
+        video_stream = output.add_stream('h264', rate=frame_rate)
+        video_stream.width = width
+        video_stream.height = height
+        video_stream.pix_fmt = 'yuv420p'
+
+        # Create an audio stream
+        audio_sample_rate = 1
+        audio_stream: Optional[av.AudioStream] = None
+        if audio:
+            audio_sample_rate = int(audio['sample_rate'])
+            audio_stream = output.add_stream('aac', rate=audio_sample_rate)
+
+        # Encode video
+        frame_count = 0
+        muxer = BackgroundMuxer(output, video_stream) if background else None
+        try:
+            for chunk in chunks:
+                frames = frames_to_uint8(chunk)
+                frame_count += frames.shape[0]
+                if muxer is not None:
+                    muxer.put(frames)
+                    continue
+                for img in frames:
+                    frame = av.VideoFrame.from_ndarray(img, format='rgb24')
+                    frame = frame.reformat(format='yuv420p')  # Convert to YUV420P as required by h264
+                    output.mux(video_stream.encode(frame))
+        finally:
+            if muxer is not None:
+                muxer.close()
+
+        # Flush video
+        packet = video_stream.encode(None)
+        output.mux(packet)
+
+        if audio_stream and audio:
+            waveform = audio['waveform']
+            waveform = waveform[:, :, :math.ceil((audio_sample_rate / frame_rate) * frame_count)]
+            frame = av.AudioFrame.from_ndarray(waveform.movedim(2, 1).reshape(1, -1).float().numpy(), format='flt', layout='mono' if waveform.shape[1] == 1 else 'stereo')
+            frame.sample_rate = audio_sample_rate
+            frame.pts = 0
+            output.mux(audio_stream.encode(frame))
+
+            # Flush encoder
+            output.mux(audio_stream.encode(None))
+
+
 class VideoFromComponents(VideoInput):
     """
     Class representing video input from tensors.
@@ -264,45 +380,60 @@ class VideoFromComponents(VideoInput):
             raise ValueError("Only MP4 format is supported for now")
         if codec != VideoCodec.AUTO and codec != VideoCodec.H264:
             raise ValueError("Only H264 codec is supported for now")
-        with av.open(path, mode='w', options={'movflags': 'use_metadata_tags'}) as output:
-            # Add metadata before writing any streams
-            if metadata is not None:
-                for key, value in metadata.items():
-                    output.metadata[key] = json.dumps(value)
-
-            frame_rate = Fraction(round(self.__components.frame_rate * 1000), 1000)
-            # Create a video stream
-            video_stream = output.add_stream('h264', rate=frame_rate)
-            video_stream.width = self.__components.images.shape[2]
-            video_stream.height = self.__components.images.shape[1]
-            video_stream.pix_fmt = 'yuv420p'
-
-            # Create an audio stream
-            audio_sample_rate = 1
-            audio_stream: Optional[av.AudioStream] = None
-            if self.__components.audio:
-                audio_sample_rate = int(self.__components.audio['sample_rate'])
-                audio_stream = output.add_stream('aac', rate=audio_sample_rate)
-
-            # Encode video
-            for i, frame in enumerate(self.__components.images):
-                img = (frame * 255).clamp(0, 255).byte().cpu().numpy() # shape: (H, W, 3)
-                frame = av.VideoFrame.from_ndarray(img, format='rgb24')
-                frame = frame.reformat(format='yuv420p')  # Convert to YUV420P as required by h264
-                packet = video_stream.encode(frame)
-                output.mux(packet)
-
-            # Flush video
-            packet = video_stream.encode(None)
-            output.mux(packet)
-
-            if audio_stream and self.__components.audio:
-                waveform = self.__components.audio['waveform']
-                waveform = waveform[:, :, :math.ceil((audio_sample_rate / frame_rate) * self.__components.images.shape[0])]
-                frame = av.AudioFrame.from_ndarray(waveform.movedim(2, 1).reshape(1, -1).float().numpy(), format='flt', layout='mono' if waveform.shape[1] == 1 else 'stereo')
-                frame.sample_rate = audio_sample_rate
-                frame.pts = 0
-                output.mux(audio_stream.encode(frame))
-
-                # Flush encoder
-                output.mux(audio_stream.encode(None))
+        images = self.__components.images
+        write_h264(path, [images], images.shape[2], images.shape[1], self.__components.frame_rate, audio=self.__components.audio, metadata=metadata)
+
+
+class VideoFromFrameStream(VideoInput):
+    """
+    Class representing a video whose frames are produced in chunks, for example decoded from a
+    latent a few frames at a time. Saving it encodes each chunk as soon as it is produced so only
+    a chunk of frames is in memory at a time. The frames are produced again every time the video
+    is saved or its components are requested.
+    """
+
+    def __init__(
+        self,
+        frames: Callable[[], Iterable[torch.Tensor]],
+        width: int,
+        height: int,
+        frame_rate: Fraction,
+        frame_count: Optional[int] = None,
+        audio: Optional[AudioInput] = None,
+    ):
+        """
+        frames is called to produce the chunks of frames, [frames, height, width, 3] tensors with
+        values between 0 and 1.
+        """
+        self.__frames = frames
+        self.__width = width
+        self.__height = height
+        self.__frame_rate = frame_rate
+        self.__frame_count = frame_count
+        self.__audio = audio
+
+    def get_components(self) -> VideoComponents:
+        chunks = [chunk.cpu() for chunk in self.__frames()]
+        images = torch.cat(chunks) if len(chunks) > 0 else torch.zeros(0, self.__height, self.__width, 3)
+        return VideoComponents(images=images, audio=self.__audio, frame_rate=self.__frame_rate)
+
+    def get_dimensions(self) -> tuple[int, int]:
+        return self.__width, self.__height
+
+    def get_duration(self) -> float:
+        if self.__frame_count is None:
+            return super().get_duration()
+        return float(self.__frame_count / self.__frame_rate)
+
+    def save_to(
+        self,
+        path: str,
+        format: VideoContainer = VideoContainer.AUTO,
+        codec: VideoCodec = VideoCodec.AUTO,
+        metadata: Optional[dict] = None
+    ):
+        if format != VideoContainer.AUTO and format != VideoContainer.MP4:
+            raise ValueError("Only MP4 format is supported for now")
+        if codec != VideoCodec.AUTO and codec != VideoCodec.H264:
+            raise ValueError("Only H264 codec is supported for now")
+        write_h264(path, self.__frames(), self.__width, self.__height, self.__frame_rate, audio=self.__audio, metadata=metadata, background=True)
@@ -140,17 +140,18 @@ class ImageSaveHelper:
     ) -> list[SavedResult]:
         """Saves a batch of images as individual PNG files."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], len(images), suffix="_.png"
         )
         results = []
         metadata = ImageSaveHelper._create_png_metadata(cls)
-        for batch_number, image_tensor in enumerate(images):
-            img = ImageSaveHelper._convert_tensor_to_pil(image_tensor)
-            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
-            file = f"{filename_with_batch_num}_{counter:05}_.png"
-            img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level)
-            results.append(SavedResult(file, subfolder, folder_type))
-            counter += 1
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, len(images), "_.png"):
+            for batch_number, image_tensor in enumerate(images):
+                img = ImageSaveHelper._convert_tensor_to_pil(image_tensor)
+                filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
+                file = f"{filename_with_batch_num}_{counter:05}_.png"
+                img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level)
+                results.append(SavedResult(file, subfolder, folder_type))
+                counter += 1
         return results
 
     @staticmethod
@@ -172,20 +173,21 @@ class ImageSaveHelper:
     ) -> SavedResult:
         """Saves a batch of images as a single animated PNG."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
-        )
-        pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
-        metadata = ImageSaveHelper._create_animated_png_metadata(cls)
-        file = f"{filename}_{counter:05}_.png"
-        save_path = os.path.join(full_output_folder, file)
-        pil_images[0].save(
-            save_path,
-            pnginfo=metadata,
-            compress_level=compress_level,
-            save_all=True,
-            duration=int(1000.0 / fps),
-            append_images=pil_images[1:],
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], suffix="_.png"
         )
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, 1, "_.png"):
+            pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
+            metadata = ImageSaveHelper._create_animated_png_metadata(cls)
+            file = f"{filename}_{counter:05}_.png"
+            save_path = os.path.join(full_output_folder, file)
+            pil_images[0].save(
+                save_path,
+                pnginfo=metadata,
+                compress_level=compress_level,
+                save_all=True,
+                duration=int(1000.0 / fps),
+                append_images=pil_images[1:],
+            )
         return SavedResult(file, subfolder, folder_type)
 
     @staticmethod
@@ -216,21 +218,22 @@ class ImageSaveHelper:
     ) -> SavedResult:
         """Saves a batch of images as a single animated WebP."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
-        )
-        pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
-        pil_exif = ImageSaveHelper._create_webp_metadata(pil_images[0], cls)
-        file = f"{filename}_{counter:05}_.webp"
-        pil_images[0].save(
-            os.path.join(full_output_folder, file),
-            save_all=True,
-            duration=int(1000.0 / fps),
-            append_images=pil_images[1:],
-            exif=pil_exif,
-            lossless=lossless,
-            quality=quality,
-            method=method,
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], suffix="_.webp"
         )
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, 1, "_.webp"):
+            pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
+            pil_exif = ImageSaveHelper._create_webp_metadata(pil_images[0], cls)
+            file = f"{filename}_{counter:05}_.webp"
+            pil_images[0].save(
+                os.path.join(full_output_folder, file),
+                save_all=True,
+                duration=int(1000.0 / fps),
+                append_images=pil_images[1:],
+                exif=pil_exif,
+                lossless=lossless,
+                quality=quality,
+                method=method,
+            )
         return SavedResult(file, subfolder, folder_type)
 
     @staticmethod
@@ -271,7 +274,7 @@ class AudioSaveHelper:
         quality: str = "128k",
     ) -> list[SavedResult]:
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type)
+            filename_prefix, _get_directory_by_folder_type(folder_type), batch_size=len(audio["waveform"]), suffix=f"_.{format}"
         )
 
         metadata = {}
@@ -283,88 +286,89 @@ class AudioSaveHelper:
                     metadata[x] = json.dumps(cls.hidden.extra_pnginfo[x])
 
         results = []
-        for batch_number, waveform in enumerate(audio["waveform"].cpu()):
-            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
-            file = f"{filename_with_batch_num}_{counter:05}_.{format}"
-            output_path = os.path.join(full_output_folder, file)
-
-            # Use original sample rate initially
-            sample_rate = audio["sample_rate"]
-
-            # Handle Opus sample rate requirements
-            if format == "opus":
-                if sample_rate > 48000:
-                    sample_rate = 48000
-                elif sample_rate not in AudioSaveHelper._OPUS_RATES:
-                    # Find the next highest supported rate
-                    for rate in sorted(AudioSaveHelper._OPUS_RATES):
-                        if rate > sample_rate:
-                            sample_rate = rate
-                            break
-                    if sample_rate not in AudioSaveHelper._OPUS_RATES:  # Fallback if still not supported
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, len(audio["waveform"]), f"_.{format}"):
+            for batch_number, waveform in enumerate(audio["waveform"].cpu()):
+                filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
+                file = f"{filename_with_batch_num}_{counter:05}_.{format}"
+                output_path = os.path.join(full_output_folder, file)
+
+                # Use original sample rate initially
+                sample_rate = audio["sample_rate"]
+
+                # Handle Opus sample rate requirements
+                if format == "opus":
+                    if sample_rate > 48000:
                         sample_rate = 48000
+                    elif sample_rate not in AudioSaveHelper._OPUS_RATES:
+                        # Find the next highest supported rate
+                        for rate in sorted(AudioSaveHelper._OPUS_RATES):
+                            if rate > sample_rate:
+                                sample_rate = rate
+                                break
+                        if sample_rate not in AudioSaveHelper._OPUS_RATES:  # Fallback if still not supported
+                            sample_rate = 48000
+
+                    # Resample if necessary
+                    if sample_rate != audio["sample_rate"]:
+                        if not TORCH_AUDIO_AVAILABLE:
+                            raise Exception("torchaudio is not available; cannot resample audio.")
+                        waveform = torchaudio.functional.resample(waveform, audio["sample_rate"], sample_rate)
+
+                # Create output with specified format
+                output_buffer = BytesIO()
+                output_container = av.open(output_buffer, mode="w", format=format)
+
+                # Set metadata on the container
+                for key, value in metadata.items():
+                    output_container.metadata[key] = value
+
+                # Set up the output stream with appropriate properties
+                if format == "opus":
+                    out_stream = output_container.add_stream("libopus", rate=sample_rate)
+                    if quality == "64k":
+                        out_stream.bit_rate = 64000
+                    elif quality == "96k":
+                        out_stream.bit_rate = 96000
+                    elif quality == "128k":
+                        out_stream.bit_rate = 128000
+                    elif quality == "192k":
+                        out_stream.bit_rate = 192000
+                    elif quality == "320k":
+                        out_stream.bit_rate = 320000
+                elif format == "mp3":
+                    out_stream = output_container.add_stream("libmp3lame", rate=sample_rate)
+                    if quality == "V0":
+                        # TODO i would really love to support V3 and V5 but there doesn't seem to be a way to set the qscale level, the property below is a bool
+                        out_stream.codec_context.qscale = 1
+                    elif quality == "128k":
+                        out_stream.bit_rate = 128000
+                    elif quality == "320k":
+                        out_stream.bit_rate = 320000
+                else:  # format == "flac":
+                    out_stream = output_container.add_stream("flac", rate=sample_rate)
+
+                frame = av.AudioFrame.from_ndarray(
+                    waveform.movedim(0, 1).reshape(1, -1).float().numpy(),
+                    format="flt",
+                    layout="mono" if waveform.shape[0] == 1 else "stereo",
+                )
+                frame.sample_rate = sample_rate
+                frame.pts = 0
+                output_container.mux(out_stream.encode(frame))
 
-                # Resample if necessary
-                if sample_rate != audio["sample_rate"]:
-                    if not TORCH_AUDIO_AVAILABLE:
-                        raise Exception("torchaudio is not available; cannot resample audio.")
-                    waveform = torchaudio.functional.resample(waveform, audio["sample_rate"], sample_rate)
-
-            # Create output with specified format
-            output_buffer = BytesIO()
-            output_container = av.open(output_buffer, mode="w", format=format)
-
-            # Set metadata on the container
-            for key, value in metadata.items():
-                output_container.metadata[key] = value
-
-            # Set up the output stream with appropriate properties
-            if format == "opus":
-                out_stream = output_container.add_stream("libopus", rate=sample_rate)
-                if quality == "64k":
-                    out_stream.bit_rate = 64000
-                elif quality == "96k":
-                    out_stream.bit_rate = 96000
-                elif quality == "128k":
-                    out_stream.bit_rate = 128000
-                elif quality == "192k":
-                    out_stream.bit_rate = 192000
-                elif quality == "320k":
-                    out_stream.bit_rate = 320000
-            elif format == "mp3":
-                out_stream = output_container.add_stream("libmp3lame", rate=sample_rate)
-                if quality == "V0":
-                    # TODO i would really love to support V3 and V5 but there doesn't seem to be a way to set the qscale level, the property below is a bool
-                    out_stream.codec_context.qscale = 1
-                elif quality == "128k":
-                    out_stream.bit_rate = 128000
-                elif quality == "320k":
-                    out_stream.bit_rate = 320000
-            else:  # format == "flac":
-                out_stream = output_container.add_stream("flac", rate=sample_rate)
-
-            frame = av.AudioFrame.from_ndarray(
-                waveform.movedim(0, 1).reshape(1, -1).float().numpy(),
-                format="flt",
-                layout="mono" if waveform.shape[0] == 1 else "stereo",
-            )
-            frame.sample_rate = sample_rate
-            frame.pts = 0
-            output_container.mux(out_stream.encode(frame))
-
-            # Flush encoder
-            output_container.mux(out_stream.encode(None))
+                # Flush encoder
+                output_container.mux(out_stream.encode(None))
 
-            # Close containers
-            output_container.close()
+                # Close containers
+                output_container.close()
 
-            # Write the output to file
-            output_buffer.seek(0)
-            with open(output_path, "wb") as f:
-                f.write(output_buffer.getbuffer())
+                # Write the output to file
+                output_buffer.seek(0)
+                with open(output_path, "wb") as f:
+                    f.write(output_buffer.getbuffer())
 
-            results.append(SavedResult(file, subfolder, folder_type))
-            counter += 1
+                results.append(SavedResult(file, subfolder, folder_type))
+                counter += 1
 
         return results
 
@@ -0,0 +1,364 @@
+"""
+Samples queued prompts that only differ in their seed or prompt text as one batch.
+
+When a worker starts a prompt (the leader) it picks the queued prompts of the same client whose
+sampler nodes have the same inputs except for the seed, or for the text of a CLIPTextEncode node
+plugged straight into positive/negative. They stay in the queue, so they can still be deleted.
+When the leader reaches such a sampler node the latents of every prompt still queued are
+denoised by a single sampling call, the leader keeps its slice of the batch and the slices of
+the other prompts are kept until they run. The other prompts are then taken from the queue and
+execute normally right after the leader (so they get their own outputs and history entry) and
+their sampler node returns the stored result instead of sampling again. When the fused batch
+runs out of memory every prompt samples on its own.
+
+Only the samplers that don't draw noise from the seed during sampling are fused: with the
+ancestral/SDE samplers the noise of every image in the batch comes from the seed of the first
+prompt so the result would change with the batching.
+"""
+import logging
+import threading
+
+import torch
+
+import comfy.model_management
+import comfy.sample
+import comfy.utils
+import latent_preview
+import nodes
+from comfy_execution.graph_utils import is_link
+from comfy_execution.scheduler import item_client, item_priority
+
+# Sampler nodes that can be fused and their seed input
+SAMPLER_SEED_INPUTS = {
+    "KSampler": "seed",
+    "KSamplerAdvanced": "noise_seed",
+}
+
+# Text encode nodes whose text can differ between fused prompts and their text input
+TEXT_INPUTS = {
+    "CLIPTextEncode": "text",
+}
+
+CONDITIONING_INPUTS = ("positive", "negative")
+
+# Samplers whose result only depends on the initial noise
+DETERMINISTIC_SAMPLERS = {
+    "euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+    "ipndm", "ipndm_v", "deis", "res_multistep", "res_multistep_cfg_pp", "gradient_estimation",
+    "gradient_estimation_cfg_pp", "uni_pc", "uni_pc_bh2",
+}
+
+
+def same_link(prompt_a, link_a, prompt_b, link_b, memo):
+    """True if the two links point to the same output of nodes with the same inputs."""
+    if link_a[1] != link_b[1]:
+        return False
+    return same_node(prompt_a, link_a[0], prompt_b, link_b[0], memo)
+
+
+def same_node(prompt_a, id_a, prompt_b, id_b, memo, ignore=()):
+    key = (id_a, id_b, ignore)
+    if key in memo:
+        return memo[key]
+    memo[key] = False
+    node_a = prompt_a.get(id_a, None)
+    node_b = prompt_b.get(id_b, None)
+    if node_a is None or node_b is None or node_a.get("class_type") != node_b.get("class_type"):
+        return False
+    inputs_a = node_a.get("inputs", {})
+    inputs_b = node_b.get("inputs", {})
+    if inputs_a.keys() != inputs_b.keys():
+        return False
+    for name, value_a in inputs_a.items():
+        if name in ignore:
+            continue
+        value_b = inputs_b[name]
+        if is_link(value_a) and is_link(value_b):
+            if not same_link(prompt_a, value_a, prompt_b, value_b, memo):
+                return False
+        elif is_link(value_a) or is_link(value_b) or value_a != value_b:
+            return False
+    memo[key] = True
+    return True
+
+
+class FusedSampler:
+    """How a sampler node of a fused prompt differs from the one of the leader."""
+    def __init__(self, seed, texts):
+        self.seed = seed
+        # conditioning input -> text of the CLIPTextEncode node plugged into it
+        self.texts = texts
+
+
+def fused_sampler(leader, node_id, prompt):
+    """The FusedSampler of this node of prompt or None if it can't be sampled with the leader."""
+    node_a = leader[node_id]
+    node_b = prompt.get(node_id, None)
+    class_type = node_a.get("class_type")
+    if node_b is None or node_b.get("class_type") != class_type:
+        return None
+    inputs_a = node_a.get("inputs", {})
+    inputs_b = node_b.get("inputs", {})
+    if inputs_a.keys() != inputs_b.keys() or inputs_a.get("sampler_name") not in DETERMINISTIC_SAMPLERS:
+        return None
+
+    seed_input = SAMPLER_SEED_INPUTS[class_type]
+    seed = inputs_b.get(seed_input)
+    if is_link(seed) or is_link(inputs_a.get(seed_input)):
+        return None
+    memo = {}
+    texts = {}
+    for name, value_a in inputs_a.items():
+        value_b = inputs_b[name]
+        if name == seed_input:
+            continue
+        if is_link(value_a) and is_link(value_b):
+            if same_link(leader, value_a, prompt, value_b, memo):
+                continue
+            if name not in CONDITIONING_INPUTS or value_a[1] != 0 or value_b[1] != 0:
+                return None
+            text_a = leader.get(value_a[0], {})
+            text_b = prompt.get(value_b[0], {})
+            text_input = TEXT_INPUTS.get(text_a.get("class_type"), None)
+            if text_input is None or not same_node(leader, value_a[0], prompt, value_b[0], memo, ignore=(text_input,)):
+                return None
+            text = text_b["inputs"].get(text_input)
+            if not isinstance(text, str) or not isinstance(text_a["inputs"].get(text_input), str):
+                return None
+            texts[name] = text
+        elif is_link(value_a) or is_link(value_b) or value_a != value_b:
+            return None
+
+    if seed == inputs_a.get(seed_input) and len(texts) == 0:
+        # Same inputs, the node output cache takes care of it
+        return None
+    return FusedSampler(seed, texts)
+
+
+def fusion_plan(leader, prompt):
+    """{sampler node_id: FusedSampler} of the sampler nodes of prompt that can be sampled with the ones of the leader."""
+    plan = {}
+    for node_id, node in leader.items():
+        if isinstance(node, dict) and node.get("class_type") in SAMPLER_SEED_INPUTS:
+            fused = fused_sampler(leader, node_id, prompt)
+            if fused is not None:
+                plan[node_id] = fused
+    return plan
+
+
+def concat_conditioning(conditionings, batch_size):
+    """
+    Concatenates the conditioning of each prompt (repeated to its latent batch size) into the
+    conditioning of the fused batch. None if they don't have the same structure and shapes.
+    """
+    first = conditionings[0]
+    if all(c is first for c in conditionings):
+        return first
+    if any(len(c) != len(first) for c in conditionings):
+        return None
+    out = []
+    for i in range(len(first)):
+        entries = [c[i] for c in conditionings]
+        tensors = [e[0] for e in entries]
+        if any(t.shape[1:] != tensors[0].shape[1:] for t in tensors):
+            return None
+        if any(e[1].keys() != entries[0][1].keys() for e in entries):
+            return None
+        values = {}
+        for k, v in entries[0][1].items():
+            others = [e[1][k] for e in entries]
+            if torch.is_tensor(v):
+                if any(not torch.is_tensor(o) or o.shape[1:] != v.shape[1:] for o in others):
+                    return None
+                values[k] = torch.cat([comfy.utils.repeat_to_batch_size(o, batch_size) for o in others])
+            elif all(o is v for o in others):
+                values[k] = v
+            else:
+                return None
+        out.append([torch.cat([comfy.utils.repeat_to_batch_size(t, batch_size) for t in tensors]), values])
+    return out
+
+
+def sampler_arguments(class_type, inputs):
+    """The common_ksampler arguments of a KSampler/KSamplerAdvanced node."""
+    args = {name: inputs[name] for name in ("model", "steps", "cfg", "sampler_name", "scheduler", "positive", "negative") if name in inputs}
+    args["latent"] = inputs["latent_image"]
+    args["denoise"] = inputs.get("denoise", 1.0)
+    if class_type == "KSamplerAdvanced":
+        args["disable_noise"] = inputs["add_noise"] == "disable"
+        args["start_step"] = inputs["start_at_step"]
+        args["last_step"] = inputs["end_at_step"]
+        args["force_full_denoise"] = inputs["return_with_leftover_noise"] != "enable"
+    return args
+
+
+def ksampler_batched(model, seeds, steps, cfg, sampler_name, scheduler, positive, negative, latent, denoise=1.0, disable_noise=False, start_step=None, last_step=None, force_full_denoise=False):
+    """
+    common_ksampler with one set of noise per seed, sampled in a single batch. positive and
+    negative are the concatenated conditionings of every seed. Returns one latent per seed.
+    """
+    latent_image = comfy.sample.fix_empty_latent_channels(model, latent["samples"])
+    batch_size = latent_image.shape[0]
+    count = len(seeds)
+
+    if disable_noise:
+        noise = torch.zeros((batch_size * count,) + tuple(latent_image.shape[1:]), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
+    else:
+        batch_inds = latent["batch_index"] if "batch_index" in latent else None
+        noise = torch.cat([comfy.sample.prepare_noise(latent_image, seed, batch_inds) for seed in seeds])
+    latent_batch = latent_image.repeat((count,) + (1,) * (latent_image.ndim - 1))
+
+    # The noise mask is repeated to the batch size like the latent
+    noise_mask = latent.get("noise_mask", None)
+
+    callback = latent_preview.prepare_callback(model, steps)
+    disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
+    samples = comfy.sample.sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_batch,
+                                  denoise=denoise, disable_noise=disable_noise, start_step=start_step, last_step=last_step,
+                                  force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seeds[0])
+    out = []
+    for chunk in samples.split(batch_size):
+        o = latent.copy()
+        o["samples"] = chunk
+        out.append(o)
+    return out
+
+
+# (sampler class, latent shape) -> smallest number of fused prompts that ran out of memory
+out_of_memory = {}
+out_of_memory_lock = threading.Lock()
+
+
+class FusionGroup:
+    """A leader prompt and the queued prompts that get sampled with it."""
+    def __init__(self, item, max_size, is_queued=None):
+        self.leader = item[1]
+        # is_queued(prompt_id) tells if a picked prompt is still in the queue
+        self.is_queued = is_queued
+        self.prompt = item[2]
+        self.client_id = item_client(item)
+        self.priority = item_priority(item)
+        self.max_size = max_size
+        # sampler node_id -> [(prompt_id, FusedSampler)]
+        self.members = {}
+        # (prompt_id, node_id) -> output data of the sampler node
+        self.results = {}
+        self.prompt_ids = [self.leader]
+        register(self)
+
+    def add(self, item):
+        """Adds a queued item to the group if it can be sampled with the leader, used to pick the items in the queue."""
+        if len(self.prompt_ids) >= self.max_size or item_client(item) != self.client_id or item_priority(item) != self.priority:
+            return False
+        plan = fusion_plan(self.prompt, item[2])
+        if len(plan) == 0:
+            return False
+        for node_id, fused in plan.items():
+            self.members.setdefault(node_id, []).append((item[1], fused))
+        self.prompt_ids.append(item[1])
+        register(self)
+        return True
+
+    def close(self):
+        unregister(self)
+        self.results.clear()
+
+    def encode_text(self, node_id, name, text, caches):
+        """Encodes the text of another prompt with the CLIP of the leader's text encode node plugged into this input."""
+        text_node = self.prompt[self.prompt[node_id]["inputs"][name][0]]
+        clip_link = text_node["inputs"].get("clip", None)
+        if not is_link(clip_link):
+            return None
+        cached = caches.outputs.get(clip_link[0])
+        if cached is None or cached.outputs is None or len(cached.outputs) <= clip_link[1]:
+            return None
+        clip = cached.outputs[clip_link[1]][0]
+        text_encode = nodes.NODE_CLASS_MAPPINGS[text_node["class_type"]]()
+        return getattr(text_encode, text_encode.FUNCTION)(clip=clip, text=text)[0]
+
+    def sample(self, node_id, input_data_all, caches):
+        if any(len(v) != 1 for v in input_data_all.values()):
+            return None
+        inputs = {k: v[0] for k, v in input_data_all.items()}
+        class_type = self.prompt[node_id]["class_type"]
+        args = sampler_arguments(class_type, inputs)
+        if args["latent"]["samples"].is_nested:
+            return None
+        batch_size = args["latent"]["samples"].shape[0]
+
+        oom_key = (class_type, tuple(args["latent"]["samples"].shape))
+        with out_of_memory_lock:
+            max_count = out_of_memory.get(oom_key, self.max_size + 1) - 1
+
+        members = []
+        conditionings = {name: [inputs[name]] for name in CONDITIONING_INPUTS}
+        for prompt_id, fused in self.members[node_id]:
+            if len(members) + 1 >= max_count:
+                break
+            if self.is_queued is not None and not self.is_queued(prompt_id):
+                continue
+            encoded = {}
+            for name, text in fused.texts.items():
+                encoded[name] = self.encode_text(node_id, name, text, caches)
+                if encoded[name] is None:
+                    break
+            else:
+                candidate = {name: conditionings[name] + [encoded.get(name, inputs[name])] for name in CONDITIONING_INPUTS}
+                if all(concat_conditioning(c, batch_size) is not None for c in candidate.values()):
+                    conditionings = candidate
+                    members.append((prompt_id, fused))
+        if len(members) == 0:
+            return None
+
+        for name in CONDITIONING_INPUTS:
+            args[name] = concat_conditioning(conditionings[name], batch_size)
+        seeds = [inputs[SAMPLER_SEED_INPUTS[class_type]]] + [fused.seed for _, fused in members]
+        logging.info("Sampling node {} of {} prompts as one batch".format(node_id, len(seeds)))
+        try:
+            latents = ksampler_batched(seeds=seeds, **args)
+        except comfy.model_management.InterruptProcessingException:
+            raise
+        except comfy.model_management.OOM_EXCEPTION:
+            latents = None
+        if latents is None:
+            # The prompts would have run alone, sample them one by one
+            logging.warning("Ran out of memory sampling node {} of {} prompts as one batch, sampling them separately.".format(node_id, len(seeds)))
+            with out_of_memory_lock:
+                out_of_memory[oom_key] = min(out_of_memory.get(oom_key, len(seeds)), len(seeds))
+            comfy.model_management.soft_empty_cache()
+            return None
+        for (prompt_id, _), latent in zip(members, latents[1:]):
+            self.results[(prompt_id, node_id)] = [[latent]]
+        return [[latents[0]]]
+
+    def output(self, prompt_id, node_id, input_data_all, caches):
+        result = self.results.pop((prompt_id, node_id), None)
+        if result is not None:
+            return result
+        if prompt_id == self.leader and node_id in self.members:
+            return self.sample(node_id, input_data_all, caches)
+        return None
+
+
+groups_lock = threading.Lock()
+groups = {}
+
+def register(group):
+    with groups_lock:
+        for prompt_id in group.prompt_ids:
+            groups[prompt_id] = group
+
+def unregister(group):
+    with groups_lock:
+        for prompt_id in group.prompt_ids:
+            if groups.get(prompt_id, None) is group:
+                del groups[prompt_id]
+
+
+def fused_output(prompt_id, node_id, input_data_all, caches):
+    """The output data of a sampler node computed in a fused batch, None if the node should be executed normally."""
+    with groups_lock:
+        group = groups.get(prompt_id, None)
+    if group is None:
+        return None
+    return group.output(prompt_id, node_id, input_data_all, caches)
@@ -1,14 +1,36 @@
 import bisect
 import gc
+import hashlib
 import itertools
+import json
+import logging
+import math
+import os
 import psutil
+import struct
+import threading
 import time
 import torch
-from typing import Sequence, Mapping, Dict
+import weakref
+import numpy as np
+import safetensors.torch
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
 
 import nodes
+from comfy.cli_args import args
+from comfyui_version import __version__
+
+try:
+    import xxhash
+    def content_hasher():
+        return xxhash.xxh3_128()
+except ImportError:
+    def content_hasher():
+        return hashlib.blake2b(digest_size=16)
 
 from comfy_execution.graph_utils import is_link
 
@@ -50,6 +72,55 @@ class Unhashable:
     def __init__(self):
         self.value = float("NaN")
 
+# Maps a type to a function returning a fingerprint for its instances: a value made of
+# primitives, mappings and sequences that changes whenever the content of the object does.
+FINGERPRINT_FUNCTIONS: Dict[type, Callable[[Any], Any]] = {}
+
+def register_fingerprint(obj_type: type, function: Callable[[Any], Any]):
+    """
+    Lets objects of obj_type be part of cache keys. Subclasses use the function
+    registered for their closest base class. Returning None marks an object as unhashable.
+    """
+    FINGERPRINT_FUNCTIONS[obj_type] = function
+
+def get_fingerprint(obj):
+    for obj_type in type(obj).__mro__:
+        function = FINGERPRINT_FUNCTIONS.get(obj_type, None)
+        if function is not None:
+            return function(obj)
+    return None
+
+# Tensors larger than this are only partially read with --cache-tensor-hash sampled
+TENSOR_SAMPLE_THRESHOLD = 16 * 1024 * 1024
+TENSOR_SAMPLE_COUNT = 64
+TENSOR_SAMPLE_SIZE = 64 * 1024
+
+def hash_buffer(data: memoryview, sampled: bool) -> bytes:
+    hasher = content_hasher()
+    size = data.nbytes
+    if sampled and size > TENSOR_SAMPLE_THRESHOLD:
+        stride = (size - TENSOR_SAMPLE_SIZE) // (TENSOR_SAMPLE_COUNT - 1)
+        for i in range(TENSOR_SAMPLE_COUNT):
+            hasher.update(data[i * stride:i * stride + TENSOR_SAMPLE_SIZE])
+    else:
+        hasher.update(data)
+    return hasher.digest()
+
+def tensor_fingerprint(tensor: torch.Tensor):
+    if args.cache_tensor_hash == "none" or tensor.is_sparse or tensor.is_nested:
+        return None
+    data = tensor.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8).numpy()
+    return ("tensor", str(tensor.dtype), list(tensor.shape), hash_buffer(memoryview(data), args.cache_tensor_hash == "sampled"))
+
+def ndarray_fingerprint(array: np.ndarray):
+    if args.cache_tensor_hash == "none" or array.dtype.hasobject:
+        return None
+    data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+    return ("ndarray", array.dtype.str, list(array.shape), hash_buffer(memoryview(data), args.cache_tensor_hash == "sampled"))
+
+register_fingerprint(torch.Tensor, tensor_fingerprint)
+register_fingerprint(np.ndarray, ndarray_fingerprint)
+
 def to_hashable(obj):
     # So that we don't infinitely recurse since frozenset and tuples
     # are Sequences.
@@ -60,8 +131,52 @@ def to_hashable(obj):
     elif isinstance(obj, Sequence):
         return frozenset(zip(itertools.count(), [to_hashable(i) for i in obj]))
     else:
-        # TODO - Support other objects like tensors?
-        return Unhashable()
+        fingerprint = get_fingerprint(obj)
+        if fingerprint is None:
+            return Unhashable()
+        return ("FINGERPRINT", type(obj).__qualname__, to_hashable(fingerprint))
+
+def update_hash(hasher, obj) -> bool:
+    """
+    Feeds a canonical encoding of obj into hasher. Every value is prefixed with a
+    type tag (and containers with their length) so different structures can't
+    produce the same byte stream. Returns False if obj can't be hashed, in which
+    case the result must not be used as a cache key.
+    """
+    if obj is None:
+        hasher.update(b"N")
+    elif isinstance(obj, bool):
+        hasher.update(b"T" if obj else b"F")
+    elif isinstance(obj, int):
+        data = str(obj).encode()
+        hasher.update(b"i" + struct.pack("<Q", len(data)) + data)
+    elif isinstance(obj, float):
+        # NaN never equals itself, IS_CHANGED returns it to force a node to execute again
+        if math.isnan(obj):
+            return False
+        hasher.update(b"f" + struct.pack("<d", obj))
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8", "surrogatepass")
+        hasher.update(b"s" + struct.pack("<Q", len(data)) + data)
+    elif isinstance(obj, bytes):
+        hasher.update(b"b" + struct.pack("<Q", len(obj)) + obj)
+    elif isinstance(obj, Mapping):
+        hasher.update(b"m" + struct.pack("<Q", len(obj)))
+        for k, v in sorted(obj.items()):
+            if not update_hash(hasher, k) or not update_hash(hasher, v):
+                return False
+    elif isinstance(obj, Sequence):
+        hasher.update(b"l" + struct.pack("<Q", len(obj)))
+        for i in obj:
+            if not update_hash(hasher, i):
+                return False
+    else:
+        fingerprint = get_fingerprint(obj)
+        if fingerprint is None:
+            return False
+        # The type is part of the key so objects of different types can't collide
+        return update_hash(hasher, ("o", type(obj).__module__, type(obj).__qualname__, fingerprint))
+    return True
 
 class CacheKeySetID(CacheKeySet):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
@@ -79,10 +194,15 @@ class CacheKeySetID(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
 class CacheKeySetInputSignature(CacheKeySet):
+    # Node digests only depend on the prompt, so they are shared by every cache
+    # (and subcache) that computes keys for the same DynamicPrompt.
+    digest_memo = weakref.WeakKeyDictionary()
+
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.digests = self.digest_memo.setdefault(dynprompt, {}).setdefault(type(self), {})
 
     def include_node_id_in_input(self) -> bool:
         return False
@@ -98,53 +218,66 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
-        if not dynprompt.has_node(node_id):
-            # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+        """
+        Returns a fixed size digest of the node and everything upstream of it (Merkle style):
+        the digest of a node covers its own inputs and the digests of the nodes it is linked to.
+        Each node is only hashed once per prompt, so building the keys of a whole graph is linear
+        in its size. Nodes that can't be hashed get an Unhashable key which never matches.
+        """
+        digests = self.digests
+        if node_id in digests:
+            return digests[node_id]
+
+        # Iterative post-order walk so long chains don't hit the recursion limit
+        visiting = set()
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current_id, parents_done = stack.pop()
+            if current_id in digests:
+                continue
+            if not dynprompt.has_node(current_id):
+                # This node doesn't exist -- we can't cache it.
+                digests[current_id] = Unhashable()
+                continue
+            if not parents_done:
+                visiting.add(current_id)
+                stack.append((current_id, True))
+                inputs = dynprompt.get_node(current_id)["inputs"]
+                for key in sorted(inputs.keys()):
+                    if is_link(inputs[key]) and inputs[key][0] not in digests and inputs[key][0] not in visiting:
+                        stack.append((inputs[key][0], False))
+                continue
+            digests[current_id] = await self.get_immediate_node_signature(dynprompt, current_id, digests)
+            visiting.discard(current_id)
+        return digests[node_id]
+
+    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_digests):
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-        signature = [class_type, await self.is_changed_cache.get(node_id)]
+        hasher = hashlib.sha256()
+        hashable = update_hash(hasher, class_type) and update_hash(hasher, await self.is_changed_cache.get(node_id))
         if self.include_node_id_in_input() or (hasattr(class_def, "NOT_IDEMPOTENT") and class_def.NOT_IDEMPOTENT) or include_unique_id_in_input(class_type):
-            signature.append(node_id)
+            hashable = hashable and update_hash(hasher, node_id)
         inputs = node["inputs"]
         for key in sorted(inputs.keys()):
+            if not hashable:
+                break
+            hashable = update_hash(hasher, key)
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                # Missing digests only happen for links that form a cycle
+                ancestor_digest = ancestor_digests.get(ancestor_id, None)
+                if ancestor_digest is None or isinstance(ancestor_digest, Unhashable):
+                    hashable = False
+                else:
+                    hasher.update(b"a" + ancestor_digest)
+                    hashable = hashable and update_hash(hasher, ancestor_socket)
             else:
-                signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+                hashable = hashable and update_hash(hasher, inputs[key])
+        if not hashable:
+            return Unhashable()
+        return hasher.digest()
 
 class BasicCache:
     def __init__(self, key_class):
@@ -154,6 +287,11 @@ class BasicCache:
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        self.spill_store = None
+
+    def set_spill_store(self, spill_store):
+        """Entries removed from this cache are written to spill_store and read back from it on a miss."""
+        self.spill_store = spill_store
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         self.dynprompt = dynprompt
@@ -176,7 +314,12 @@ class BasicCache:
             if key not in preserve_keys:
                 to_remove.append(key)
         for key in to_remove:
-            del self.cache[key]
+            self._evict(key)
+
+    def _evict(self, key):
+        value = self.cache.pop(key)
+        if self.spill_store is not None:
+            self.spill_store.put(key, value)
 
     def _clean_subcaches(self):
         preserve_subcaches = set(self.cache_key_set.get_used_subcache_keys())
@@ -207,6 +350,11 @@ class BasicCache:
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key in self.cache:
             return self.cache[cache_key]
+        elif self.spill_store is not None:
+            value = self.spill_store.get(cache_key)
+            if value is not None:
+                self.cache[cache_key] = value
+            return value
         else:
             return None
 
@@ -215,6 +363,7 @@ class BasicCache:
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
             subcache = BasicCache(self.key_class)
+            subcache.set_spill_store(self.spill_store)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -316,7 +465,7 @@ class LRUCache(BasicCache):
             self.min_generation += 1
             to_remove = [key for key in self.cache if self.used_generation[key] < self.min_generation]
             for key in to_remove:
-                del self.cache[key]
+                self._evict(key)
                 del self.used_generation[key]
                 if key in self.children:
                     del self.children[key]
@@ -419,5 +568,205 @@ class RAMPressureCache(LRUCache):
 
         while _ram_gb() < ram_headroom * RAM_CACHE_HYSTERESIS and clean_list:
             _, _, key = clean_list.pop()
-            del self.cache[key]
+            self._evict(key)
             gc.collect()
+
+
+class NotSpillable(Exception):
+    pass
+
+# Evicted entries waiting to be written to the disk cache at most
+MAX_PENDING_SPILLS = 8
+
+class DiskSpillStore:
+    """
+    Second cache tier on the local disk. Entries are stored as one safetensors file per
+    cache key: the tensors are the file's tensors and everything else (the nesting of
+    lists/tuples/dicts, primitive values, the ui dict) is JSON in the metadata.
+    Entries holding anything else (models, custom objects) are not spilled.
+    Files are evicted least recently used first once the total size exceeds max_size.
+
+    One store per directory is shared by the executors of every prompt worker (see
+    get_spill_store). Entries are written by a background thread, until then get returns
+    them from memory.
+    """
+    def __init__(self, directory, max_size, entry_type):
+        self.directory = directory
+        self.max_size = max_size
+        self.entry_type = entry_type
+        self.index = OrderedDict()
+        self.total_size = 0
+        self.lock = threading.RLock()
+        # name -> entry waiting to be written
+        self.pending = {}
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="DiskSpillWriter")
+        os.makedirs(directory, exist_ok=True)
+
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".safetensors") and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-len(".safetensors")], stat.st_size))
+        for _, name, size in sorted(files):
+            self.index[name] = size
+            self.total_size += size
+        self._evict_to(self.max_size)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".safetensors")
+
+    def _evict_to(self, size):
+        while self.total_size > size and len(self.index) > 0:
+            name, file_size = self.index.popitem(last=False)
+            self.total_size -= file_size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _flatten(self, obj, tensors, seen):
+        if obj is None or isinstance(obj, (bool, int, str)):
+            return obj
+        if isinstance(obj, float):
+            return {"f": repr(obj)}
+        if type(obj) is torch.Tensor and obj.layout == torch.strided:
+            name = seen.get(id(obj), None)
+            if name is None:
+                name = str(len(tensors))
+                tensors[name] = obj.detach().to("cpu").contiguous()
+                seen[id(obj)] = name
+            return {"t": name}
+        if type(obj) is list:
+            return {"l": [self._flatten(x, tensors, seen) for x in obj]}
+        if type(obj) is tuple:
+            return {"u": [self._flatten(x, tensors, seen) for x in obj]}
+        if type(obj) is dict and all(isinstance(k, str) for k in obj):
+            return {"d": {k: self._flatten(v, tensors, seen) for k, v in obj.items()}}
+        raise NotSpillable()
+
+    def _unflatten(self, obj, tensors):
+        if not isinstance(obj, dict):
+            return obj
+        tag, value = next(iter(obj.items()))
+        if tag == "f":
+            return float(value)
+        if tag == "t":
+            return tensors[value]
+        if tag == "l":
+            return [self._unflatten(x, tensors) for x in value]
+        if tag == "u":
+            return tuple(self._unflatten(x, tensors) for x in value)
+        return {k: self._unflatten(v, tensors) for k, v in value.items()}
+
+    def put(self, key, value):
+        if not isinstance(key, bytes):
+            return
+        name = key.hex()
+        with self.lock:
+            # The evicted entries are kept in memory until they are written, skip them when the writer falls behind
+            if name in self.index or name in self.pending or len(self.pending) >= MAX_PENDING_SPILLS:
+                return
+            self.pending[name] = value
+        self.writer.submit(self._write, name, value)
+
+    def flush(self):
+        """Waits until the pending entries are written."""
+        self.writer.submit(lambda: None).result()
+
+    def _write(self, name, value):
+        try:
+            self._save(name, value)
+        finally:
+            with self.lock:
+                self.pending.pop(name, None)
+
+    def _save(self, name, value):
+        tensors = {}
+        try:
+            metadata = {
+                "comfyui_version": __version__,
+                "outputs": json.dumps(self._flatten(value.outputs, tensors, {})),
+                "ui": json.dumps(value.ui),
+            }
+        except (NotSpillable, TypeError, ValueError):
+            return
+
+        size = sum(t.numel() * t.element_size() for t in tensors.values())
+        with self.lock:
+            if size > self.max_size or name in self.index:
+                return
+            self._evict_to(self.max_size - size)
+            # Reserved until the real size of the file is known
+            self.index[name] = size
+            self.total_size += size
+
+        path = self._path(name)
+        temp_path = path + ".tmp"
+        try:
+            try:
+                safetensors.torch.save_file(tensors, temp_path, metadata=metadata)
+            except RuntimeError:
+                # Views of the same storage can't be saved as they are
+                safetensors.torch.save_file({k: v.clone() for k, v in tensors.items()}, temp_path, metadata=metadata)
+            os.replace(temp_path, path)
+            file_size = os.path.getsize(path)
+        except OSError as e:
+            logging.warning(f"Failed to write cache entry to disk: {e}")
+            with self.lock:
+                self.total_size -= self.index.pop(name, 0)
+            return
+        with self.lock:
+            if name in self.index:
+                self.total_size += file_size - self.index[name]
+                self.index[name] = file_size
+            self._evict_to(self.max_size)
+
+    def get(self, key):
+        if not isinstance(key, bytes):
+            return None
+        name = key.hex()
+        with self.lock:
+            value = self.pending.get(name, None)
+            if value is not None:
+                return value
+            if name not in self.index:
+                return None
+            self.index.move_to_end(name)
+        path = self._path(name)
+        try:
+            with safetensors.safe_open(path, framework="pt", device="cpu") as f:
+                metadata = f.metadata()
+                if metadata.get("comfyui_version", None) != __version__:
+                    raise ValueError("cache entry from another ComfyUI version")
+                tensors = {k: f.get_tensor(k) for k in f.keys()}
+            outputs = self._unflatten(json.loads(metadata["outputs"]), tensors)
+            ui = json.loads(metadata["ui"])
+        except Exception as e:
+            logging.debug(f"Dropping unreadable disk cache entry {name}: {e}")
+            with self.lock:
+                if name in self.index:
+                    self.total_size -= self.index.pop(name)
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return self.entry_type(ui=ui, outputs=outputs)
+
+
+spill_stores = {}
+spill_stores_lock = threading.Lock()
+
+def get_spill_store(directory, max_size, entry_type):
+    """The DiskSpillStore of this directory, shared by every executor so they keep to one size limit."""
+    with spill_stores_lock:
+        store = spill_stores.get(directory, None)
+        if store is None:
+            store = DiskSpillStore(directory, max_size, entry_type)
+            spill_stores[directory] = store
+        return store
@@ -0,0 +1,128 @@
+"""
+Reads the model files of the next queued prompts while the current prompt runs.
+
+The prefetcher thread is woken up every time the queue changes. It looks at the next prompts
+the queue would run, resolves the files their loader nodes use and stages them in order:
+
+- Checkpoints, diffusion models, text encoders and VAEs are loaded into comfy.state_dict_cache
+  (when --state-dict-cache leaves room for them) and their tensors are pinned with
+  model_management.pin_memory, so the loader node gets the state dict without touching the disk
+  and the weights are uploaded to the GPU from pinned memory.
+- The other files (LoRAs, controlnets...) and the files that don't fit in the state dict cache
+  are read ahead into the OS page cache.
+
+Models that are already built are left alone: loading them onto the GPU is done by the prompt
+worker, ModelPatcher and the list of loaded models can't be touched from another thread.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import folder_paths
+import comfy.state_dict_cache
+from comfy_execution.scheduler import model_input_folders
+
+# Model folders whose files are loaded through comfy.state_dict_cache and the safe_load flag the loaders use
+STATE_DICT_FOLDERS = {
+    "checkpoints": False,
+    "diffusion_models": False,
+    "text_encoders": True,
+    "vae": False,
+}
+
+READAHEAD_CHUNK = 64 * 1024 * 1024
+
+
+def prompt_model_files(prompt):
+    """The model files used by the loader nodes of a prompt, [(folder, path)] in node order."""
+    files = OrderedDict()
+    for node in prompt.values():
+        if not isinstance(node, dict):
+            continue
+        for input_name, value in node.get("inputs", {}).items():
+            if not isinstance(value, str) or value in ("", "None"):
+                continue
+            folders = model_input_folders(input_name)
+            if folders is None:
+                continue
+            for folder in folders:
+                try:
+                    path = folder_paths.get_full_path(folder, value)
+                except KeyError:
+                    path = None
+                if path is not None:
+                    files[path] = folder
+                    break
+    return [(folder, path) for path, folder in files.items()]
+
+
+def readahead(path):
+    """Asks the OS to read the file into the page cache, reads it when that isn't supported."""
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return
+        while f.read(READAHEAD_CHUNK):
+            pass
+
+
+class ModelPrefetcher(threading.Thread):
+    def __init__(self, queue, depth):
+        super().__init__(daemon=True, name="ModelPrefetcher")
+        self.queue = queue
+        self.depth = depth
+        self.wakeup = threading.Event()
+        self.staged = {}
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stage(self, folder, path):
+        safe_load = STATE_DICT_FOLDERS.get(folder, None)
+        if safe_load is not None and comfy.state_dict_cache.cache.prefetch(path, safe_load=safe_load, pin=True):
+            return "state dict cache"
+        readahead(path)
+        return "page cache"
+
+    def prefetch(self):
+        """Stages the files of the next prompts, returns the ones that were staged by this call."""
+        files = []
+        for item in self.queue.upcoming(self.depth):
+            files += prompt_model_files(item[2])
+
+        staged = {}
+        done = []
+        for folder, path in files:
+            if path in staged:
+                continue
+            try:
+                stat = os.stat(path)
+                key = (stat.st_size, stat.st_mtime_ns)
+                if self.staged.get(path, None) != key:
+                    logging.debug("prefetched {} into the {}".format(path, self.stage(folder, path)))
+                    done.append(path)
+                staged[path] = key
+            except Exception as e:
+                logging.warning("Failed to prefetch {}: {}".format(path, e))
+            if self.wakeup.is_set():
+                # The queue changed, start over with the new order
+                break
+        # Files that left the window are staged again if they come back, they may have been evicted since
+        self.staged = staged
+        return done
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.prefetch()
+
+
+def start_prefetcher(queue, depth):
+    if depth <= 0:
+        return None
+    prefetcher = ModelPrefetcher(queue, depth)
+    queue.prefetcher = prefetcher
+    prefetcher.start()
+    return prefetcher
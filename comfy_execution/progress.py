@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import TypedDict, Dict, Optional, Tuple
+import threading
+from typing import TypedDict, Dict, Optional, Tuple, Union
 from typing_extensions import override
 from PIL import Image
 from enum import Enum
@@ -12,7 +13,8 @@ if TYPE_CHECKING:
 from protocol import BinaryEventTypes
 from comfy_api import feature_flags
 
-PreviewImageTuple = Tuple[str, Image.Image, Optional[int]]
+# (format, image, max size), the image can also be bytes already encoded in that format
+PreviewImageTuple = Tuple[str, Union[Image.Image, bytes], Optional[int]]
 
 class NodeState(Enum):
     Pending = "pending"
@@ -319,18 +321,24 @@ class ProgressRegistry:
         for handler in self.handlers.values():
             handler.reset()
 
-# Global registry instance
+# Global registry instance, the registry of the prompt that was started last
 global_progress_registry: ProgressRegistry | None = None
+# Registry of the prompt running in the current prompt worker thread
+worker_progress_registry = threading.local()
 
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
 
     # Reset existing handlers if registry exists
-    if global_progress_registry is not None:
-        global_progress_registry.reset_handlers()
+    registry = getattr(worker_progress_registry, "registry", None)
+    if registry is None and global_progress_registry is not None and global_progress_registry.prompt_id == "":
+        registry = global_progress_registry
+    if registry is not None:
+        registry.reset_handlers()
 
     # Create new registry
     global_progress_registry = ProgressRegistry(prompt_id, dynprompt)
+    worker_progress_registry.registry = global_progress_registry
 
 
 def add_progress_handler(handler: ProgressHandler) -> None:
@@ -341,6 +349,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    registry = getattr(worker_progress_registry, "registry", None)
+    if registry is not None:
+        return registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
@@ -0,0 +1,294 @@
+import heapq
+import os
+import time
+
+import folder_paths
+
+# Priority classes in the order they are served. Prompts in a class only run when
+# no prompt of a class before it is waiting.
+PRIORITY_CLASSES = ("interactive", "batch")
+DEFAULT_PRIORITY = "interactive"
+
+
+def item_priority(item):
+    priority = item[3].get("priority", DEFAULT_PRIORITY)
+    if priority not in PRIORITY_CLASSES:
+        return DEFAULT_PRIORITY
+    return priority
+
+
+def item_client(item):
+    return item[3].get("client_id", None)
+
+
+# Loader node inputs and the model folders the value can be found in
+MODEL_INPUTS = {
+    "ckpt_name": ("checkpoints",),
+    "unet_name": ("diffusion_models",),
+    "clip_name": ("text_encoders", "clip_vision"),
+    "vae_name": ("vae",),
+    "lora_name": ("loras",),
+    "control_net_name": ("controlnet",),
+}
+
+def model_input_folders(input_name):
+    folders = MODEL_INPUTS.get(input_name.rstrip("0123456789"), None)
+    if folders is None and input_name.startswith("lora_"):
+        folders = MODEL_INPUTS["lora_name"]
+    return folders
+
+
+class ModelSizes:
+    """Size on disk of the model files, used as the cost of swapping them in."""
+    def __init__(self):
+        self.sizes = {}
+
+    def get(self, folders, filename):
+        key = (folders, filename)
+        size = self.sizes.get(key, None)
+        if size is None:
+            size = 1
+            for folder in folders:
+                try:
+                    path = folder_paths.get_full_path(folder, filename)
+                except KeyError:
+                    path = None
+                if path is not None:
+                    size = max(os.path.getsize(path), 1)
+                    break
+            self.sizes[key] = size
+        return size
+
+
+def prompt_models(prompt, model_sizes):
+    """The model files loaded by the loader nodes of a prompt, {(folders, filename): size}."""
+    models = {}
+    for node in prompt.values():
+        if not isinstance(node, dict):
+            continue
+        for input_name, value in node.get("inputs", {}).items():
+            if not isinstance(value, str) or value in ("", "None"):
+                continue
+            folders = model_input_folders(input_name)
+            if folders is not None:
+                models[(folders, value)] = model_sizes.get(folders, value)
+    return models
+
+
+class FairShareScheduler:
+    """
+    Orders the queued prompts. Within a priority class the clients are served by
+    weighted round robin (stride scheduling): every client has a virtual pass that
+    advances by 1 / weight each time one of its prompts is picked and the client with
+    the lowest pass goes next. A client joining the queue starts at the lowest pass of
+    the clients already waiting so it can't claim credit for the time it was idle.
+    The prompts of one client run in queue number order and prompts queued to the front
+    (negative number) skip the round robin.
+
+    With a model affinity window the scheduler looks at the next affinity_window prompts
+    it would run and picks the one that shares the most model bytes with the prompt that
+    ran before it, so prompts using the same checkpoints run back to back instead of
+    swapping models for every prompt. A prompt can only be passed over affinity_window
+    times before it runs.
+    """
+    def __init__(self, client_weights=None, affinity_window=0):
+        self.client_weights = client_weights or {}
+        self.pending = {priority: {} for priority in PRIORITY_CLASSES}
+        self.passes = {priority: {} for priority in PRIORITY_CLASSES}
+        self.count = 0
+        self.affinity_window = affinity_window
+        self.model_sizes = ModelSizes()
+        self.item_models = {}
+        self.skips = {}
+        self.last_models = {}
+
+    def __len__(self):
+        return self.count
+
+    def client_weight(self, client_id):
+        return max(self.client_weights.get(client_id, 1.0), 1e-3)
+
+    def put(self, item):
+        priority = item_priority(item)
+        client_id = item_client(item)
+        clients = self.pending[priority]
+        passes = self.passes[priority]
+        if client_id not in clients:
+            clients[client_id] = []
+            passes[client_id] = min(passes.values(), default=0.0)
+        heapq.heappush(clients[client_id], item)
+        self.count += 1
+        if self.affinity_window > 0:
+            self.item_models[item[1]] = prompt_models(item[2], self.model_sizes)
+
+    def candidates(self, priority):
+        """(client_id, next item) of every client waiting in this class, in the order they would be picked."""
+        clients = self.pending[priority]
+        passes = self.passes[priority]
+        def order(client_id):
+            number = clients[client_id][0][0]
+            if number < 0:
+                return (0, number, 0.0)
+            return (1, passes[client_id], number)
+        return [(client_id, clients[client_id][0]) for client_id in sorted(clients, key=order)]
+
+    def fair_order(self, priority, limit):
+        """The next limit (client_id, item) this class would run without model affinity."""
+        clients = self.pending[priority]
+        passes = dict(self.passes[priority])
+        upcoming = {client_id: sorted(heapq.nsmallest(limit, items), reverse=True) for client_id, items in clients.items()}
+        out = []
+        while len(out) < limit:
+            waiting = [client_id for client_id in upcoming if len(upcoming[client_id]) > 0]
+            if len(waiting) == 0:
+                break
+            def order(client_id):
+                number = upcoming[client_id][-1][0]
+                if number < 0:
+                    return (0, number, 0.0)
+                return (1, passes[client_id], number)
+            client_id = min(waiting, key=order)
+            out.append((client_id, upcoming[client_id].pop()))
+            passes[client_id] += 1.0 / self.client_weight(client_id)
+        return out
+
+    def upcoming(self, limit):
+        """The next limit items in the order they would run (not taking the model affinity into account)."""
+        out = []
+        for priority in PRIORITY_CLASSES:
+            if len(out) >= limit:
+                break
+            out += [item for _, item in self.fair_order(priority, limit - len(out))]
+        return out
+
+    def pick_by_affinity(self, priority):
+        window = self.fair_order(priority, self.affinity_window)
+        client_id, head = window[0]
+        if head[0] < 0 or self.skips.get(head[1], 0) >= self.affinity_window:
+            return client_id, head
+
+        def shared_bytes(item):
+            models = self.item_models.get(item[1], {})
+            return sum(size for model, size in models.items() if model in self.last_models)
+
+        best = 0
+        best_score = shared_bytes(head)
+        for i, (_, candidate) in enumerate(window):
+            score = shared_bytes(candidate)
+            if score > best_score:
+                best = i
+                best_score = score
+        for _, skipped in window[:best]:
+            self.skips[skipped[1]] = self.skips.get(skipped[1], 0) + 1
+        return window[best]
+
+    def pop(self):
+        for priority in PRIORITY_CLASSES:
+            if len(self.pending[priority]) > 0:
+                if self.affinity_window > 0:
+                    client_id, item = self.pick_by_affinity(priority)
+                    return self.take(priority, client_id, item)
+                client_id, _ = self.candidates(priority)[0]
+                return self.take(priority, client_id)
+        return None
+
+    def take(self, priority, client_id, item=None):
+        """Removes the next prompt of this client (or the given one) and advances its pass."""
+        clients = self.pending[priority]
+        passes = self.passes[priority]
+        if item is None:
+            item = heapq.heappop(clients[client_id])
+        else:
+            items = clients[client_id]
+            items.pop(next(i for i, x in enumerate(items) if x is item))
+            heapq.heapify(items)
+        passes[client_id] += 1.0 / self.client_weight(client_id)
+        if len(clients[client_id]) == 0:
+            del clients[client_id]
+            del passes[client_id]
+        self.count -= 1
+        self.skips.pop(item[1], None)
+        models = self.item_models.pop(item[1], None)
+        if models is not None:
+            self.last_models = models
+        return item
+
+    def remove(self, function):
+        for priority in PRIORITY_CLASSES:
+            clients = self.pending[priority]
+            for client_id, items in clients.items():
+                for i, item in enumerate(items):
+                    if function(item):
+                        items.pop(i)
+                        self.skips.pop(item[1], None)
+                        self.item_models.pop(item[1], None)
+                        heapq.heapify(items)
+                        if len(items) == 0:
+                            del clients[client_id]
+                            del self.passes[priority][client_id]
+                        self.count -= 1
+                        return True
+        return False
+
+    def clear(self):
+        for priority in PRIORITY_CLASSES:
+            self.pending[priority].clear()
+            self.passes[priority].clear()
+        self.count = 0
+        self.skips.clear()
+        self.item_models.clear()
+
+    def items(self):
+        out = []
+        for clients in self.pending.values():
+            for items in clients.values():
+                out += items
+        out.sort()
+        return out
+
+    def pending_counts(self):
+        return {priority: sum(len(items) for items in self.pending[priority].values()) for priority in PRIORITY_CLASSES}
+
+
+class QueueStats:
+    """Wait time (queued until started) and service time (started until done) per priority class."""
+    def __init__(self):
+        self.stats = {priority: {"completed": 0, "wait_time": 0.0, "service_time": 0.0, "max_wait_time": 0.0} for priority in PRIORITY_CLASSES}
+        self.queued_at = {}
+        self.started_at = {}
+
+    def queued(self, item):
+        self.queued_at[item[1]] = time.monotonic()
+
+    def started(self, item):
+        self.started_at[item[1]] = (time.monotonic(), self.queued_at.pop(item[1], None))
+
+    def removed(self, item):
+        self.queued_at.pop(item[1], None)
+
+    def done(self, item):
+        started = self.started_at.pop(item[1], None)
+        if started is None:
+            return
+        start_time, queue_time = started
+        stats = self.stats[item_priority(item)]
+        stats["completed"] += 1
+        stats["service_time"] += time.monotonic() - start_time
+        if queue_time is not None:
+            wait_time = start_time - queue_time
+            stats["wait_time"] += wait_time
+            stats["max_wait_time"] = max(stats["max_wait_time"], wait_time)
+
+    def get(self, pending_counts, running_counts):
+        out = {}
+        for priority, stats in self.stats.items():
+            completed = stats["completed"]
+            out[priority] = {
+                "pending": pending_counts.get(priority, 0),
+                "running": running_counts.get(priority, 0),
+                "completed": completed,
+                "avg_wait_time": stats["wait_time"] / completed if completed > 0 else 0.0,
+                "max_wait_time": stats["max_wait_time"],
+                "avg_service_time": stats["service_time"] / completed if completed > 0 else 0.0,
+            }
+        return out
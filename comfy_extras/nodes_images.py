@@ -9,6 +9,7 @@ from PIL.PngImagePlugin import PngInfo
 
 import numpy as np
 import json
+import math
 import os
 import re
 from io import BytesIO
@@ -126,7 +127,6 @@ class SaveAnimatedWEBP:
     def save_images(self, images, fps, filename_prefix, lossless, quality, method, num_frames=0, prompt=None, extra_pnginfo=None):
         method = self.methods.get(method)
         filename_prefix += self.prefix_append
-        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
         results: list[FileLocator] = []
         pil_images = []
         for image in images:
@@ -147,16 +147,19 @@ class SaveAnimatedWEBP:
         if num_frames == 0:
             num_frames = len(pil_images)
 
-        c = len(pil_images)
-        for i in range(0, c, num_frames):
-            file = f"{filename}_{counter:05}_.webp"
-            pil_images[i].save(os.path.join(full_output_folder, file), save_all=True, duration=int(1000.0/fps), append_images=pil_images[i + 1:i + num_frames], exif=metadata, lossless=lossless, quality=quality, method=method)
-            results.append({
-                "filename": file,
-                "subfolder": subfolder,
-                "type": self.type
-            })
-            counter += 1
+        file_count = math.ceil(len(pil_images) / num_frames)
+        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0], file_count, suffix="_.webp")
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, file_count, "_.webp"):
+            c = len(pil_images)
+            for i in range(0, c, num_frames):
+                file = f"{filename}_{counter:05}_.webp"
+                pil_images[i].save(os.path.join(full_output_folder, file), save_all=True, duration=int(1000.0/fps), append_images=pil_images[i + 1:i + num_frames], exif=metadata, lossless=lossless, quality=quality, method=method)
+                results.append({
+                    "filename": file,
+                    "subfolder": subfolder,
+                    "type": self.type
+                })
+                counter += 1
 
         animated = num_frames != 1
         return { "ui": { "images": results, "animated": (animated,) } }
@@ -187,7 +190,6 @@ class SaveAnimatedPNG:
 
     def save_images(self, images, fps, compress_level, filename_prefix="ComfyUI", prompt=None, extra_pnginfo=None):
         filename_prefix += self.prefix_append
-        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
         results = list()
         pil_images = []
         for image in images:
@@ -204,8 +206,10 @@ class SaveAnimatedPNG:
                 for x in extra_pnginfo:
                     metadata.add(b"comf", x.encode("latin-1", "strict") + b"\0" + json.dumps(extra_pnginfo[x]).encode("latin-1", "strict"), after_idat=True)
 
-        file = f"{filename}_{counter:05}_.png"
-        pil_images[0].save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level, save_all=True, duration=int(1000.0/fps), append_images=pil_images[1:])
+        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0], suffix="_.png")
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, 1, "_.png"):
+            file = f"{filename}_{counter:05}_.png"
+            pil_images[0].save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=compress_level, save_all=True, duration=int(1000.0/fps), append_images=pil_images[1:])
         results.append({
             "filename": file,
             "subfolder": subfolder,
@@ -502,7 +506,7 @@ class SaveSVGNode:
 
     def save_svg(self, svg: SVG, filename_prefix="svg/ComfyUI", prompt=None, extra_pnginfo=None):
         filename_prefix += self.prefix_append
-        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir)
+        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, batch_size=len(svg.data), suffix="_.svg")
         results = list()
 
         # Prepare metadata JSON
@@ -515,41 +519,42 @@ class SaveSVGNode:
         # Convert metadata to JSON string
         metadata_json = json.dumps(metadata_dict, indent=2) if metadata_dict else None
 
-        for batch_number, svg_bytes in enumerate(svg.data):
-            filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
-            file = f"{filename_with_batch_num}_{counter:05}_.svg"
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, len(svg.data), "_.svg"):
+            for batch_number, svg_bytes in enumerate(svg.data):
+                filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
+                file = f"{filename_with_batch_num}_{counter:05}_.svg"
 
-            # Read SVG content
-            svg_bytes.seek(0)
-            svg_content = svg_bytes.read().decode('utf-8')
+                # Read SVG content
+                svg_bytes.seek(0)
+                svg_content = svg_bytes.read().decode('utf-8')
 
-            # Inject metadata if available
-            if metadata_json:
-                # Create metadata element with CDATA section
-                metadata_element = f"""  <metadata>
+                # Inject metadata if available
+                if metadata_json:
+                    # Create metadata element with CDATA section
+                    metadata_element = f"""  <metadata>
                 <![CDATA[
             {metadata_json}
                 ]]>
             </metadata>
             """
-                # Insert metadata after opening svg tag using regex with a replacement function
-                def replacement(match):
-                    # match.group(1) contains the captured <svg> tag
-                    return match.group(1) + '\n' + metadata_element
-
-                # Apply the substitution
-                svg_content = re.sub(r'(<svg[^>]*>)', replacement, svg_content, flags=re.UNICODE)
-
-            # Write the modified SVG to file
-            with open(os.path.join(full_output_folder, file), 'wb') as svg_file:
-                svg_file.write(svg_content.encode('utf-8'))
-
-            results.append({
-                "filename": file,
-                "subfolder": subfolder,
-                "type": self.type
-            })
-            counter += 1
+                    # Insert metadata after opening svg tag using regex with a replacement function
+                    def replacement(match):
+                        # match.group(1) contains the captured <svg> tag
+                        return match.group(1) + '\n' + metadata_element
+
+                    # Apply the substitution
+                    svg_content = re.sub(r'(<svg[^>]*>)', replacement, svg_content, flags=re.UNICODE)
+
+                # Write the modified SVG to file
+                with open(os.path.join(full_output_folder, file), 'wb') as svg_file:
+                    svg_file.write(svg_content.encode('utf-8'))
+
+                results.append({
+                    "filename": file,
+                    "subfolder": subfolder,
+                    "type": self.type
+                })
+                counter += 1
         return { "ui": { "images": results } }
 
 class GetImageSize:
@@ -77,12 +77,22 @@ class ImageUpscaleWithModel(io.ComfyNode):
         tile = 512
         overlap = 32
 
+        # Blend the tiles on the device when the upscaled image fits, several tiles per model call when there is room
+        free_memory = model_management.get_free_memory(device)
+        accumulate_device = "cpu"
+        accumulate_memory = 2 * in_img[:1].nelement() * upscale_model.scale * upscale_model.scale * 4
+        if accumulate_memory < free_memory * 0.25:
+            accumulate_device = device
+            free_memory -= accumulate_memory
+
         oom = True
         while oom:
             try:
                 steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile, tile_y=tile, overlap=overlap)
                 pbar = comfy.utils.ProgressBar(steps)
-                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar)
+                tile_memory = (tile * tile * 3) * image.element_size() * max(upscale_model.scale, 1.0) * 384.0
+                max_tile_batch = 1 if model_management.is_device_cpu(device) else max(1, min(16, int(free_memory / tile_memory)))
+                s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar, max_tile_batch=max_tile_batch, accumulate_device=accumulate_device)
                 oom = False
             except model_management.OOM_EXCEPTION as e:
                 tile //= 2
@@ -11,7 +11,7 @@ from fractions import Fraction
 from comfy_api.input import AudioInput, ImageInput, VideoInput
 from comfy_api.input_impl import VideoFromComponents, VideoFromFile
 from comfy_api.util import VideoCodec, VideoComponents, VideoContainer
-from comfy_api.latest import ComfyExtension, io, ui
+from comfy_api.latest import ComfyExtension, InputImpl, io, ui
 from comfy.cli_args import args
 
 class SaveWEBM(io.ComfyNode):
@@ -140,6 +140,52 @@ class CreateVideo(io.ComfyNode):
             VideoFromComponents(VideoComponents(images=images, audio=audio, frame_rate=Fraction(fps)))
         )
 
+class CreateVideoFromLatent(io.ComfyNode):
+    @classmethod
+    def define_schema(cls):
+        return io.Schema(
+            node_id="CreateVideoFromLatent",
+            display_name="Create Video (Streaming VAE Decode)",
+            category="image/video",
+            description="Create a video from a video latent. The latent is decoded a chunk of frames at a time while the video is saved, so the whole clip never has to fit in memory.",
+            inputs=[
+                io.Latent.Input("samples", tooltip="The video latent to decode."),
+                io.Vae.Input("vae"),
+                io.Float.Input("fps", default=24.0, min=1.0, max=120.0, step=1.0),
+                io.Int.Input("temporal_size", default=64, min=8, max=4096, step=4, tooltip="Amount of frames to decode at a time."),
+                io.Int.Input("temporal_overlap", default=8, min=4, max=4096, step=4, tooltip="Amount of frames to overlap."),
+                io.Audio.Input("audio", optional=True, tooltip="The audio to add to the video."),
+            ],
+            outputs=[
+                io.Video.Output(),
+            ],
+        )
+
+    @classmethod
+    def execute(cls, samples, vae, fps: float, temporal_size: int, temporal_overlap: int, audio: Optional[AudioInput] = None) -> io.NodeOutput:
+        latent = samples["samples"]
+        temporal_compression = vae.temporal_compression_decode()
+        if latent.ndim != 5 or temporal_compression is None:
+            # Not a video latent, decode it as a batch of images
+            images = vae.decode(latent)
+            if len(images.shape) == 5:
+                images = images.reshape(-1, images.shape[-3], images.shape[-2], images.shape[-1])
+            return io.NodeOutput(VideoFromComponents(VideoComponents(images=images, audio=audio, frame_rate=Fraction(fps))))
+
+        tile_t = max(2, temporal_size // temporal_compression)
+        overlap_t = max(1, min(tile_t // 2, temporal_overlap // temporal_compression))
+        upscale_t = vae.upscale_ratio[0]
+        frames = upscale_t(latent.shape[2]) if callable(upscale_t) else upscale_t * latent.shape[2]
+        compression = vae.spacial_compression_decode()
+        return io.NodeOutput(InputImpl.VideoFromFrameStream(
+            lambda: vae.decode_stream(latent, tile_t=tile_t, overlap_t=overlap_t),
+            width=latent.shape[4] * compression,
+            height=latent.shape[3] * compression,
+            frame_rate=Fraction(fps),
+            frame_count=latent.shape[0] * round(frames),
+            audio=audio,
+        ))
+
 class GetVideoComponents(io.ComfyNode):
     @classmethod
     def define_schema(cls):
@@ -210,6 +256,7 @@ class VideoExtension(ComfyExtension):
             SaveWEBM,
             SaveVideo,
             CreateVideo,
+            CreateVideoFromLatent,
             GetVideoComponents,
             LoadVideo,
         ]
@@ -1,7 +1,7 @@
 import copy
-import heapq
 import inspect
 import logging
+import os
 import sys
 import threading
 import time
@@ -13,11 +13,13 @@ import asyncio
 import torch
 
 import comfy.model_management
+import folder_paths
 import nodes
 from comfy_execution.caching import (
     BasicCache,
     CacheKeySetID,
     CacheKeySetInputSignature,
+    get_spill_store,
     NullCache,
     HierarchicalCache,
     LRUCache,
@@ -31,10 +33,13 @@ from comfy_execution.graph import (
 )
 from comfy_execution.graph_utils import GraphBuilder, is_link
 from comfy_execution.validation import validate_node_input
+from comfy_execution.scheduler import FairShareScheduler, QueueStats, item_client, item_priority
+from comfy_execution import batch_fusion
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
 from comfy_api.latest import io
+from app.database.history import HistoryStore, iter_output_files, persistent_history_available
 
 
 class ExecutionResult(Enum):
@@ -117,6 +122,11 @@ class CacheSet:
         else:
             self.init_classic_cache()
 
+        cache_disk = cache_args.get("disk", 0)
+        if cache_type != CacheType.NONE and cache_disk > 0:
+            self.init_disk_cache(cache_disk)
+            logging.info("Spilling evicted node outputs to the disk cache ({} GB max).".format(cache_disk))
+
         self.all = [self.outputs, self.objects]
 
     # Performs like the old cache -- dump data ASAP
@@ -136,6 +146,10 @@ class CacheSet:
         self.outputs = NullCache()
         self.objects = NullCache()
 
+    def init_disk_cache(self, max_size_gb):
+        directory = os.path.join(folder_paths.get_cache_directory(), "outputs")
+        self.outputs.set_spill_store(get_spill_store(directory, int(max_size_gb * (1024 ** 3)), CacheEntry))
+
     def recursive_debug_dump(self):
         result = {
             "outputs": self.outputs.recursive_debug_dump(),
@@ -507,7 +521,11 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+            fused_output = batch_fusion.fused_output(prompt_id, unique_id, input_data_all, caches)
+            if fused_output is not None:
+                output_data, output_ui, has_subgraph, has_pending_tasks = fused_output, [], False, False
+            else:
+                output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -1089,45 +1107,109 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
 MAXIMUM_HISTORY_SIZE = 10000
 
 class PromptQueue:
-    def __init__(self, server):
+    def __init__(self, server, client_weights=None, affinity_window=0):
         self.server = server
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
         self.task_counter = 0
-        self.queue = []
+        self.scheduler = FairShareScheduler(client_weights, affinity_window)
+        self.stats = QueueStats()
         self.currently_running = {}
+        # Ident of the worker thread running each item, for interrupts
+        self.running_threads = {}
         self.history = {}
+        self.history_store = None
         self.flags = {}
+        self.prefetcher = None
+
+    @property
+    def queue(self):
+        """The pending items in queue number order."""
+        with self.mutex:
+            return self.scheduler.items()
 
     def put(self, item):
         with self.mutex:
-            heapq.heappush(self.queue, item)
+            self.scheduler.put(item)
+            self.stats.queued(item)
             self.server.queue_updated()
             self.not_empty.notify()
+        if self.prefetcher is not None:
+            self.prefetcher.notify()
+
+    def upcoming(self, limit):
+        """The next limit pending items, in the order they are expected to run."""
+        with self.mutex:
+            return self.scheduler.upcoming(limit)
 
     def get(self, timeout=None):
         with self.not_empty:
-            while len(self.queue) == 0:
+            while len(self.scheduler) == 0:
                 self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
+                if timeout is not None and len(self.scheduler) == 0:
                     return None
-            item = heapq.heappop(self.queue)
-            i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
-            self.task_counter += 1
-            self.server.queue_updated()
-            return (item, i)
+            item = self.scheduler.pop()
+            i = self.start(item)
+        if self.prefetcher is not None:
+            self.prefetcher.notify()
+        return (item, i)
+
+    def start(self, item):
+        """Marks an item removed from the scheduler as running, returns its item_id. Called with the mutex held."""
+        self.stats.started(item)
+        i = self.task_counter
+        self.currently_running[i] = copy.deepcopy(item)
+        self.running_threads[i] = threading.get_ident()
+        self.task_counter += 1
+        self.server.queue_updated()
+        return i
+
+    def find_matching(self, function, limit):
+        """The pending items (at most limit, in queue number order) for which function(item) is true. They stay in the queue."""
+        out = []
+        with self.mutex:
+            for item in self.scheduler.items():
+                if len(out) >= limit:
+                    break
+                if function(item):
+                    out.append(item)
+        return out
+
+    def is_pending(self, prompt_id):
+        with self.mutex:
+            return any(item[1] == prompt_id for item in self.scheduler.items())
+
+    def take(self, prompt_id):
+        """Starts the pending item with this prompt_id out of order, None if it isn't in the queue anymore."""
+        with self.mutex:
+            item = next((x for x in self.scheduler.items() if x[1] == prompt_id), None)
+            if item is None:
+                return None
+            self.scheduler.take(item_priority(item), item_client(item), item)
+            i = self.start(item)
+        if self.prefetcher is not None:
+            self.prefetcher.notify()
+        return (item, i)
 
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
         completed: bool
         messages: List[str]
 
+    def get_history_store(self):
+        # The database is initialized after the queue is created so pick the backend on first use.
+        if self.history_store is None and persistent_history_available():
+            self.history_store = HistoryStore(MAXIMUM_HISTORY_SIZE)
+        return self.history_store
+
     def task_done(self, item_id, history_result,
                   status: Optional['PromptQueue.ExecutionStatus'], process_item=None):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
+            self.running_threads.pop(item_id, None)
+            self.stats.done(prompt)
+            history_store = self.get_history_store()
+            if history_store is None and len(self.history) > MAXIMUM_HISTORY_SIZE:
                 self.history.pop(next(iter(self.history)))
 
             status_dict: Optional[dict] = None
@@ -1137,52 +1219,85 @@ class PromptQueue:
             if process_item is not None:
                 prompt = process_item(prompt)
 
-            self.history[prompt[1]] = {
+            entry = {
                 "prompt": prompt,
                 "outputs": {},
                 'status': status_dict,
             }
-            self.history[prompt[1]].update(history_result)
+            entry.update(history_result)
+            if history_store is not None:
+                history_store.add(prompt[1], entry, completed_at=time.time())
+            else:
+                self.history[prompt[1]] = entry
             self.server.queue_updated()
 
+    def interrupt(self, prompt_id=None):
+        """Interrupts the worker running prompt_id, or every worker when it's None. Returns False when no such prompt is running."""
+        with self.mutex:
+            threads = set(self.running_threads[i] for i, item in self.currently_running.items() if prompt_id is None or item[1] == prompt_id)
+        for thread_id in threads:
+            comfy.model_management.interrupt_current_processing(True, thread_id=thread_id)
+        return len(threads) > 0
+
     # Note: slow
     def get_current_queue(self):
         with self.mutex:
             out = []
             for x in self.currently_running.values():
                 out += [x]
-            return (out, copy.deepcopy(self.queue))
+            return (out, copy.deepcopy(self.scheduler.items()))
 
     # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
         with self.mutex:
             running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
+            queued = self.scheduler.items()
             return (running, queued)
 
     def get_tasks_remaining(self):
         with self.mutex:
-            return len(self.queue) + len(self.currently_running)
+            return len(self.scheduler) + len(self.currently_running)
+
+    def get_queue_stats(self):
+        with self.mutex:
+            running_counts = {}
+            for item in self.currently_running.values():
+                priority = item_priority(item)
+                running_counts[priority] = running_counts.get(priority, 0) + 1
+            return self.stats.get(self.scheduler.pending_counts(), running_counts)
 
     def wipe_queue(self):
         with self.mutex:
-            self.queue = []
+            for item in self.scheduler.items():
+                self.stats.removed(item)
+            self.scheduler.clear()
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
         with self.mutex:
-            for x in range(len(self.queue)):
-                if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
-                    self.server.queue_updated()
+            def remove(item):
+                if function(item):
+                    self.stats.removed(item)
                     return True
+                return False
+            if self.scheduler.remove(remove):
+                self.server.queue_updated()
+                return True
         return False
 
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        history_store = self.get_history_store()
+        if history_store is not None:
+            # Entries are decoded from the database so they are already private copies.
+            if prompt_id is None:
+                out = history_store.get_page(max_items=max_items, offset=offset)
+            else:
+                p = history_store.get(prompt_id)
+                out = {} if p is None else {prompt_id: p}
+            if map_function is not None:
+                out = {k: map_function(v) for k, v in out.items()}
+            return out
+
         with self.mutex:
             if prompt_id is None:
                 out = {}
@@ -1209,12 +1324,37 @@ class PromptQueue:
             else:
                 return {}
 
+    def get_history_by_output(self, filename, subfolder=None, output_type=None):
+        history_store = self.get_history_store()
+        if history_store is not None:
+            return history_store.find_by_output(filename, subfolder, output_type)
+
+        with self.mutex:
+            out = {}
+            for k, p in self.history.items():
+                for _, item in iter_output_files(p.get("outputs", {})):
+                    if item["filename"] != filename:
+                        continue
+                    if subfolder is not None and item.get("subfolder", "") != subfolder:
+                        continue
+                    if output_type is not None and item.get("type") != output_type:
+                        continue
+                    out[k] = copy.deepcopy(p)
+                    break
+            return out
+
     def wipe_history(self):
         with self.mutex:
+            history_store = self.get_history_store()
+            if history_store is not None:
+                history_store.wipe()
             self.history = {}
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
+            history_store = self.get_history_store()
+            if history_store is not None:
+                history_store.delete(id_to_delete)
             self.history.pop(id_to_delete, None)
 
     def set_flag(self, name, data):
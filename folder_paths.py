@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import contextlib
 import os
 import time
 import mimetypes
 import logging
+import threading
 from typing import Literal, List
 from collections.abc import Collection
 
@@ -54,6 +56,7 @@ output_directory = os.path.join(base_path, "output")
 temp_directory = os.path.join(base_path, "temp")
 input_directory = os.path.join(base_path, "input")
 user_directory = os.path.join(base_path, "user")
+cache_directory = os.path.join(base_path, "cache")
 
 filename_list_cache: dict[str, tuple[list[str], dict[str, float], float]] = {}
 
@@ -87,6 +90,97 @@ class CacheHelper:
 
 cache_helper = CacheHelper()
 
+class SaveCounterIndex:
+    """
+    Next free counter of every (output folder, filename prefix) used by get_save_image_path.
+    The folder is only listed the first time a prefix is used, after that the counters handed
+    out are tracked in memory and the files that may have been written by someone else are
+    checked by name, using the suffixes (the part after the counter) seen for that prefix, so
+    the cost doesn't grow with the folder size. When the caller passes the suffix it will write,
+    the files are also reserved with O_EXCL so a concurrent writer can't take the same names.
+    """
+    def __init__(self):
+        self.entries: dict[tuple[str, str], dict] = {}
+        self.lock = threading.Lock()
+
+    def scan(self, folder: str, filename: str) -> dict:
+        prefix_len = len(filename)
+        counter = 0
+        suffixes = set()
+        for name in os.listdir(folder):
+            if os.path.normcase(name[:prefix_len]) != os.path.normcase(filename) or name[prefix_len:prefix_len + 1] != "_":
+                continue
+            digits = name[prefix_len + 1:].split('_')[0]
+            try:
+                counter = max(counter, int(digits))
+            except ValueError:
+                continue
+            suffixes.add(name[prefix_len + 1 + len(digits):])
+        return {"next": counter + 1, "suffixes": suffixes}
+
+    @staticmethod
+    def file_name(filename: str, counter: int, index: int, suffix: str) -> str:
+        return f"{filename.replace('%batch_num%', str(index))}_{counter + index:05}{suffix}"
+
+    def in_use(self, folder: str, filename: str, counter: int, count: int, suffixes) -> bool:
+        return any(os.path.lexists(os.path.join(folder, self.file_name(filename, counter, i, suffix))) for i in range(count) for suffix in suffixes)
+
+    def create(self, folder: str, filename: str, counter: int, count: int, suffix: str) -> bool:
+        """Creates the (empty) files the caller will write, False if one of them already exists."""
+        created = []
+        try:
+            for i in range(count):
+                path = os.path.join(folder, self.file_name(filename, counter, i, suffix))
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                created.append(path)
+        except FileExistsError:
+            for path in created:
+                os.remove(path)
+            return False
+        return True
+
+    def release(self, folder: str, filename: str, counter: int, count: int, suffix: str):
+        """Removes the files reserved by create that are still empty."""
+        for i in range(max(count, 1)):
+            path = os.path.join(folder, self.file_name(filename, counter, i, suffix))
+            try:
+                if os.path.getsize(path) == 0:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def reserve(self, folder: str, filename: str, count: int = 1, suffix: str | None = None) -> int:
+        """Returns the first of count consecutive counters that are free for this prefix."""
+        key = (os.path.normcase(os.path.abspath(folder)), os.path.normcase(filename))
+        count = max(count, 1)
+        with self.lock:
+            if not os.path.isdir(folder):
+                os.makedirs(folder, exist_ok=True)
+                self.entries[key] = {"next": 1, "suffixes": set()}
+
+            entry = self.entries.get(key, None)
+            if entry is None or len(entry["suffixes"]) == 0:
+                scanned = self.scan(folder, filename)
+                if entry is not None:
+                    scanned["next"] = max(scanned["next"], entry["next"])
+                entry = self.entries[key] = scanned
+            if suffix is not None:
+                entry["suffixes"].add(suffix)
+
+            while True:
+                counter = entry["next"]
+                entry["next"] += count
+                if self.in_use(folder, filename, counter, count, entry["suffixes"]):
+                    continue
+                if suffix is None or self.create(folder, filename, counter, count, suffix):
+                    return counter
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+save_counters = SaveCounterIndex()
+
 extension_mimetypes_cache = {
     "webp" : "image",
     "fbx" : "model",
@@ -134,6 +228,14 @@ def set_user_directory(user_dir: str) -> None:
     global user_directory
     user_directory = user_dir
 
+def get_cache_directory() -> str:
+    global cache_directory
+    return cache_directory
+
+def set_cache_directory(cache_dir: str) -> None:
+    global cache_directory
+    cache_directory = cache_dir
+
 
 #NOTE: used in http server so don't put folders that should not be accessed remotely
 def get_directory_by_type(type_name: str) -> str | None:
@@ -309,18 +411,162 @@ def get_full_path_or_raise(folder_name: str, filename: str) -> str:
     return full_path
 
 
+class ModelIndexRoot:
+    """
+    The files under one model directory, grouped by the directory they are in so a change
+    only rescans the directory that changed. version is increased on every change.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.scanned = False
+        self.version = 0
+        self.files: dict[str, set[str]] = {}
+        self.dirs: dict[str, float] = {}
+        self.stats: dict[str, os.stat_result] = {}
+        self.file_list: list[str] = []
+        self.file_list_version = -1
+
+    def add_tree(self, directory: str):
+        files, dirs = recursive_search(directory, excluded_dir_names=[".git"])
+        for x in files:
+            if os.path.basename(x).startswith("."):
+                continue
+            path = os.path.join(directory, x)
+            self.files.setdefault(os.path.dirname(path), set()).add(os.path.relpath(path, self.directory))
+        for x, mtime in dirs.items():
+            self.dirs[os.path.normpath(x)] = mtime
+
+    def remove_tree(self, directory: str):
+        for x in [x for x in self.dirs if x == directory or x.startswith(directory + os.sep)]:
+            self.dirs.pop(x, None)
+            for name in self.files.pop(x, ()):
+                self.stats.pop(name, None)
+
+    def scan(self):
+        self.files = {}
+        self.dirs = {}
+        self.stats = {}
+        self.add_tree(self.directory)
+        self.scanned = True
+        self.version += 1
+
+    def rescan_dir(self, directory: str):
+        """Updates the files directly in a directory and the trees of its added or removed subdirectories."""
+        if directory not in self.dirs:
+            return
+        try:
+            mtime = os.path.getmtime(directory)
+            entries = list(os.scandir(directory))
+        except OSError:
+            self.remove_tree(directory)
+            self.version += 1
+            return
+
+        self.dirs[directory] = mtime
+        files = set()
+        subdirs = set()
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name != ".git":
+                    subdirs.add(os.path.normpath(entry.path))
+            elif not entry.name.startswith("."):
+                files.add(os.path.relpath(entry.path, self.directory))
+        for name in self.files.get(directory, ()):
+            self.stats.pop(name, None)
+        self.files[directory] = files
+
+        existing = set(x for x in self.dirs if os.path.dirname(x) == directory and x != directory)
+        for x in existing - subdirs:
+            self.remove_tree(x)
+        for x in subdirs - existing:
+            self.add_tree(x)
+        self.version += 1
+
+    def refresh(self):
+        """Compares the mtime of every known directory with the disk and rescans the ones that changed."""
+        if not self.scanned or (self.directory not in self.dirs and os.path.isdir(self.directory)):
+            self.scan()
+            return
+        changed = []
+        for directory, mtime in self.dirs.items():
+            try:
+                if os.path.getmtime(directory) != mtime:
+                    changed.append(directory)
+            except OSError:
+                changed.append(directory)
+        for directory in changed:
+            self.rescan_dir(directory)
+
+    def get_files(self) -> list[str]:
+        with self.lock:
+            if self.file_list_version != self.version:
+                self.file_list = [x for files in self.files.values() for x in files]
+                self.file_list_version = self.version
+            return self.file_list
+
+    def get_stat(self, name: str) -> os.stat_result:
+        with self.lock:
+            stat = self.stats.get(name, None)
+        if stat is None:
+            stat = os.stat(os.path.join(self.directory, name))
+            with self.lock:
+                self.stats[name] = stat
+        return stat
+
+
+class ModelIndex:
+    """
+    Index of the files in the model folders, shared by get_filename_list and the model manager.
+    Each directory is scanned once. When a watcher keeps the index up to date (see
+    app/model_watcher.py) lookups don't touch the disk, otherwise the directory mtimes are
+    checked on every lookup.
+    """
+    def __init__(self):
+        self.roots: dict[str, ModelIndexRoot] = {}
+        self.lock = threading.Lock()
+        self.watched = False
+
+    def get_root(self, directory: str, refresh: bool = True) -> ModelIndexRoot:
+        key = os.path.normpath(directory)
+        with self.lock:
+            root = self.roots.get(key, None)
+            if root is None:
+                root = self.roots[key] = ModelIndexRoot(key)
+        with root.lock:
+            if not root.scanned:
+                root.scan()
+            elif refresh and not self.watched:
+                root.refresh()
+        return root
+
+    def get_roots(self) -> list[ModelIndexRoot]:
+        with self.lock:
+            return list(self.roots.values())
+
+    def directory_changed(self, directory: str):
+        directory = os.path.normpath(directory)
+        for root in self.get_roots():
+            with root.lock:
+                if directory in root.dirs:
+                    root.rescan_dir(directory)
+
+model_index = ModelIndex()
+
+
 def get_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float], float]:
     folder_name = map_legacy(folder_name)
     global folder_names_and_paths
     output_list = set()
     folders = folder_names_and_paths[folder_name]
-    output_folders = {}
+    versions = {}
     for x in folders[0]:
-        files, folders_all = recursive_search(x, excluded_dir_names=[".git"])
-        output_list.update(filter_files_extensions(files, folders[1]))
-        output_folders = {**output_folders, **folders_all}
+        root = model_index.get_root(x)
+        with root.lock:
+            output_list.update(filter_files_extensions(root.get_files(), folders[1]))
+            versions[x] = root.version
 
-    return sorted(list(output_list)), output_folders, time.perf_counter()
+    return sorted(list(output_list)), versions, time.perf_counter()
 
 def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float], float] | None:
     strong_cache = cache_helper.get(folder_name)
@@ -334,17 +580,12 @@ def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float]
         return None
     out = filename_list_cache[folder_name]
 
-    for x in out[1]:
-        time_modified = out[1][x]
-        folder = x
-        if os.path.getmtime(folder) != time_modified:
-            return None
-
     folders = folder_names_and_paths[folder_name]
+    if len(folders[0]) != len(out[1]):
+        return None
     for x in folders[0]:
-        if os.path.isdir(x):
-            if x not in out[1]:
-                return None
+        if out[1].get(x, None) != model_index.get_root(x).version:
+            return None
 
     return out
 
@@ -358,16 +599,13 @@ def get_filename_list(folder_name: str) -> list[str]:
     cache_helper.set(folder_name, out)
     return list(out[0])
 
-def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
-    def map_filename(filename: str) -> tuple[int, str]:
-        prefix_len = len(os.path.basename(filename_prefix))
-        prefix = filename[:prefix_len + 1]
-        try:
-            digits = int(filename[prefix_len + 1:].split('_')[0])
-        except:
-            digits = 0
-        return digits, prefix
-
+def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0, batch_size=1, suffix: str | None = None) -> tuple[str, str, int, str, str]:
+    """
+    Returns (full output folder, filename, counter, subfolder, filename prefix) for saving files named
+    {filename}_{counter:05}... batch_size counters starting at counter are reserved for the caller.
+    When suffix is given the files {filename}_{counter:05}{suffix} are created empty so no other
+    writer can pick the same names, the caller is expected to overwrite them.
+    """
     def compute_vars(input: str, image_width: int, image_height: int) -> str:
         input = input.replace("%width%", str(image_width))
         input = input.replace("%height%", str(image_height))
@@ -396,15 +634,21 @@ def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, im
         logging.error(err)
         raise Exception(err)
 
-    try:
-        counter = max(filter(lambda a: os.path.normcase(a[1][:-1]) == os.path.normcase(filename) and a[1][-1] == "_", map(map_filename, os.listdir(full_output_folder))))[0] + 1
-    except ValueError:
-        counter = 1
-    except FileNotFoundError:
-        os.makedirs(full_output_folder, exist_ok=True)
-        counter = 1
+    counter = save_counters.reserve(full_output_folder, filename, batch_size, suffix)
     return full_output_folder, filename, counter, subfolder, filename_prefix
 
+@contextlib.contextmanager
+def save_path_reservation(full_output_folder: str, filename: str, counter: int, count: int, suffix: str):
+    """
+    Removes the files get_save_image_path reserved (with the same count and suffix) that are
+    still empty when the block raises, so a failed save doesn't leave empty files behind.
+    """
+    try:
+        yield
+    except BaseException:
+        save_counters.release(full_output_folder, filename, counter, count, suffix)
+        raise
+
 def get_input_subfolders() -> list[str]:
     """Returns a list of all subfolder paths in the input directory, recursively.
 
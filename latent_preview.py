@@ -1,11 +1,16 @@
 import torch
-from PIL import Image
+from PIL import Image, ImageOps
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from comfy.cli_args import args, LatentPreviewMethod
 from comfy.taesd.taesd import TAESD
 import comfy.model_management
 import folder_paths
 import comfy.utils
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 MAX_PREVIEW_RESOLUTION = args.preview_size
 
@@ -19,6 +24,15 @@ def preview_to_image(latent_image):
 
         return Image.fromarray(latents_ubyte.numpy())
 
+def encode_preview(image_data):
+    """Resizes and encodes a ("JPEG", PIL image, max size) preview tuple, the server sends the bytes as they are."""
+    image_type, image, max_size = image_data
+    if max_size is not None:
+        image = ImageOps.contain(image, (max_size, max_size), Image.Resampling.BILINEAR)
+    bytesIO = BytesIO()
+    image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+    return (image_type, bytesIO.getvalue(), None)
+
 class LatentPreviewer:
     def decode_latent_to_preview(self, x0):
         pass
@@ -59,50 +73,140 @@ class Latent2RGBPreviewer(LatentPreviewer):
         return preview_to_image(latent_image)
 
 
-def get_previewer(device, latent_format):
+def taesd_decoder_path(latent_format):
+    if latent_format.taesd_decoder_name is None:
+        return None
+    taesd_decoder_path = next(
+        (fn for fn in folder_paths.get_filename_list("vae_approx")
+            if fn.startswith(latent_format.taesd_decoder_name)),
+        ""
+    )
+    return folder_paths.get_full_path("vae_approx", taesd_decoder_path)
+
+def load_previewer(device, latent_format, method, taesd_decoder_path):
     previewer = None
-    method = args.preview_method
-    if method != LatentPreviewMethod.NoPreviews:
-        # TODO previewer methods
-        taesd_decoder_path = None
-        if latent_format.taesd_decoder_name is not None:
-            taesd_decoder_path = next(
-                (fn for fn in folder_paths.get_filename_list("vae_approx")
-                    if fn.startswith(latent_format.taesd_decoder_name)),
-                ""
-            )
-            taesd_decoder_path = folder_paths.get_full_path("vae_approx", taesd_decoder_path)
-
-        if method == LatentPreviewMethod.Auto:
-            method = LatentPreviewMethod.Latent2RGB
-
-        if method == LatentPreviewMethod.TAESD:
-            if taesd_decoder_path:
-                taesd = TAESD(None, taesd_decoder_path, latent_channels=latent_format.latent_channels).to(device)
-                previewer = TAESDPreviewerImpl(taesd)
-            else:
-                logging.warning("Warning: TAESD previews enabled, but could not find models/vae_approx/{}".format(latent_format.taesd_decoder_name))
-
-        if previewer is None:
-            if latent_format.latent_rgb_factors is not None:
-                previewer = Latent2RGBPreviewer(latent_format.latent_rgb_factors, latent_format.latent_rgb_factors_bias)
+    # TODO previewer methods
+    if method == LatentPreviewMethod.Auto:
+        method = LatentPreviewMethod.Latent2RGB
+
+    if method == LatentPreviewMethod.TAESD:
+        if taesd_decoder_path:
+            taesd = TAESD(None, taesd_decoder_path, latent_channels=latent_format.latent_channels).to(device)
+            previewer = TAESDPreviewerImpl(taesd)
+        else:
+            logging.warning("Warning: TAESD previews enabled, but could not find models/vae_approx/{}".format(latent_format.taesd_decoder_name))
+
+    if previewer is None:
+        if latent_format.latent_rgb_factors is not None:
+            previewer = Latent2RGBPreviewer(latent_format.latent_rgb_factors, latent_format.latent_rgb_factors_bias)
     return previewer
 
+# Previewers are kept between sampling runs so the TAESD decoders are only loaded once per latent format and device.
+# Only the MAX_PREVIEWERS last used ones are kept, unload_previewers drops them all.
+MAX_PREVIEWERS = 2
+previewers = OrderedDict()
+previewers_lock = threading.Lock()
+
+def get_previewer(device, latent_format):
+    method = args.preview_method
+    if method == LatentPreviewMethod.NoPreviews:
+        return None
+    decoder_path = taesd_decoder_path(latent_format)
+    key = (method, str(device), type(latent_format), decoder_path)
+    with previewers_lock:
+        if key in previewers:
+            previewers.move_to_end(key)
+            return previewers[key]
+        previewer = load_previewer(device, latent_format, method, decoder_path)
+        previewers[key] = previewer
+        while len(previewers) > MAX_PREVIEWERS:
+            previewers.popitem(last=False)
+        return previewer
+
+def unload_previewers():
+    with previewers_lock:
+        previewers.clear()
+
+preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="latent_preview")
+
+class PreviewPipeline:
+    """
+    Decodes and encodes the previews of a sampling run on the preview thread. Only the latest
+    latent waiting to be decoded is kept: when the thread is slower than the sampler, the
+    intermediate steps are skipped. take() returns the newest finished preview, once.
+    """
+    def __init__(self, previewer, preview_format):
+        self.previewer = previewer
+        self.preview_format = preview_format
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.busy = False
+        self.pending = None
+        self.result = None
+
+    def submit(self, x0):
+        with self.lock:
+            if self.busy:
+                self.pending = x0
+                return
+            self.busy = True
+        preview_executor.submit(self.run, x0)
+
+    def run(self, x0):
+        while x0 is not None:
+            result = None
+            try:
+                with torch.inference_mode():
+                    result = encode_preview(self.previewer.decode_latent_to_preview_image(self.preview_format, x0))
+            except Exception as e:
+                logging.warning("Failed to decode the latent preview: {}".format(e))
+            with self.lock:
+                if result is not None:
+                    self.result = result
+                x0 = self.pending
+                self.pending = None
+                if x0 is None:
+                    self.busy = False
+                    self.idle.notify_all()
+
+    def wait(self):
+        """Waits until the submitted latents are decoded."""
+        with self.lock:
+            while self.busy:
+                self.idle.wait()
+
+    def take(self):
+        with self.lock:
+            result = self.result
+            self.result = None
+        return result
+
 def prepare_callback(model, steps, x0_output_dict=None):
     preview_format = "JPEG"
     if preview_format not in ["JPEG", "PNG"]:
         preview_format = "JPEG"
 
     previewer = get_previewer(model.load_device, model.model.latent_format)
+    pipeline = PreviewPipeline(previewer, preview_format) if previewer else None
+    last_preview = None
 
     pbar = comfy.utils.ProgressBar(steps)
     def callback(step, x0, x, total_steps):
+        nonlocal last_preview
         if x0_output_dict is not None:
             x0_output_dict["x0"] = x0
 
         preview_bytes = None
-        if previewer:
-            preview_bytes = previewer.decode_latent_to_preview_image(preview_format, x0)
+        if pipeline is not None:
+            now = time.monotonic()
+            last_step = step + 1 == total_steps
+            if last_preview is None or now - last_preview >= args.preview_interval or last_step:
+                last_preview = now
+                # The sampler keeps updating x0, the preview thread gets its own copy of the first sample
+                pipeline.submit(x0[:1].clone())
+            if last_step:
+                # No callback comes after this one to send the final preview
+                pipeline.wait()
+            preview_bytes = pipeline.take()
         pbar.update_absolute(step + 1, total_steps, preview_bytes)
     return callback
-
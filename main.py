@@ -56,6 +56,11 @@ def apply_custom_paths():
         logging.info(f"Setting user directory to: {user_dir}")
         folder_paths.set_user_directory(user_dir)
 
+    if args.cache_directory:
+        cache_dir = os.path.abspath(args.cache_directory)
+        logging.info(f"Setting cache directory to: {cache_dir}")
+        folder_paths.set_cache_directory(cache_dir)
+
 
 def execute_prestartup_script():
     if args.disable_all_custom_nodes and len(args.whitelist_custom_nodes) == 0:
@@ -145,6 +150,13 @@ if 'torch' in sys.modules:
     logging.warning("WARNING: Potential Error in code: Torch already imported, torch should never be imported before this point.")
 
 import comfy.utils
+import comfy.text_encoder_cache
+import comfy.state_dict_cache
+import comfy.lora_cache
+import comfy.merged_weight_cache
+import comfy.model_hash
+import comfy.vae_memory
+import latent_preview
 
 import execution
 import server
@@ -153,6 +165,9 @@ import nodes
 import comfy.model_management
 import comfyui_version
 import app.logger
+import app.model_watcher
+import comfy_execution.prefetch
+import comfy_execution.batch_fusion
 import hook_breaker_ac10a0
 
 def cuda_malloc_warning():
@@ -167,7 +182,9 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+def prompt_worker(q, server_instance, device_id=None):
+    if device_id is not None:
+        comfy.model_management.set_torch_device(device_id)
     current_time: float = 0.0
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
@@ -177,7 +194,7 @@ def prompt_worker(q, server_instance):
     elif args.cache_none:
         cache_type = execution.CacheType.NONE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram } )
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram, "disk" : args.cache_disk } )
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -189,49 +206,65 @@ def prompt_worker(q, server_instance):
 
         queue_item = q.get(timeout=timeout)
         if queue_item is not None:
-            item, item_id = queue_item
-            execution_start_time = time.perf_counter()
-            prompt_id = item[1]
-            server_instance.last_prompt_id = prompt_id
-
-            sensitive = item[5]
-            extra_data = item[3].copy()
-            for k in sensitive:
-                extra_data[k] = sensitive[k]
-
-            e.execute(item[2], prompt_id, extra_data, item[4])
-            need_gc = True
-
-            remove_sensitive = lambda prompt: prompt[:5] + prompt[6:]
-            q.task_done(item_id,
-                        e.history_result,
-                        status=execution.PromptQueue.ExecutionStatus(
-                            status_str='success' if e.success else 'error',
-                            completed=e.success,
-                            messages=e.status_messages), process_item=remove_sensitive)
-            if server_instance.client_id is not None:
-                server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
-
-            current_time = time.perf_counter()
-            execution_time = current_time - execution_start_time
-
-            # Log Time in a more readable way after 10 minutes
-            if execution_time > 600:
-                execution_time = time.strftime("%H:%M:%S", time.gmtime(execution_time))
-                logging.info(f"Prompt executed in {execution_time}")
-            else:
-                logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
+            followers = []
+            fusion = None
+            if args.sampler_batch_fusion > 1:
+                fusion = comfy_execution.batch_fusion.FusionGroup(queue_item[0], args.sampler_batch_fusion, q.is_pending)
+                followers = [item[1] for item in q.find_matching(fusion.add, args.sampler_batch_fusion - 1)]
+
+            # The fused prompts stay in the queue (and can be deleted) until they are taken, right after the leader
+            batch = itertools.chain([queue_item], filter(None, map(q.take, followers)))
+            for item, item_id in batch:
+                execution_start_time = time.perf_counter()
+                prompt_id = item[1]
+                server_instance.last_prompt_id = prompt_id
+
+                sensitive = item[5]
+                extra_data = item[3].copy()
+                for k in sensitive:
+                    extra_data[k] = sensitive[k]
+
+                e.execute(item[2], prompt_id, extra_data, item[4])
+                need_gc = True
+
+                remove_sensitive = lambda prompt: prompt[:5] + prompt[6:]
+                q.task_done(item_id,
+                            e.history_result,
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='success' if e.success else 'error',
+                                completed=e.success,
+                                messages=e.status_messages), process_item=remove_sensitive)
+                server_instance.preview_manager.warm_outputs(e.history_result.get("outputs", {}))
+                if server_instance.client_id is not None:
+                    server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+
+                current_time = time.perf_counter()
+                execution_time = current_time - execution_start_time
+
+                # Log Time in a more readable way after 10 minutes
+                if execution_time > 600:
+                    execution_time = time.strftime("%H:%M:%S", time.gmtime(execution_time))
+                    logging.info(f"Prompt executed in {execution_time}")
+                else:
+                    logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
+
+            if fusion is not None:
+                fusion.close()
 
         flags = q.get_flags()
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
             comfy.model_management.unload_all_models()
+            latent_preview.unload_previewers()
             need_gc = True
             last_gc_collect = 0
 
         if free_memory:
             e.reset()
+            comfy.state_dict_cache.cache.clear()
+            comfy.lora_cache.cache.clear()
+            comfy.merged_weight_cache.cache.clear()
             need_gc = True
             last_gc_collect = 0
 
@@ -311,6 +344,9 @@ def start_comfyui(asyncio_loop=None):
         folder_paths.set_temp_directory(temp_dir)
     cleanup_temp()
 
+    if args.text_encoder_cache_disk > 0:
+        comfy.text_encoder_cache.enable_disk_cache(os.path.join(folder_paths.get_cache_directory(), "text_encoder"), args.text_encoder_cache_disk)
+
     if args.windows_standalone_build:
         try:
             import new_updater
@@ -318,6 +354,8 @@ def start_comfyui(asyncio_loop=None):
         except:
             pass
 
+    app.model_watcher.start_model_watcher(args.model_watch_interval)
+
     if not asyncio_loop:
         asyncio_loop = asyncio.new_event_loop()
         asyncio.set_event_loop(asyncio_loop)
@@ -336,7 +374,23 @@ def start_comfyui(asyncio_loop=None):
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    # Workers sharing a device would unload and unpatch the models the others are sampling with,
+    # so there is at most one worker per device
+    worker_devices = [None]
+    if args.prompt_worker_devices is not None:
+        devices = list(dict.fromkeys(int(x) for x in args.prompt_worker_devices.split(",") if x.strip() != ""))
+        worker_devices = devices[:max(args.prompt_workers, 1)]
+    if args.prompt_workers > len(worker_devices):
+        logging.warning("--prompt-workers {}: starting {} prompt worker(s), one per device of --prompt-worker-devices.".format(args.prompt_workers, len(worker_devices)))
+    comfy_execution.prefetch.start_prefetcher(prompt_server.prompt_queue, args.prefetch_models)
+    comfy.model_hash.index.set_path(os.path.join(folder_paths.get_cache_directory(), "model_hashes.json"))
+    comfy.vae_memory.profile.set_path(os.path.join(folder_paths.get_cache_directory(), "vae_memory_profile.json"))
+    if not args.disable_model_hasher:
+        comfy.model_hash.start_model_hasher(lambda: len(prompt_server.prompt_queue.currently_running) > 0)
+    for i, device_id in enumerate(worker_devices):
+        threading.Thread(target=prompt_worker, daemon=True, name="PromptWorker-{}".format(i), args=(prompt_server.prompt_queue, prompt_server, device_id)).start()
+    if len(worker_devices) > 1:
+        logging.info("Started {} prompt workers, devices: {}".format(len(worker_devices), worker_devices))
 
     if args.quick_test_for_ci:
         exit(0)
@@ -0,0 +1,69 @@
+"""
+Measures how fast safetensors files load with each loader of comfy.utils.load_torch_file.
+
+    python scripts/benchmark_safetensors_load.py models/diffusion_models/flux1-dev.safetensors --threads 8 16
+
+The tensors returned by the safe_open and mmap loaders are only read from disk when used,
+so every page is touched before the time is taken. Run it after dropping the page cache
+(echo 3 > /proc/sys/vm/drop_caches on Linux) to measure the disk instead of the RAM.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+import comfy.utils  # noqa: E402
+
+PAGE_SIZE = 4096
+
+
+def touch(sd):
+    total = 0
+    for tensor in sd.values():
+        if tensor.numel() > 0:
+            data = tensor.reshape(-1).view(torch.uint8)
+            total += int(data[::PAGE_SIZE].sum())
+    return total
+
+
+def run(path, loader, threads, device):
+    comfy.utils.SAFETENSORS_LOADER = loader
+    comfy.utils.args.safetensors_load_threads = threads
+    start = time.perf_counter()
+    sd = comfy.utils.load_torch_file(path, device=device)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    else:
+        touch(sd)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Safetensors load throughput in GB/s.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--loaders", nargs="+", default=["safe_open", "mmap", "parallel"], choices=["safe_open", "mmap", "parallel"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[8], help="Thread counts tried with the parallel loader.")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--repeat", type=int, default=1)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+
+    device = torch.device(options.device)
+    for path in options.files:
+        size = os.path.getsize(path)
+        logging.info("{} ({:.2f} GB)".format(path, size / (1024 ** 3)))
+        for loader in options.loaders:
+            for threads in (options.threads if loader == "parallel" or device.type == "cuda" else [1]):
+                for _ in range(options.repeat):
+                    elapsed = run(path, loader, threads, device)
+                    name = loader if loader != "parallel" and device.type != "cuda" else "{} ({} threads)".format(loader, threads)
+                    logging.info("  {:<24} {:8.2f}s {:8.2f} GB/s".format(name, elapsed, size / elapsed / (1024 ** 3)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures the throughput of comfy.utils.tiled_scale against the previous implementation (one tile
+per call, feather mask rebuilt pixel row by pixel row for every tile) and with batched tiles.
+
+    python scripts/benchmark_tiled_scale.py --size 1024 1024 --tile 128 --batch 1 4 16
+
+The upscaler is a small convolutional network (conv, pixel shuffle) so the time is split between
+the model calls and the blending of the tiles like with a real upscale model or VAE. On the CPU
+the gain comes from the blending, batching pays off on GPUs where small tiles leave it idle.
+"""
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+import comfy.utils  # noqa: E402
+
+
+class Upscaler(torch.nn.Module):
+    def __init__(self, scale, channels=32):
+        super().__init__()
+        self.scale = scale
+        self.body = torch.nn.Sequential(
+            torch.nn.Conv2d(3, channels, 3, padding=1),
+            torch.nn.ReLU(),
+            torch.nn.Conv2d(channels, channels, 3, padding=1),
+            torch.nn.ReLU(),
+            torch.nn.Conv2d(channels, 3 * scale * scale, 3, padding=1),
+            torch.nn.PixelShuffle(scale),
+        )
+
+    def forward(self, x):
+        return self.body(x)
+
+
+def previous_tiled_scale(samples, function, tile, overlap, scale):
+    out = torch.zeros([1, 3, samples.shape[2] * scale, samples.shape[3] * scale])
+    out_div = torch.zeros_like(out)
+    positions = [range(0, samples.shape[d] - overlap, tile - overlap) if samples.shape[d] > tile else [0] for d in (2, 3)]
+    for y, x in itertools.product(*positions):
+        y = max(0, min(samples.shape[2] - overlap, y))
+        x = max(0, min(samples.shape[3] - overlap, x))
+        ps = function(samples[:, :, y:y + tile, x:x + tile]).to("cpu")
+        mask = torch.ones_like(ps)
+        feather = overlap * scale
+        for d in (2, 3):
+            for t in range(feather):
+                a = (t + 1) / feather
+                mask.narrow(d, t, 1).mul_(a)
+                mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
+        out[:, :, y * scale:y * scale + ps.shape[2], x * scale:x * scale + ps.shape[3]] += ps * mask
+        out_div[:, :, y * scale:y * scale + ps.shape[2], x * scale:x * scale + ps.shape[3]] += mask
+    return out / out_div
+
+
+def run(model, image, tile, overlap, batch, device, accumulate_device):
+    start = time.perf_counter()
+    if batch is None:
+        previous_tiled_scale(image, model, tile, overlap, model.scale)
+    else:
+        comfy.utils.tiled_scale(image, model, tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=model.scale, max_tile_batch=batch, accumulate_device=accumulate_device)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled upscale throughput in tiles/s.")
+    parser.add_argument("--size", nargs=2, type=int, default=[1024, 1024], metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--tile", type=int, default=128)
+    parser.add_argument("--overlap", type=int, default=16)
+    parser.add_argument("--scale", type=int, default=4)
+    parser.add_argument("--batch", nargs="+", type=int, default=[1, 4, 16], help="Tile batch sizes to try.")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--accumulate-on-device", action="store_true", help="Blend the tiles on --device instead of the CPU.")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", force=True)
+
+    device = torch.device(options.device)
+    accumulate_device = device if options.accumulate_on_device else None
+    model = Upscaler(options.scale).to(device).eval()
+    image = torch.rand([1, 3] + options.size, device=device)
+    tiles = comfy.utils.get_tiled_scale_steps(options.size[1], options.size[0], options.tile, options.tile, options.overlap)
+    logging.info("{}x{} image, {} tiles of {}px, x{} upscale on {}".format(options.size[1], options.size[0], tiles, options.tile, options.scale, device))
+
+    with torch.inference_mode():
+        run(model, image, options.tile, options.overlap, 1, device, accumulate_device)  # warmup
+        baseline = None
+        for batch in [None] + options.batch:
+            elapsed = min(run(model, image, options.tile, options.overlap, batch, device, accumulate_device) for _ in range(options.repeat))
+            if baseline is None:
+                baseline = elapsed
+            name = "previous" if batch is None else "batch {}".format(batch)
+            logging.info("  {:<10} {:8.3f}s {:8.1f} tiles/s {:6.2f}x".format(name, elapsed, tiles / elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
 import sys
 import asyncio
+import threading
 import traceback
 
 import nodes
@@ -26,14 +27,21 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.state_dict_cache
+import comfy.lora_cache
+import comfy.merged_weight_cache
+import comfy.model_hash
 from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
 from app.frontend_management import FrontendManager
 from comfy_api.internal import _ComfyNodeInternal
+from comfy_execution.scheduler import PRIORITY_CLASSES
 
 from app.user_manager import UserManager
 from app.model_manager import ModelFileManager
+from app.preview_manager import PreviewManager, same_file_content
+from app.broadcaster import Broadcaster, OutgoingMessage
 from app.custom_node_manager import CustomNodeManager
 from app.subgraph_manager import SubgraphManager
 from typing import Optional, Union
@@ -43,12 +51,6 @@ from protocol import BinaryEventTypes
 # Import cache control middleware
 from middleware.cache_middleware import cache_control
 
-async def send_socket_catch_exception(function, message):
-    try:
-        await function(message)
-    except (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError) as err:
-        logging.warning("send error: {}".format(err))
-
 # Track deprecated paths that have been warned about to only warn once per file
 _deprecated_paths_warned = set()
 
@@ -163,23 +165,62 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+class WorkerLocal:
+    """
+    Attribute with a separate value in every prompt worker thread so concurrent prompts
+    don't overwrite each other's client/prompt/node. Threads that never set it (the event
+    loop) read the value that was set last by any thread.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance.worker_local, self.name, instance.worker_shared.get(self.name, None))
+
+    def __set__(self, instance, value):
+        setattr(instance.worker_local, self.name, value)
+        instance.worker_shared[self.name] = value
+
+
+def parse_client_weights(values):
+    weights = {}
+    for value in values:
+        client_id, _, weight = value.rpartition("=")
+        try:
+            weights[client_id] = float(weight)
+        except ValueError:
+            logging.warning("Ignoring invalid --queue-client-weight {}".format(value))
+    return weights
+
+
 class PromptServer():
+    client_id = WorkerLocal()
+    last_node_id = WorkerLocal()
+    last_prompt_id = WorkerLocal()
+
     def __init__(self, loop):
         PromptServer.instance = self
+        self.worker_local = threading.local()
+        self.worker_shared = {}
 
         mimetypes.init()
         mimetypes.add_type('application/javascript; charset=utf-8', '.js')
         mimetypes.add_type('image/webp', '.webp')
 
         self.user_manager = UserManager()
-        self.model_file_manager = ModelFileManager()
+        self.preview_manager = PreviewManager(directory=os.path.join(folder_paths.get_cache_directory(), "previews"),
+                                              disk_size=int(args.preview_cache_size * (1024 ** 3)))
+        self.model_file_manager = ModelFileManager(self.preview_manager)
         self.custom_node_manager = CustomNodeManager()
         self.subgraph_manager = SubgraphManager()
         self.internal_routes = InternalRoutes(self)
         self.supports = ["custom_nodes_from_web"]
-        self.prompt_queue = execution.PromptQueue(self)
+        self.prompt_queue = execution.PromptQueue(self, client_weights=parse_client_weights(args.queue_client_weight), affinity_window=args.queue_model_affinity)
         self.loop = loop
         self.messages = asyncio.Queue()
+        self.broadcaster = Broadcaster()
         self.client_session:Optional[aiohttp.ClientSession] = None
         self.number = 0
 
@@ -222,6 +263,7 @@ class PromptServer():
 
             # Store WebSocket for backward compatibility
             self.sockets[sid] = ws
+            self.broadcaster.add(sid, ws)
             # Store metadata separately
             self.sockets_metadata[sid] = {"feature_flags": {}}
 
@@ -265,8 +307,10 @@ class PromptServer():
                         except Exception as e:
                             logging.error(f"Error processing WebSocket message: {e}")
             finally:
-                self.sockets.pop(sid, None)
-                self.sockets_metadata.pop(sid, None)
+                if self.sockets.get(sid, None) is ws:
+                    self.sockets.pop(sid, None)
+                    self.sockets_metadata.pop(sid, None)
+                    self.broadcaster.remove(sid)
             return ws
 
         @routes.get("/")
@@ -324,17 +368,9 @@ class PromptServer():
             return type_dir, dir_type
 
         def compare_image_hash(filepath, image):
-            hasher = node_helpers.hasher()
-
             # function to compare hashes of two images to see if it already exists, fix to #3465
             if os.path.exists(filepath):
-                a = hasher()
-                b = hasher()
-                with open(filepath, "rb") as f:
-                    a.update(f.read())
-                    b.update(image.file.read())
-                    image.file.seek(0)
-                return a.hexdigest() == b.hexdigest()
+                return same_file_content(node_helpers.hasher(), filepath, image.file)
             return False
 
         def image_upload(post, image_save_function=None):
@@ -388,7 +424,7 @@ class PromptServer():
         @routes.post("/upload/image")
         async def upload_image(request):
             post = await request.post()
-            return image_upload(post)
+            return await self.preview_manager.run(image_upload, post)
 
 
         @routes.post("/upload/mask")
@@ -435,7 +471,7 @@ class PromptServer():
                         original_pil.putalpha(new_alpha)
                         original_pil.save(filepath, compress_level=4, pnginfo=metadata)
 
-            return image_upload(post, image_save_function)
+            return await self.preview_manager.run(image_upload, post, image_save_function)
 
         @routes.get("/view")
         async def view_image(request):
@@ -467,62 +503,22 @@ class PromptServer():
                 file = os.path.join(output_dir, filename)
 
                 if os.path.isfile(file):
-                    if 'preview' in request.rel_url.query:
-                        with Image.open(file) as img:
-                            preview_info = request.rel_url.query['preview'].split(';')
-                            image_format = preview_info[0]
-                            if image_format not in ['webp', 'jpeg'] or 'a' in request.rel_url.query.get('channel', ''):
-                                image_format = 'webp'
-
-                            quality = 90
-                            if preview_info[-1].isdigit():
-                                quality = int(preview_info[-1])
-
-                            buffer = BytesIO()
-                            if image_format in ['jpeg'] or request.rel_url.query.get('channel', '') == 'rgb':
-                                img = img.convert("RGB")
-                            img.save(buffer, format=image_format, quality=quality)
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type=f'image/{image_format}',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    if 'channel' not in request.rel_url.query:
-                        channel = 'rgba'
-                    else:
-                        channel = request.rel_url.query["channel"]
-
-                    if channel == 'rgb':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                r, g, b, a = img.split()
-                                new_img = Image.merge('RGB', (r, g, b))
-                            else:
-                                new_img = img.convert("RGB")
-
-                            buffer = BytesIO()
-                            new_img.save(buffer, format='PNG')
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    elif channel == 'a':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                _, _, _, a = img.split()
-                            else:
-                                a = Image.new('L', img.size, 255)
-
-                            # alpha img
-                            alpha_img = Image.new('RGBA', img.size)
-                            alpha_img.putalpha(a)
-                            alpha_buffer = BytesIO()
-                            alpha_img.save(alpha_buffer, format='PNG')
-                            alpha_buffer.seek(0)
-
-                            return web.Response(body=alpha_buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
+                    preview = request.rel_url.query.get('preview', None)
+                    channel = request.rel_url.query.get('channel', None)
+                    max_dim = request.rel_url.query.get('max_dim', None)
+                    if max_dim is not None:
+                        if not max_dim.isdigit() or int(max_dim) <= 0:
+                            return web.Response(status=400)
+                        max_dim = int(max_dim)
+                        if preview is None:
+                            preview = 'webp'
+                    if preview is not None or channel in ('rgb', 'a'):
+                        etag = '"{}"'.format(self.preview_manager.etag(file, preview, channel, max_dim))
+                        headers = {"Content-Disposition": f"filename=\"{filename}\"", "ETag": etag, "Cache-Control": "no-cache"}
+                        if request.headers.get("If-None-Match", None) == etag:
+                            return web.Response(status=304, headers=headers)
+                        body, content_type = await self.preview_manager.convert_image_async(file, preview, channel, max_dim)
+                        return web.Response(body=body, content_type=content_type, headers=headers)
                     else:
                         # Get content type from mimetype, defaulting to 'application/octet-stream'
                         content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
@@ -562,7 +558,13 @@ class PromptServer():
             dt = json.loads(out)
             if not "__metadata__" in dt:
                 return web.Response(status=404)
-            return web.json_response(dt["__metadata__"])
+            metadata = dt["__metadata__"]
+            hashes = comfy.model_hash.index.lookup(safetensors_path)
+            if hashes is not None:
+                metadata["comfy.fingerprint"] = hashes["fingerprint"]
+                if hashes["sha256"] is not None:
+                    metadata["comfy.sha256"] = hashes["sha256"]
+            return web.json_response(metadata)
 
         @routes.get("/system_stats")
         async def system_stats(request):
@@ -601,7 +603,11 @@ class PromptServer():
                         "torch_vram_total": torch_vram_total,
                         "torch_vram_free": torch_vram_free,
                     }
-                ]
+                ],
+                "state_dict_cache": comfy.state_dict_cache.cache.get_stats(),
+                "lora_cache": comfy.lora_cache.cache.get_stats(),
+                "merged_weight_cache": comfy.merged_weight_cache.cache.get_stats(),
+                "model_eviction": comfy.model_management.eviction_policy.summary(),
             }
             return web.json_response(system_stats)
 
@@ -670,6 +676,14 @@ class PromptServer():
 
         @routes.get("/history")
         async def get_history(request):
+            # The persistent history waits for its pending writes, keep that off the event loop
+            if "filename" in request.rel_url.query:
+                return web.json_response(await asyncio.to_thread(
+                    self.prompt_queue.get_history_by_output,
+                    request.rel_url.query["filename"],
+                    subfolder=request.rel_url.query.get("subfolder", None),
+                    output_type=request.rel_url.query.get("type", None)))
+
             max_items = request.rel_url.query.get("max_items", None)
             if max_items is not None:
                 max_items = int(max_items)
@@ -680,12 +694,12 @@ class PromptServer():
             else:
                 offset = -1
 
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
+            return web.json_response(await asyncio.to_thread(self.prompt_queue.get_history, max_items=max_items, offset=offset))
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            return web.json_response(await asyncio.to_thread(self.prompt_queue.get_history, prompt_id=prompt_id))
 
         @routes.get("/queue")
         async def get_queue(request):
@@ -694,6 +708,7 @@ class PromptServer():
             remove_sensitive = lambda queue: [x[:5] for x in queue]
             queue_info['queue_running'] = remove_sensitive(current_queue[0])
             queue_info['queue_pending'] = remove_sensitive(current_queue[1])
+            queue_info['queue_stats'] = self.prompt_queue.get_queue_stats()
             return web.json_response(queue_info)
 
         @routes.post("/prompt")
@@ -727,6 +742,16 @@ class PromptServer():
 
                 if "client_id" in json_data:
                     extra_data["client_id"] = json_data["client_id"]
+                if "priority" in json_data:
+                    if json_data["priority"] not in PRIORITY_CLASSES:
+                        error = {
+                            "type": "invalid_priority",
+                            "message": "Invalid priority",
+                            "details": "priority must be one of: {}".format(", ".join(PRIORITY_CLASSES)),
+                            "extra_info": {}
+                        }
+                        return web.json_response({"error": error, "node_errors": {}}, status=400)
+                    extra_data["priority"] = json_data["priority"]
                 if valid[0]:
                     outputs_to_execute = valid[2]
                     sensitive = {}
@@ -772,25 +797,16 @@ class PromptServer():
             # Check if a specific prompt_id was provided for targeted interruption
             prompt_id = json_data.get('prompt_id')
             if prompt_id:
-                currently_running, _ = self.prompt_queue.get_current_queue()
-
-                # Check if the prompt_id matches any currently running prompt
-                should_interrupt = False
-                for item in currently_running:
-                    # item structure: (number, prompt_id, prompt, extra_data, outputs_to_execute)
-                    if item[1] == prompt_id:
-                        logging.info(f"Interrupting prompt {prompt_id}")
-                        should_interrupt = True
-                        break
-
-                if should_interrupt:
-                    nodes.interrupt_processing()
+                # Only the worker running the prompt stops, the other prompt workers keep going
+                if self.prompt_queue.interrupt(prompt_id):
+                    logging.info(f"Interrupting prompt {prompt_id}")
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
                 # No prompt_id provided, do a global interrupt
                 logging.info("Global interrupt (no prompt_id specified)")
-                nodes.interrupt_processing()
+                if not self.prompt_queue.interrupt():
+                    nodes.interrupt_processing()
 
             return web.Response(status=200)
 
@@ -912,7 +928,10 @@ class PromptServer():
         bytesIO = BytesIO()
         header = struct.pack(">I", type_num)
         bytesIO.write(header)
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+        if isinstance(image, bytes):
+            bytesIO.write(image)
+        else:
+            image.save(bytesIO, format=image_type, quality=95, compress_level=1)
         preview_bytes = bytesIO.getvalue()
         await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes, sid=sid)
 
@@ -940,10 +959,13 @@ class PromptServer():
         metadata_json = json.dumps(metadata).encode('utf-8')
         metadata_length = len(metadata_json)
 
-        # Prepare image data
-        bytesIO = BytesIO()
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        image_bytes = bytesIO.getvalue()
+        # Prepare image data, latent previews arrive already encoded
+        if isinstance(image, bytes):
+            image_bytes = image
+        else:
+            bytesIO = BytesIO()
+            image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+            image_bytes = bytesIO.getvalue()
 
         # Combine metadata and image
         combined_data = bytearray()
@@ -955,23 +977,10 @@ class PromptServer():
 
     async def send_bytes(self, event, data, sid=None):
         message = self.encode_bytes(event, data)
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_bytes, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_bytes, message)
+        self.broadcaster.send(OutgoingMessage.binary(event, message), sid)
 
     async def send_json(self, event, data, sid=None):
-        message = {"type": event, "data": data}
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_json, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_json, message)
+        self.broadcaster.send(OutgoingMessage.json(event, data), sid)
 
     def send_sync(self, event, data, sid=None):
         self.loop.call_soon_threadsafe(
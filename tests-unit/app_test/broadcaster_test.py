@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+from app.broadcaster import Broadcaster, OutgoingMessage, SocketSender
+from protocol import BinaryEventTypes
+
+
+class FakeSocket:
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.unblocked = asyncio.Event()
+        if not blocked:
+            self.unblocked.set()
+
+    async def send_str(self, data):
+        await self.unblocked.wait()
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        await self.unblocked.wait()
+        self.sent.append(data)
+
+
+def events(ws):
+    return [x["type"] if isinstance(x, dict) else "bytes" for x in ws.sent]
+
+
+@pytest.mark.asyncio
+async def test_consecutive_status_messages_are_coalesced():
+    broadcaster = Broadcaster(coalesce_window=0.01)
+    ws = FakeSocket()
+    broadcaster.add("a", ws)
+    for i in range(5):
+        broadcaster.send(OutgoingMessage.json("status", {"status": {"queue_remaining": i}}))
+    broadcaster.send(OutgoingMessage.json("progress_state", {"prompt_id": "p1", "nodes": {}}))
+    broadcaster.send(OutgoingMessage.json("progress_state", {"prompt_id": "p2", "nodes": {}}))
+    await asyncio.sleep(0.05)
+    await broadcaster.senders["a"].flush()
+    assert events(ws) == ["status", "progress_state", "progress_state"]
+    assert ws.sent[0]["data"]["status"]["queue_remaining"] == 4
+
+    broadcaster.send(OutgoingMessage.json("status", {"status": {"queue_remaining": 0}}))
+    broadcaster.send(OutgoingMessage.json("executing", {"node": None}))
+    await broadcaster.senders["a"].flush()
+    assert events(ws)[3:] == ["status", "executing"]
+
+
+@pytest.mark.asyncio
+async def test_slow_socket_drops_old_previews():
+    slow = FakeSocket(blocked=True)
+    fast = FakeSocket()
+    broadcaster = Broadcaster(coalesce_window=0, max_droppable=2)
+    broadcaster.add("slow", slow)
+    broadcaster.add("fast", fast)
+    for i in range(5):
+        broadcaster.send(OutgoingMessage.binary(BinaryEventTypes.PREVIEW_IMAGE, bytes([i])))
+        broadcaster.send(OutgoingMessage.json("executed", {"node": str(i)}))
+        await asyncio.sleep(0)
+    await broadcaster.senders["fast"].flush()
+    assert len(fast.sent) == 10
+
+    slow.unblocked.set()
+    await broadcaster.senders["slow"].flush()
+    # The first preview was already being sent when the socket stalled
+    assert [x for x in slow.sent if isinstance(x, bytes)] == [bytes([0]), bytes([3]), bytes([4])]
+    assert len([x for x in slow.sent if isinstance(x, dict)]) == 5
+    assert broadcaster.senders["slow"].dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_remove_stops_sender():
+    broadcaster = Broadcaster(coalesce_window=0)
+    broadcaster.add("a", FakeSocket())
+    sender = broadcaster.senders["a"]
+    broadcaster.remove("a")
+    await asyncio.sleep(0)
+    assert sender.task.cancelled() or sender.task.done()
+    broadcaster.send(OutgoingMessage.json("executing", {"node": None}), "a")
+    assert isinstance(sender, SocketSender)
+
+
+@pytest.mark.asyncio
+async def test_coalesced_message_keeps_order():
+    ws = FakeSocket(blocked=True)
+    broadcaster = Broadcaster(coalesce_window=0)
+    broadcaster.add("a", ws)
+    broadcaster.send(OutgoingMessage.json("executed", {"node": "1"}))
+    await asyncio.sleep(0)
+    broadcaster.send(OutgoingMessage.json("status", {"status": {"queue_remaining": 1}}))
+    broadcaster.send(OutgoingMessage.json("executing", {"node": "2"}))
+    broadcaster.send(OutgoingMessage.json("status", {"status": {"queue_remaining": 0}}))
+    ws.unblocked.set()
+    await broadcaster.senders["a"].flush()
+    # The newer status is not sent ahead of the executing queued before it
+    assert events(ws) == ["executed", "executing", "status"]
+    assert ws.sent[2]["data"]["status"]["queue_remaining"] == 0
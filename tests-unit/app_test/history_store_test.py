@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import patch
+
+from app.database import db
+from app.database.history import HistoryStore
+
+
+@pytest.fixture
+def history_store(tmp_path):
+    database_url = f"sqlite:///{tmp_path / 'comfyui.db'}"
+    with patch.object(db.args, "database_url", database_url), patch.object(db, "Session", None):
+        db.init_db()
+        yield HistoryStore(max_items=5, batch_size=2)
+
+
+def make_entry(number, prompt_id, filename=None):
+    outputs = {}
+    if filename is not None:
+        outputs["9"] = {"images": [{"filename": filename, "subfolder": "", "type": "output"}]}
+    return {
+        "prompt": [number, prompt_id, {}, {}, []],
+        "outputs": outputs,
+        "status": {"status_str": "success", "completed": True, "messages": []},
+        "meta": {},
+    }
+
+
+def test_get_returns_written_entry(history_store):
+    history_store.add("a", make_entry(0, "a"), completed_at=1.0)
+    assert history_store.get("a") == make_entry(0, "a")
+    assert history_store.get("missing") is None
+
+
+def test_paging_matches_in_memory_order(history_store):
+    for i in range(4):
+        history_store.add(f"p{i}", make_entry(i, f"p{i}"), completed_at=float(i))
+
+    assert list(history_store.get_page()) == ["p0", "p1", "p2", "p3"]
+    assert list(history_store.get_page(max_items=2)) == ["p2", "p3"]
+    assert list(history_store.get_page(max_items=2, offset=1)) == ["p1", "p2"]
+    assert list(history_store.get_page(offset=3)) == ["p3"]
+
+
+def test_delete_and_wipe(history_store):
+    for i in range(3):
+        history_store.add(f"p{i}", make_entry(i, f"p{i}"), completed_at=float(i))
+    history_store.delete("p1")
+    assert list(history_store.get_page()) == ["p0", "p2"]
+
+    history_store.wipe()
+    assert history_store.get_page() == {}
+
+
+def test_find_by_output(history_store):
+    history_store.add("a", make_entry(0, "a", "ComfyUI_00001_.png"), completed_at=1.0)
+    history_store.add("b", make_entry(1, "b", "ComfyUI_00002_.png"), completed_at=2.0)
+
+    assert list(history_store.find_by_output("ComfyUI_00002_.png")) == ["b"]
+    assert history_store.find_by_output("ComfyUI_00002_.png", output_type="temp") == {}
+
+
+def test_prune_keeps_latest(history_store):
+    for i in range(12):
+        history_store.add(f"p{i}", make_entry(i, f"p{i}", f"{i}.png"), completed_at=float(i))
+
+    history = history_store.get_page()
+    assert len(history) <= 6
+    assert list(history)[-1] == "p11"
+    assert history_store.find_by_output("0.png") == {}
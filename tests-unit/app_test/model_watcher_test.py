@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import pytest
+
+import folder_paths
+from app.model_watcher import ModelIndexWatcher
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watcher_updates_index(tmp_path, use_inotify):
+    if use_inotify and not sys.platform.startswith("linux"):
+        pytest.skip("inotify is only available on Linux")
+    models = tmp_path / "models"
+    models.mkdir()
+    (models / "a.safetensors").touch()
+    index = folder_paths.ModelIndex()
+    interval = 60.0 if use_inotify else 0.05
+    watcher = ModelIndexWatcher(index, interval)
+    if not use_inotify:
+        watcher.inotify = None
+    elif watcher.inotify is None:
+        pytest.skip("inotify not available")
+    watcher.folder_paths = lambda: [str(models)]
+    watcher.start()
+    assert wait_for(lambda: index.watched)
+    root = index.get_root(str(models))
+    assert root.get_files() == ["a.safetensors"]
+
+    (models / "sub").mkdir()
+    (models / "sub" / "b.safetensors").touch()
+    assert wait_for(lambda: os.path.join("sub", "b.safetensors") in root.get_files())
+    (models / ".b.safetensors.part").touch()
+    (models / "a.safetensors").unlink()
+    assert wait_for(lambda: "a.safetensors" not in root.get_files())
+    # Hidden files (partial downloads) are not indexed
+    assert ".b.safetensors.part" not in root.get_files()
+
+
+def test_only_unwatched_folders_are_polled(tmp_path):
+    index = folder_paths.ModelIndex()
+    watcher = ModelIndexWatcher(index, 60.0)
+    if watcher.inotify is None:
+        pytest.skip("inotify not available")
+    watched = tmp_path / "watched"
+    unwatched = tmp_path / "unwatched"
+    watched.mkdir()
+    unwatched.mkdir()
+    watch = watcher.inotify.watch
+    watcher.inotify.watch = lambda path: False if path.startswith(str(unwatched)) else watch(path)
+    watcher.folder_paths = lambda: [str(watched), str(unwatched)]
+    watcher.poll()
+    assert watcher.polled_roots == {str(unwatched)}
+
+    refreshed = []
+    for root in index.get_roots():
+        root.refresh = lambda directory=root.directory: refreshed.append(directory)
+    watcher.poll(full=False)
+    assert refreshed == [str(unwatched)]
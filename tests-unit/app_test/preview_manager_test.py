@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app.preview_manager import PreviewManager, same_file_content
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / "image.png"
+    Image.new("RGBA", (32, 16), (255, 0, 0, 128)).save(path)
+    return str(path)
+
+
+def test_same_file_content(image_file):
+    with open(image_file, "rb") as f:
+        data = f.read()
+    upload = io.BytesIO(data)
+    assert same_file_content(hashlib.sha256, image_file, upload)
+    assert upload.tell() == 0
+    assert not same_file_content(hashlib.sha256, image_file, io.BytesIO(data[:-1] + b"\0"))
+    assert not same_file_content(hashlib.sha256, image_file, io.BytesIO(data + b"\0"))
+
+
+def test_conversions(image_file):
+    manager = PreviewManager(max_workers=1)
+    body, content_type = manager.convert_image(image_file, "jpeg;50")
+    assert content_type == "image/jpeg"
+    assert Image.open(io.BytesIO(body)).mode == "RGB"
+
+    body, content_type = manager.convert_image(image_file, None, "a")
+    assert content_type == "image/png"
+    assert Image.open(io.BytesIO(body)).getchannel("A").getextrema() == (128, 128)
+
+    assert manager.convert_image(image_file) is None
+
+
+def test_cache_is_keyed_by_file_version(image_file):
+    manager = PreviewManager(max_workers=1)
+    first = manager.convert_image(image_file, "webp;80")
+    assert manager.convert_image(image_file, "webp;80") is first
+
+    Image.new("RGBA", (64, 64), (0, 255, 0, 255)).save(image_file)
+    os.utime(image_file, ns=(0, os.stat(image_file).st_mtime_ns + 1))
+    second = manager.convert_image(image_file, "webp;80")
+    assert second is not first
+    assert Image.open(io.BytesIO(second[0])).size == (64, 64)
+
+
+def test_cache_size_limit(image_file):
+    manager = PreviewManager(max_workers=1, cache_size=1)
+    manager.convert_image(image_file, "webp;80")
+    assert manager.cache_used == 0
+
+
+def test_thumbnails(image_file):
+    manager = PreviewManager(max_workers=1)
+    body, content_type = manager.convert_image(image_file, "webp", None, 8)
+    assert content_type == "image/webp"
+    assert Image.open(io.BytesIO(body)).size == (8, 4)
+    assert manager.etag(image_file, "webp", None, 8) != manager.etag(image_file, "webp", None, None)
+
+
+def test_disk_cache(image_file, tmp_path):
+    directory = str(tmp_path / "previews")
+    manager = PreviewManager(max_workers=1, directory=directory, disk_size=1024 ** 2)
+    first = manager.convert_image(image_file, "jpeg;80")
+    assert len(os.listdir(directory)) == 1
+
+    restarted = PreviewManager(max_workers=1, directory=directory, disk_size=1024 ** 2)
+    assert restarted.get_cached(manager.etag(image_file, "jpeg;80", None, None)) == first
+
+    limited = PreviewManager(max_workers=1, directory=directory, disk_size=len(first[0]) + 1)
+    limited.convert_image(image_file, "webp;80")
+    assert limited.store.size <= len(first[0]) + 1
+    assert len(os.listdir(directory)) == 1
+
+
+def test_warm_outputs(image_file, monkeypatch):
+    import folder_paths
+    monkeypatch.setattr(folder_paths, "get_directory_by_type", lambda type_name: os.path.dirname(image_file))
+    manager = PreviewManager(max_workers=1)
+    manager.recent_params[("webp;50", None, 16)] = None
+    manager.warm_outputs({"9": {"images": [{"filename": os.path.basename(image_file), "subfolder": "", "type": "output"}]}})
+    manager.executor.shutdown(wait=True)
+    assert manager.get_cached(manager.etag(image_file, "webp;50", None, 16)) is not None
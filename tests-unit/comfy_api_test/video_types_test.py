@@ -6,6 +6,7 @@ import av
 import io
 from fractions import Fraction
 from comfy_api.input_impl.video_types import VideoFromFile, VideoFromComponents
+from comfy_api.latest._input_impl.video_types import VideoFromFrameStream
 from comfy_api.util.video_types import VideoComponents
 from comfy_api.input.basic_types import AudioInput
 from av.error import InvalidDataError
@@ -237,3 +238,35 @@ def test_duration_consistency(video_components):
     manual_duration = float(components.images.shape[0] / components.frame_rate)
 
     assert duration == pytest.approx(manual_duration)
+
+
+def test_video_from_frame_stream_saves_every_chunk():
+    """Chunks are encoded as they are produced and the saved video has all their frames"""
+    produced = []
+
+    def frames():
+        for i in range(3):
+            produced.append(i)
+            yield torch.full((4, 8, 8, 3), i / 3.0)
+
+    video = VideoFromFrameStream(frames, width=8, height=8, frame_rate=Fraction(24), frame_count=12)
+    assert video.get_dimensions() == (8, 8)
+    assert video.get_duration() == pytest.approx(0.5)
+    assert produced == []
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp:
+        tmp_name = tmp.name
+    try:
+        video.save_to(tmp_name)
+        assert produced == [0, 1, 2]
+        assert VideoFromFile(tmp_name).get_components().images.shape[0] == 12
+    finally:
+        os.unlink(tmp_name)
+
+
+def test_video_from_frame_stream_components():
+    """get_components concatenates the chunks"""
+    video = VideoFromFrameStream(lambda: (torch.rand(2, 4, 6, 3) for _ in range(2)), width=6, height=4, frame_rate=Fraction(30))
+    components = video.get_components()
+    assert components.images.shape == (4, 4, 6, 3)
+    assert video.get_duration() == pytest.approx(4 / 30)
@@ -116,6 +116,56 @@ def test_get_save_image_path(temp_dir):
         assert filename_prefix == "test"
 
 
+def test_get_save_image_path_counter(temp_dir):
+    for name in ["test_00007_.png", "test_00003_.png", "other_00050_.png", "test_notanumber_.png"]:
+        open(os.path.join(temp_dir, name), "wb").close()
+    counter = folder_paths.get_save_image_path("test", temp_dir, batch_size=2)[2]
+    assert counter == 8
+    assert folder_paths.get_save_image_path("test", temp_dir)[2] == 10
+
+    # Files written by someone else are found without listing the folder again,
+    # even when the folder mtime didn't change
+    mtime = os.stat(temp_dir).st_mtime_ns
+    open(os.path.join(temp_dir, "test_00011_.png"), "wb").close()
+    open(os.path.join(temp_dir, "test_00012_.png"), "wb").close()
+    os.utime(temp_dir, ns=(0, mtime))
+    with patch("folder_paths.os.listdir", side_effect=AssertionError):
+        assert folder_paths.get_save_image_path("test", temp_dir)[2] == 13
+
+    assert folder_paths.get_save_image_path("sub/test", temp_dir)[2] == 1
+    assert os.path.isdir(os.path.join(temp_dir, "sub"))
+
+
+def test_get_save_image_path_reserves_files(temp_dir):
+    counter = folder_paths.get_save_image_path("img_%batch_num%", temp_dir, batch_size=2, suffix="_.png")[2]
+    assert counter == 1
+    assert os.path.exists(os.path.join(temp_dir, "img_0_00001_.png"))
+    assert os.path.exists(os.path.join(temp_dir, "img_1_00002_.png"))
+
+    # A file the index doesn't know about is never handed out again
+    open(os.path.join(temp_dir, "img_0_00003_.webp"), "wb").close()
+    counter = folder_paths.get_save_image_path("img_%batch_num%", temp_dir, suffix="_.webp")[2]
+    assert counter == 4
+    assert os.path.exists(os.path.join(temp_dir, "img_0_00004_.webp"))
+
+
+def test_failed_save_releases_reserved_files(temp_dir):
+    full_output_folder, filename, counter, _, _ = folder_paths.get_save_image_path("fail", temp_dir, batch_size=2, suffix="_.png")
+    with pytest.raises(RuntimeError):
+        with folder_paths.save_path_reservation(full_output_folder, filename, counter, 2, "_.png"):
+            with open(os.path.join(full_output_folder, f"{filename}_{counter:05}_.png"), "wb") as f:
+                f.write(b"written")
+            raise RuntimeError("encode failed")
+    # The file that was written is kept, the empty placeholder is removed
+    assert os.listdir(temp_dir) == ["fail_00001_.png"]
+
+    # A successful save keeps its files
+    full_output_folder, filename, counter, _, _ = folder_paths.get_save_image_path("ok", temp_dir, suffix="_.png")
+    with folder_paths.save_path_reservation(full_output_folder, filename, counter, 1, "_.png"):
+        pass
+    assert os.path.exists(os.path.join(temp_dir, "ok_00001_.png"))
+
+
 def test_base_path_changes(set_base_dir):
     test_dir = os.path.abspath("/test/dir")
     set_base_dir(test_dir)
@@ -160,3 +210,43 @@ def test_base_path_change_clears_old(set_base_dir):
 
     for name in ["controlnet", "diffusion_models", "text_encoders"]:
         assert len(folder_paths.get_folder_paths(name)) == 2
+
+
+def test_model_index_incremental_updates(temp_dir):
+    os.makedirs(os.path.join(temp_dir, "sub", "deep"))
+    for name in ["a.safetensors", os.path.join("sub", "b.safetensors"), os.path.join("sub", "deep", "c.ckpt")]:
+        open(os.path.join(temp_dir, name), "wb").close()
+    index = folder_paths.ModelIndex()
+    root = index.get_root(temp_dir)
+    assert sorted(root.get_files()) == sorted(["a.safetensors", os.path.join("sub", "b.safetensors"), os.path.join("sub", "deep", "c.ckpt")])
+
+    version = root.version
+    assert index.get_root(temp_dir) is root and root.version == version
+
+    import shutil
+    shutil.rmtree(os.path.join(temp_dir, "sub", "deep"))
+    os.makedirs(os.path.join(temp_dir, "new"))
+    open(os.path.join(temp_dir, "new", "d.safetensors"), "wb").close()
+    for d in [temp_dir, os.path.join(temp_dir, "sub")]:
+        os.utime(d, ns=(0, os.stat(d).st_mtime_ns + 1000))
+    with patch("folder_paths.recursive_search", wraps=folder_paths.recursive_search) as search:
+        index.get_root(temp_dir)
+        # Only the added directory is searched
+        assert [c.args[0] for c in search.call_args_list] == [os.path.join(temp_dir, "new")]
+    assert sorted(root.get_files()) == sorted(["a.safetensors", os.path.join("sub", "b.safetensors"), os.path.join("new", "d.safetensors")])
+    assert root.version > version
+
+    index.watched = True
+    open(os.path.join(temp_dir, "e.safetensors"), "wb").close()
+    assert "e.safetensors" not in index.get_root(temp_dir).get_files()
+    index.directory_changed(temp_dir)
+    assert "e.safetensors" in root.get_files()
+
+
+def test_get_filename_list_follows_index(temp_dir):
+    open(os.path.join(temp_dir, "a.safetensors"), "wb").close()
+    with patch.dict(folder_paths.folder_names_and_paths, {"test_index": ([temp_dir], {".safetensors"})}):
+        assert folder_paths.get_filename_list("test_index") == ["a.safetensors"]
+        open(os.path.join(temp_dir, "b.safetensors"), "wb").close()
+        os.utime(temp_dir, ns=(0, os.stat(temp_dir).st_mtime_ns + 1000))
+        assert folder_paths.get_filename_list("test_index") == ["a.safetensors", "b.safetensors"]
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+import comfy.model_management as mm
+
+
+def run_in_thread(function):
+    result = {}
+    def target():
+        try:
+            function()
+            result["interrupted"] = False
+        except mm.InterruptProcessingException:
+            result["interrupted"] = True
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    return result["interrupted"]
+
+
+def test_thread_interrupt_only_stops_that_thread():
+    mm.interrupt_current_processing(True, thread_id=threading.get_ident())
+    try:
+        assert mm.processing_interrupted()
+        assert not run_in_thread(mm.throw_exception_if_processing_interrupted)
+        with pytest.raises(mm.InterruptProcessingException):
+            mm.throw_exception_if_processing_interrupted()
+        assert not mm.processing_interrupted()
+    finally:
+        mm.interrupt_current_processing(False)
+
+
+def test_global_interrupt():
+    mm.interrupt_current_processing(True)
+    try:
+        assert run_in_thread(mm.throw_exception_if_processing_interrupted)
+        assert not mm.processing_interrupted()
+    finally:
+        mm.interrupt_current_processing(False)
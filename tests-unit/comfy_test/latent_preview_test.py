@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import torch
+from PIL import Image
+
+import latent_preview
+from comfy.cli_args import LatentPreviewMethod
+
+
+class FakeLatentFormat:
+    taesd_decoder_name = None
+    latent_channels = 4
+    latent_rgb_factors = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, 0.0]]
+    latent_rgb_factors_bias = None
+
+
+class BlockingPreviewer:
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.decoded = []
+
+    def decode_latent_to_preview_image(self, preview_format, x0):
+        self.started.set()
+        self.release.wait(5)
+        self.decoded.append(int(x0.item()))
+        return (preview_format, Image.new("RGB", (16, 16)), None)
+
+
+def test_previewer_is_cached(monkeypatch):
+    monkeypatch.setattr(latent_preview.args, "preview_method", LatentPreviewMethod.Latent2RGB)
+    monkeypatch.setattr(latent_preview, "previewers", OrderedDict())
+    previewer = latent_preview.get_previewer("cpu", FakeLatentFormat())
+    assert isinstance(previewer, latent_preview.Latent2RGBPreviewer)
+    assert latent_preview.get_previewer("cpu", FakeLatentFormat()) is previewer
+
+    # Only the last used previewers are kept
+    class OtherLatentFormat(FakeLatentFormat):
+        pass
+    class ThirdLatentFormat(FakeLatentFormat):
+        pass
+    latent_preview.get_previewer("cpu", OtherLatentFormat())
+    latent_preview.get_previewer("cpu", ThirdLatentFormat())
+    assert len(latent_preview.previewers) == latent_preview.MAX_PREVIEWERS
+    assert latent_preview.get_previewer("cpu", FakeLatentFormat()) is not previewer
+
+    latent_preview.unload_previewers()
+    assert len(latent_preview.previewers) == 0
+
+    monkeypatch.setattr(latent_preview.args, "preview_method", LatentPreviewMethod.NoPreviews)
+    assert latent_preview.get_previewer("cpu", FakeLatentFormat()) is None
+
+
+def test_pipeline_only_keeps_the_latest_latent():
+    previewer = BlockingPreviewer()
+    pipeline = latent_preview.PreviewPipeline(previewer, "JPEG")
+    pipeline.submit(torch.tensor(0))
+    assert previewer.started.wait(5)
+    for i in range(1, 4):
+        pipeline.submit(torch.tensor(i))
+    previewer.release.set()
+
+    pipeline.wait()
+    assert previewer.decoded == [0, 3]
+
+    image_type, image, max_size = pipeline.take()
+    assert image_type == "JPEG" and max_size is None
+    assert image[:2] == b"\xff\xd8"
+    assert pipeline.take() is None
@@ -0,0 +1,52 @@
+import os
+
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+from comfy.lora_cache import LoraCache
+
+
+def save_lora(path, rank=4):
+    sd = {
+        "lora_unet_a.lora_up.weight": torch.randn(8, rank),
+        "lora_unet_a.lora_down.weight": torch.randn(rank, 8),
+        "lora_unet_a.alpha": torch.tensor(float(rank)),
+    }
+    safetensors.torch.save_file(sd, str(path))
+    return str(path)
+
+
+KEY_MAP = {"lora_unet_a": "a.weight"}
+
+
+def test_patches_are_cached_per_file_and_key_map(tmp_path):
+    cache = LoraCache(1024 ** 2)
+    path = save_lora(tmp_path / "style.safetensors")
+    patches = cache.load_patches(path, KEY_MAP)
+    assert list(patches.keys()) == ["a.weight"]
+    assert cache.load_patches(path, dict(KEY_MAP)) is patches
+    assert cache.hits == 1 and cache.misses == 1
+
+    other = cache.load_patches(path, {"lora_unet_a": "b.weight"})
+    assert list(other.keys()) == ["b.weight"]
+    assert cache.misses == 2
+
+    save_lora(path, rank=2)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1000))
+    assert cache.load_patches(path, KEY_MAP) is not patches
+    assert cache.get_stats()["misses"] == 3
+
+
+def test_budget(tmp_path):
+    paths = [save_lora(tmp_path / "{}.safetensors".format(i)) for i in range(3)]
+    lora_size = sum(v.nbytes for v in safetensors.torch.load_file(paths[0]).values())
+    cache = LoraCache(lora_size * 2)
+    for path in paths:
+        cache.load_patches(path, KEY_MAP)
+    assert len(cache.entries) == 2 and cache.size <= lora_size * 2
+    cache.load_patches(paths[2], KEY_MAP)
+    assert cache.hits == 1
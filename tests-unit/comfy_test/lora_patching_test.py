@@ -0,0 +1,70 @@
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+import comfy.model_patcher
+from comfy.weight_adapter import LoRAAdapter
+
+
+def lora(out_dim, in_dim, rank, alpha=None):
+    return LoRAAdapter(set(), (torch.randn(out_dim, rank), torch.randn(rank, in_dim), alpha, None, None, None))
+
+
+def make_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Linear(16, 16),
+        torch.nn.Linear(16, 16),
+        torch.nn.Linear(16, 32),
+        torch.nn.Conv2d(8, 4, 3),
+    )
+
+
+def make_patches():
+    torch.manual_seed(1)
+    return [
+        {"0.weight": lora(16, 16, 4, 2.0), "1.weight": lora(16, 16, 4), "2.weight": lora(32, 16, 8, 4.0), "3.weight": lora(4, 72, 2)},
+        {"0.weight": lora(16, 16, 4), "1.weight": ("diff", (torch.randn(16, 16),)), "2.weight": lora(32, 16, 2)},
+    ]
+
+
+def patched_weights(monkeypatch, batched):
+    monkeypatch.setattr(args, "disable_batched_lora_patching", not batched)
+    patcher = comfy.model_patcher.ModelPatcher(make_model(), torch.device("cpu"), torch.device("cpu"))
+    patcher.add_patches(make_patches()[0], 0.8)
+    patcher.add_patches(make_patches()[1], 0.5)
+    patcher.patch_model(torch.device("cpu"))
+    assert patcher.model.weight_patch_time > 0
+    weights = {k: v.detach().clone() for k, v in patcher.model.state_dict().items()}
+    patcher.unpatch_model(torch.device("cpu"))
+    assert patcher.model.weight_patch_time == 0
+    return weights
+
+
+def test_batched_patching_matches_per_key(monkeypatch):
+    batched = patched_weights(monkeypatch, True)
+    per_key = patched_weights(monkeypatch, False)
+    original = make_model().state_dict()
+    for k in original:
+        torch.testing.assert_close(batched[k], per_key[k], rtol=1e-4, atol=1e-4)
+        if k.endswith("weight"):
+            assert not torch.equal(batched[k], original[k])
+
+
+def test_calculate_weights_batched_groups_same_shapes(monkeypatch):
+    calls = []
+    bmm = torch.bmm
+    monkeypatch.setattr(torch, "bmm", lambda *a, **kw: calls.append(a[0].shape) or bmm(*a, **kw))
+    patches = {"{}.weight".format(i): [(1.0, lora(16, 16, 4), 1.0, None, None)] for i in range(6)}
+    patches["odd.weight"] = [(1.0, lora(32, 16, 4), 1.0, None, None)]
+    weights = {k: (v, torch.zeros(v[0][1].weights[0].shape[0], 16)) for k, v in patches.items()}
+    assert all(comfy.lora.lora_patches_batchable(v) for v in patches.values())
+    out = comfy.lora.calculate_weights_batched(weights)
+    assert sorted(calls) == [(1, 32, 4), (6, 16, 4)]
+    for k, v in patches.items():
+        up, down = v[0][1].weights[:2]
+        torch.testing.assert_close(out[k], up @ down, rtol=1e-5, atol=1e-5)
+    assert not comfy.lora.lora_patches_batchable([(1.0, ("diff", (torch.zeros(1),)), 1.0, None, None)])
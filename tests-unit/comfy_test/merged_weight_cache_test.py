@@ -0,0 +1,132 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+import comfy.merged_weight_cache
+import comfy.model_patcher
+from comfy.merged_weight_cache import MergedWeightCache
+from comfy.weight_adapter import LoRAAdapter
+
+
+def make_patcher():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(16, 16), torch.nn.Linear(16, 8))
+    model.weight_source = "base"
+    return comfy.model_patcher.ModelPatcher(model, torch.device("cpu"), torch.device("cpu"))
+
+
+def make_lora(seed):
+    torch.manual_seed(seed)
+    return {
+        "0.weight": LoRAAdapter(set(), (torch.randn(16, 4), torch.randn(4, 16), 2.0, None, None, None)),
+        "1.weight": LoRAAdapter(set(), (torch.randn(8, 4), torch.randn(4, 16), None, None, None, None)),
+    }
+
+
+def load_weights(patcher):
+    patcher.patch_model(torch.device("cpu"))
+    weights = {k: v.detach().clone() for k, v in patcher.model.state_dict().items()}
+    patcher.unpatch_model(torch.device("cpu"))
+    return weights
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    cache = MergedWeightCache(1024 ** 2, str(tmp_path), 1024 ** 2)
+    monkeypatch.setattr(comfy.merged_weight_cache, "cache", cache)
+    return cache
+
+
+def test_reload_copies_merged_weights(cache, monkeypatch):
+    patcher = make_patcher()
+    patcher.add_patches(make_lora(1), 0.7)
+    patcher.add_patches(make_lora(2), 0.3)
+    first = load_weights(patcher)
+    assert cache.misses == 1 and len(cache.entries) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("patches merged again")
+    monkeypatch.setattr(comfy.lora, "calculate_weights_batched", fail)
+    monkeypatch.setattr(comfy.lora, "calculate_weight", fail)
+    for k, v in load_weights(patcher).items():
+        assert torch.equal(v, first[k])
+    assert cache.hits == 1
+
+    # Same LoRA files loaded again and applied to another instance of the same base model
+    other = make_patcher()
+    other.add_patches(make_lora(1), 0.7)
+    other.add_patches(make_lora(2), 0.3)
+    assert cache.weights_key(other) == cache.weights_key(patcher)
+    for k, v in load_weights(other).items():
+        assert torch.equal(v, first[k])
+    assert torch.equal(other.model.state_dict()["0.weight"], make_patcher().model.state_dict()["0.weight"])
+
+
+def test_key_depends_on_order_strength_and_source(cache):
+    def key(strengths, source="base"):
+        patcher = make_patcher()
+        patcher.model.weight_source = source
+        for seed, strength in strengths:
+            patcher.add_patches(make_lora(seed), strength)
+        return cache.weights_key(patcher)
+
+    base = key([(1, 0.7), (2, 0.3)])
+    assert base == key([(1, 0.7), (2, 0.3)])
+    assert base != key([(2, 0.3), (1, 0.7)])
+    assert base != key([(1, 0.7), (2, 0.4)])
+    assert base != key([(1, 0.7), (2, 0.3)], source="other")
+    assert key([(1, 0.7)], source=None) is None
+
+    patcher = make_patcher()
+    patcher.add_patches({"0.weight": ("diff", (torch.zeros(16, 16),))})
+    assert cache.weights_key(patcher) is None
+
+
+def test_disk_store(cache, tmp_path):
+    patcher = make_patcher()
+    patcher.add_patches(make_lora(1), 0.5)
+    first = load_weights(patcher)
+    cache.writer.shutdown(wait=True)
+    assert len(list(tmp_path.glob("*.safetensors"))) == 1
+
+    restarted = MergedWeightCache(0, str(tmp_path), 1024 ** 2)
+    merged = restarted.get(restarted.weights_key(patcher))
+    assert merged is not None and restarted.hits == 1
+    for k, v in merged.items():
+        assert torch.equal(v, first[k])
+
+    restarted.disk_size = 1
+    restarted.evict_disk(restarted.disk_size)
+    assert list(tmp_path.glob("*.safetensors")) == []
+
+
+def test_unreadable_disk_entry_is_removed(cache, tmp_path):
+    patcher = make_patcher()
+    patcher.add_patches(make_lora(1), 0.5)
+    load_weights(patcher)
+    cache.writer.shutdown(wait=True)
+    path = next(tmp_path.glob("*.safetensors"))
+    path.write_bytes(b"corrupt")
+
+    restarted = MergedWeightCache(0, str(tmp_path), 1024 ** 2)
+    assert restarted.get(restarted.weights_key(patcher)) is None
+    assert restarted.hits == 0 and restarted.misses == 1
+    assert not path.exists() and restarted.disk_used == 0
+
+
+def test_weights_over_budget_are_not_collected(cache, monkeypatch):
+    cache.max_size = 1
+    cache.directory = None
+    patcher = make_patcher()
+    patcher.add_patches(make_lora(1), 0.5)
+    assert not cache.fits(patcher.patched_weights_size())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("merged weights collected")
+    monkeypatch.setattr(cache, "put", fail)
+    load_weights(patcher)
+    assert len(cache.entries) == 0
@@ -0,0 +1,93 @@
+import itertools
+
+import pytest
+import torch
+
+import comfy.model_eviction
+from comfy.model_eviction import create_policy
+
+GB = 1024 ** 3
+
+
+class FakePatcher:
+    def __init__(self, module):
+        self.model = module
+
+
+class FakeLoadedModel:
+    def __init__(self, name, size):
+        self.module = type(name, (torch.nn.Module,), {})()
+        self.model = FakePatcher(self.module)
+        self.size = size
+        self.loaded = size
+
+    def model_memory(self):
+        return self.size
+
+    def model_loaded_memory(self):
+        return self.loaded
+
+    def model_offloaded_memory(self):
+        return self.size - self.loaded
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    counter = itertools.count()
+    monkeypatch.setattr(comfy.model_eviction.time, "monotonic", lambda: float(next(counter)))
+
+
+def eviction_order(policy, models):
+    return [m.module.__class__.__name__ for m in sorted(models, key=policy.sort_key)]
+
+
+def test_lru_and_lfu():
+    a, b, c = FakeLoadedModel("A", GB), FakeLoadedModel("B", GB), FakeLoadedModel("C", GB)
+    lru = create_policy("lru")
+    lfu = create_policy("lfu")
+    for policy in (lru, lfu):
+        for m in (a, a, a, b, c, c):
+            policy.record_use(m)
+    assert eviction_order(lru, [a, b, c]) == ["A", "B", "C"]
+    assert eviction_order(lfu, [a, b, c]) == ["B", "C", "A"]
+
+
+def test_greedy_dual_size_keeps_expensive_models():
+    t5 = FakeLoadedModel("T5", 10 * GB)
+    controlnet = FakeLoadedModel("ControlNet", GB)
+    policy = create_policy("greedy-dual-size")
+    policy.record_use(t5)
+    policy.record_load(t5, 10.0, t5.size)
+    policy.record_use(controlnet)
+    policy.record_load(controlnet, 0.25, controlnet.size)
+    # The T5 was used before the controlnet but it costs 4 times more per byte to bring back
+    assert eviction_order(policy, [t5, controlnet]) == ["ControlNet", "T5"]
+    assert eviction_order(create_policy("lru"), [t5, controlnet]) == ["T5", "ControlNet"]
+
+    # Partial loads are scaled to the whole model
+    policy.record_load(t5, 5.0, t5.size // 2)
+    assert policy.model_stats(t5).reload_time == pytest.approx(10.0)
+
+    # Models that aren't used again age out as the others get evicted and come back
+    for _ in range(5):
+        policy.record_unload(controlnet, "cuda:0", GB, GB, True)
+        policy.record_use(controlnet)
+        policy.record_load(controlnet, 0.25, controlnet.size)
+    assert policy.inflation > 0
+    assert eviction_order(policy, [t5, controlnet]) == ["T5", "ControlNet"]
+
+
+def test_decision_log():
+    policy = create_policy("default")
+    m = FakeLoadedModel("Model", 2 * GB)
+    m.loaded = GB
+    policy.record_use(m)
+    policy.record_unload(m, "cuda:0", 3 * GB, GB, False)
+    summary = policy.summary()
+    assert summary["policy"] == "default"
+    assert summary["models"][0]["model"] == "Model" and summary["models"][0]["uses"] == 1
+    decision = summary["decisions"][0]
+    assert decision["model"] == "Model" and decision["freed"] == GB and not decision["unloaded"]
+    # The default policy unloads the most offloaded models first
+    other = FakeLoadedModel("Other", GB)
+    assert eviction_order(policy, [other, m]) == ["Model", "Other"]
@@ -0,0 +1,92 @@
+import gc
+import hashlib
+import os
+
+import pytest
+
+from comfy.model_hash import HashIndex, ModelHasher, SharedModels
+import comfy.model_hash
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def big_data(monkeypatch):
+    monkeypatch.setattr(comfy.model_hash, "SAMPLE_SIZE", 16)
+    monkeypatch.setattr(comfy.model_hash, "HASH_CHUNK", 1000)
+    return bytes(range(256)) * 40
+
+
+def test_fingerprint_and_full_hash(tmp_path, big_data):
+    index = HashIndex(str(tmp_path / "cache" / "model_hashes.json"))
+    a = write(tmp_path / "a.safetensors", big_data)
+    # Differs from a between the sampled blocks only
+    b = write(tmp_path / "b.safetensors", big_data[:5000] + b"x" + big_data[5001:])
+    assert index.fingerprint(a) == index.fingerprint(b)
+    assert index.sha256(a) is None
+    assert index.identity(a)[0] == "file"
+
+    assert index.compute_sha256(a) == hashlib.sha256(big_data).hexdigest()
+    assert index.compute_sha256(b) != index.sha256(a)
+    assert index.identity(a) == ("sha256", hashlib.sha256(big_data).hexdigest())
+    index.save()
+
+    reloaded = HashIndex(index.path)
+    assert reloaded.sha256(a) == index.sha256(a)
+    # A new version of the file isn't matched with the old hash
+    os.utime(a, ns=(0, os.stat(a).st_mtime_ns + 1000))
+    assert reloaded.sha256(a) is None and reloaded.lookup(a) is None
+
+
+def test_hasher_order(tmp_path, big_data, monkeypatch):
+    index = HashIndex()
+    files = [write(tmp_path / "{}.safetensors".format(name), data) for name, data in (("unique", b"unique"), ("copy1", big_data), ("copy2", big_data), ("loaded", b"loaded"))]
+    monkeypatch.setattr(comfy.model_hash, "model_files", lambda: files[:3])
+    index.request(files[3])
+    hasher = ModelHasher(index)
+    assert hasher.pending() == [files[3], files[1], files[2], files[0]]
+    # pending() consumed the request
+    index.request(files[3])
+    hasher.hash_all()
+    assert all(index.sha256(path) is not None for path in files)
+    assert index.sha256(files[1]) == index.sha256(files[2])
+
+
+class Model:
+    pass
+
+
+def test_shared_models(tmp_path, big_data):
+    index = HashIndex()
+    shared = SharedModels(index)
+    a = write(tmp_path / "a.safetensors", big_data)
+    b = write(tmp_path / "b.safetensors", big_data)
+    c = write(tmp_path / "c.safetensors", big_data[:-1] + b"x")
+
+    model = Model()
+    shared.add("checkpoint", [a], "options", [model, None])
+    assert shared.get("checkpoint", [a], "options") == [model, None]
+    assert shared.get("checkpoint", [a], "other options") is None
+    assert shared.get("diffusion_model", [a], "options") is None
+    # Copies are only shared once their content is known to be the same
+    assert shared.get("checkpoint", [b], "options") is None
+    for path in (a, b, c):
+        index.compute_sha256(path)
+    assert shared.get("checkpoint", [b], "options") == [model, None]
+    assert shared.get("checkpoint", [c], "options") is None
+
+    # Overwriting the file in place makes the loaded model stale
+    write(tmp_path / "a.safetensors", big_data[:-1] + b"y")
+    os.utime(a, ns=(0, 0))
+    assert shared.get("checkpoint", [a], "options") is None
+    assert shared.entries == []
+
+    shared.add("checkpoint", [b], "options", [model, None])
+    del model
+    gc.collect()
+    assert shared.get("checkpoint", [a], "options") is None
+    assert shared.entries == []
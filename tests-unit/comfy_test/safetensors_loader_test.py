@@ -0,0 +1,83 @@
+import struct
+
+import pytest
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.utils
+from comfy.safetensors_loader import load_mmap, load_parallel
+
+
+@pytest.fixture
+def state_dict():
+    return {
+        "weight": torch.randn(33, 17),
+        "bf16": torch.randn(1000).to(torch.bfloat16),
+        "fp8": torch.randn(64).to(torch.float8_e4m3fn),
+        "mask": torch.rand(10) > 0.5,
+        "scalar": torch.tensor(3, dtype=torch.int64),
+        "empty": torch.zeros(0, 4),
+    }
+
+
+@pytest.fixture
+def safetensors_file(tmp_path, state_dict):
+    path = str(tmp_path / "model.safetensors")
+    safetensors.torch.save_file(state_dict, path, metadata={"format": "pt"})
+    return path
+
+
+def assert_same(sd, expected):
+    assert sd.keys() == expected.keys()
+    for k in expected:
+        assert sd[k].dtype == expected[k].dtype and sd[k].shape == expected[k].shape
+        assert torch.equal(sd[k].view(torch.uint8) if sd[k].dtype == torch.float8_e4m3fn else sd[k],
+                           expected[k].view(torch.uint8) if expected[k].dtype == torch.float8_e4m3fn else expected[k])
+
+
+def test_mmap(safetensors_file, state_dict):
+    sd, metadata = load_mmap(safetensors_file)
+    assert_same(sd, state_dict)
+    assert metadata == {"format": "pt"}
+    # Writes stay private to the process
+    sd["weight"].zero_()
+    assert_same(load_mmap(safetensors_file)[0], state_dict)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_parallel_chunks(safetensors_file, state_dict, threads):
+    sd, metadata = load_parallel(safetensors_file, threads=threads, chunk_size=100)
+    assert_same(sd, state_dict)
+    assert metadata == {"format": "pt"}
+
+
+def test_parallel_non_cuda_device(safetensors_file, state_dict):
+    # Devices other than CUDA don't go through the pinned staging buffers and streams
+    sd, metadata = load_parallel(safetensors_file, device=torch.device("meta"), threads=4, chunk_size=100)
+    assert sd.keys() == state_dict.keys()
+    assert all(v.device.type == "meta" and v.shape == state_dict[k].shape for k, v in sd.items())
+
+
+@pytest.mark.parametrize("loader", ["mmap", "parallel"])
+def test_load_torch_file(safetensors_file, state_dict, loader, monkeypatch):
+    monkeypatch.setattr(comfy.utils, "SAFETENSORS_LOADER", loader)
+    sd, metadata = comfy.utils.load_torch_file(safetensors_file, return_metadata=True)
+    assert_same(sd, state_dict)
+
+    with open(safetensors_file, "r+b") as f:
+        f.write(struct.pack("<Q", 1 << 40))
+    with pytest.raises(ValueError, match="corrupt or invalid"):
+        comfy.utils.load_torch_file(safetensors_file)
+
+
+def test_truncated_file(safetensors_file):
+    with open(safetensors_file, "rb") as f:
+        data_start = 8 + struct.unpack("<Q", f.read(8))[0]
+    with open(safetensors_file, "r+b") as f:
+        f.truncate(data_start + 100)
+    with pytest.raises(ValueError, match="MetadataIncompleteBuffer"):
+        load_parallel(safetensors_file)
@@ -0,0 +1,33 @@
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_hash
+import comfy.model_management
+import comfy.model_patcher
+import comfy.sd
+from comfy.model_hash import HashIndex, SharedModels
+
+
+def test_diffusion_model_is_shared_per_device(tmp_path, monkeypatch):
+    path = str(tmp_path / "unet.safetensors")
+    safetensors.torch.save_file({"weight": torch.zeros(4, 4)}, path)
+    monkeypatch.setattr(comfy.model_hash, "shared_models", SharedModels(HashIndex()))
+
+    def load_state_dict(sd, model_options={}, metadata=None):
+        return comfy.model_patcher.ModelPatcher(torch.nn.Linear(4, 4), torch.device("cpu"), torch.device("cpu"))
+    monkeypatch.setattr(comfy.sd, "load_diffusion_model_state_dict", load_state_dict)
+
+    device = torch.device("cuda", 0)
+    monkeypatch.setattr(comfy.model_management, "get_torch_device", lambda: device)
+    first = comfy.sd.load_diffusion_model(path)
+    assert comfy.sd.load_diffusion_model(path).model is first.model
+
+    # Another prompt worker on another device gets its own instance
+    device = torch.device("cuda", 1)
+    second = comfy.sd.load_diffusion_model(path)
+    assert second.model is not first.model
+    assert comfy.sd.load_diffusion_model(path).model is second.model
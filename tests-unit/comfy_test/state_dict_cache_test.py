@@ -0,0 +1,79 @@
+import gc
+import os
+
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+from comfy.state_dict_cache import StateDictCache
+
+
+def save(path, value, size=256):
+    safetensors.torch.save_file({"w": torch.full((size,), value)}, str(path))
+    return str(path)
+
+
+def test_hits_and_file_changes(tmp_path):
+    cache = StateDictCache(1024 ** 2)
+    path = save(tmp_path / "a.safetensors", 1.0)
+    sd = cache.load(path)
+    sd.pop("w")
+    sd, metadata = cache.load(path, return_metadata=True)
+    assert "w" in sd and cache.hits == 1 and cache.misses == 1
+
+    save(path, 2.0)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1000))
+    assert torch.all(cache.load(path)["w"] == 2.0)
+    assert cache.misses == 2
+    assert cache.get_stats()["hit_rate"] == 1 / 3
+    # The per file locks don't outlive the loads
+    assert len(cache.key_locks) == 0
+
+
+def test_budget_keeps_entries_used_by_live_models(tmp_path):
+    entry_size = 256 * 4
+    cache = StateDictCache(entry_size * 2)
+    a, b, c = (save(tmp_path / "{}.safetensors".format(name), 1.0) for name in "abc")
+    model = torch.nn.Linear(1, 1)
+    cache.load(a)
+    cache.add_users(a, model)
+    cache.load(b)
+    cache.load(c)
+    # b is the oldest entry nothing uses
+    assert [key[0] for key in cache.entries] == [os.path.realpath(a), os.path.realpath(c)]
+    assert cache.get_stats()["live_users"] == 1
+
+    del model
+    gc.collect()
+    cache.load(b)
+    assert [key[0] for key in cache.entries] == [os.path.realpath(c), os.path.realpath(b)]
+
+
+def test_disabled(tmp_path):
+    cache = StateDictCache(0)
+    path = save(tmp_path / "a.safetensors", 1.0)
+    cache.load(path)
+    cache.load(path)
+    assert len(cache.entries) == 0 and cache.misses == 0
+
+
+def test_prefetch_pins_until_evicted(tmp_path, monkeypatch):
+    import comfy.model_management
+    pinned = set()
+    monkeypatch.setattr(comfy.model_management, "pin_memory", lambda t: pinned.add(t.data_ptr()) is None)
+    monkeypatch.setattr(comfy.model_management, "unpin_memory", lambda t: pinned.discard(t.data_ptr()))
+
+    size = 256 * 4
+    cache = StateDictCache(size + 512)
+    a = save(tmp_path / "a.safetensors", 1.0)
+    assert cache.prefetch(a, pin=True)
+    assert len(pinned) == 1 and cache.get_stats()["pinned"] == size
+    cache.load(a)
+    assert cache.hits == 1 and cache.misses == 0
+
+    assert not cache.prefetch(save(tmp_path / "big.safetensors", 1.0, size=512))
+    assert cache.prefetch(save(tmp_path / "b.safetensors", 2.0))
+    assert list(pinned) == [] and len(cache.entries) == 1
@@ -0,0 +1,144 @@
+import hashlib
+import os
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_patcher
+import comfy.sd
+import comfy.text_encoder_cache
+from comfy.text_encoder_cache import TextEncoderCache
+
+
+class CountingTextEncoder(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.linear = torch.nn.Linear(4, 8)
+        self.dtypes = set([torch.float32])
+        self.calls = 0
+        self.options = {}
+
+    def reset_clip_options(self):
+        self.options = {}
+
+    def set_clip_options(self, options):
+        self.options.update(options)
+
+    def encode_token_weights(self, tokens):
+        self.calls += 1
+        x = torch.tensor([[float(t) for t, w in tokens["l"][0]]])
+        cond = self.linear(x)
+        return cond, cond[:, :2]
+
+    def load_sd(self, sd):
+        return self.load_state_dict(sd, strict=False)
+
+
+def make_clip(weight=1.0):
+    clip = comfy.sd.CLIP(no_init=True)
+    clip.cond_stage_model = CountingTextEncoder()
+    clip.patcher = comfy.model_patcher.ModelPatcher(clip.cond_stage_model, load_device=torch.device("cpu"), offload_device=torch.device("cpu"))
+    clip.tokenizer = None
+    clip.tokenizer_options = {}
+    clip.layer_idx = None
+    clip.use_clip_schedule = False
+    clip.apply_hooks_to_conds = None
+    sd = {"linear.weight": torch.full((8, 4), weight), "linear.bias": torch.zeros(8)}
+    clip.load_sd(sd)
+    clip.weights_digest = hashlib.sha256(str(weight).encode()).digest()
+    return clip
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(comfy.text_encoder_cache, "cache", TextEncoderCache(1024 ** 2))
+
+
+def tokens(*ids):
+    return {"l": [[(i, 1.0) for i in ids]]}
+
+
+def test_same_weights_share_entries():
+    a, b = make_clip(), make_clip()
+    cond_a = a.encode_from_tokens(tokens(1, 2, 3, 4))
+    cond_b = b.encode_from_tokens(tokens(1, 2, 3, 4))
+    assert torch.equal(cond_a, cond_b)
+    assert a.cond_stage_model.calls == 1 and b.cond_stage_model.calls == 0
+
+    b.encode_from_tokens(tokens(1, 2, 3, 5))
+    make_clip(weight=2.0).encode_from_tokens(tokens(1, 2, 3, 4))
+    assert comfy.text_encoder_cache.cache.misses == 3
+
+
+def test_options_and_patches_are_part_of_the_key():
+    clip = make_clip()
+    clip.encode_from_tokens(tokens(1, 2, 3, 4))
+    clip.encode_from_tokens(tokens(1, 2, 3, 4), return_pooled="unprojected")
+    clip.clip_layer(-2)
+    clip.encode_from_tokens(tokens(1, 2, 3, 4))
+    assert clip.cond_stage_model.calls == 3
+
+    patched = clip.clone()
+    patched.add_patches({"linear.bias": (torch.ones(8),)})
+    patched.encode_from_tokens(tokens(1, 2, 3, 4))
+    assert clip.cond_stage_model.calls == 4
+    patched.clone().encode_from_tokens(tokens(1, 2, 3, 4))
+    assert clip.cond_stage_model.calls == 4
+
+
+def test_byte_budget_and_disk(tmp_path):
+    cond = torch.zeros(1, 256)
+    cache = TextEncoderCache(cond.nbytes * 2)
+    cache.set_disk_directory(str(tmp_path), 1024 ** 2)
+    for i in range(3):
+        cache.put(bytes([i]) * 32, {"cond": cond + i, "pooled_output": None})
+    assert len(cache.entries) == 2 and cache.size <= cond.nbytes * 2
+    # The files are written in the background
+    cache.flush()
+    assert len(cache.disk_index) == 3 and len(cache.pending) == 0
+    assert cache.disk_size == sum(os.path.getsize(p) for p in tmp_path.glob("*.safetensors"))
+
+    restarted = TextEncoderCache(cond.nbytes * 2)
+    restarted.set_disk_directory(str(tmp_path), 1024 ** 2)
+    entry = restarted.get(bytes([0]) * 32)
+    assert torch.equal(entry["cond"], cond) and entry["pooled_output"] is None
+
+
+def test_weights_without_a_file_bypass_the_cache():
+    clip = make_clip()
+    clip.load_sd({"linear.bias": torch.ones(8)})
+    clip.encode_from_tokens(tokens(1, 2, 3, 4))
+    clip.encode_from_tokens(tokens(1, 2, 3, 4))
+    assert clip.cond_stage_model.calls == 2
+
+
+def test_files_digest(tmp_path):
+    path = str(tmp_path / "te.safetensors")
+    with open(path, "wb") as f:
+        f.write(b"a" * 1024)
+    digest = comfy.text_encoder_cache.files_digest([path], "options")
+    assert digest == comfy.text_encoder_cache.files_digest([path], "options")
+    assert digest != comfy.text_encoder_cache.files_digest([path], "other options")
+
+    # Overwriting the file in place changes the identity
+    with open(path, "wb") as f:
+        f.write(b"b" * 1024)
+    os.utime(path, ns=(0, 0))
+    assert digest != comfy.text_encoder_cache.files_digest([path], "options")
+    assert comfy.text_encoder_cache.files_digest([str(tmp_path / "missing")], "options") is None
+
+
+def test_large_patches_are_fully_hashed():
+    a = torch.zeros(5 * 1024 * 1024)
+    b = a.clone()
+    b[len(b) // 2 + 1] = 1.0
+    digests = []
+    for weight in (a, b):
+        hasher = hashlib.sha256()
+        comfy.text_encoder_cache.update_hash(hasher, weight)
+        digests.append(hasher.digest())
+    assert digests[0] != digests[1]
@@ -0,0 +1,106 @@
+import itertools
+
+import pytest
+import torch
+
+import comfy.utils
+
+
+def reference_tiled_scale(samples, function, tile, overlap, upscale_amount, out_channels):
+    """The one tile per call implementation the batched one must match."""
+    dims = len(tile)
+    out = torch.zeros([samples.shape[0], out_channels] + [s * upscale_amount for s in samples.shape[2:]])
+    out_div = torch.zeros_like(out)
+    positions = [range(0, samples.shape[d + 2] - overlap, tile[d] - overlap) if samples.shape[d + 2] > tile[d] else [0] for d in range(dims)]
+    for it in itertools.product(*positions):
+        s_in = samples
+        upscaled = []
+        for d in range(dims):
+            pos = max(0, min(samples.shape[d + 2] - overlap, it[d]))
+            s_in = s_in.narrow(d + 2, pos, min(tile[d], samples.shape[d + 2] - pos))
+            upscaled.append(pos * upscale_amount)
+        ps = function(s_in)
+        mask = torch.ones_like(ps)
+        feather = overlap * upscale_amount
+        for d in range(2, dims + 2):
+            if feather >= mask.shape[d]:
+                continue
+            for t in range(feather):
+                a = (t + 1) / feather
+                mask.narrow(d, t, 1).mul_(a)
+                mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
+        o = out
+        o_d = out_div
+        for d in range(dims):
+            o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+            o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+        o.add_(ps * mask)
+        o_d.add_(mask)
+    return out / out_div
+
+
+class Upscaler:
+    def __init__(self, channels, upscale_amount, dims):
+        self.weight = torch.randn(channels, 3)
+        self.upscale_amount = upscale_amount
+        self.dims = dims
+        self.batches = []
+
+    def __call__(self, x):
+        self.batches.append(x.shape[0])
+        # Depends on the position in the tile so the feathering matters
+        x = torch.einsum("oc,bc...->bo...", self.weight, x) + x.mean(dim=1, keepdim=True).cumsum(-1)
+        for d in range(self.dims):
+            x = x.repeat_interleave(self.upscale_amount, dim=d + 2)
+        return x
+
+
+class Pbar:
+    def __init__(self):
+        self.current = 0
+
+    def update(self, value):
+        self.current += value
+
+
+@pytest.mark.parametrize("shape, tile, overlap", [
+    ((2, 3, 37, 53), (16, 16), 4),
+    ((1, 3, 20, 9), (8, 32), 2),
+    ((1, 3, 6, 19, 14), (4, 8, 8), 2),
+])
+@pytest.mark.parametrize("max_tile_batch", [1, 4, 64])
+def test_matches_reference(shape, tile, overlap, max_tile_batch):
+    torch.manual_seed(0)
+    samples = torch.randn(shape)
+    function = Upscaler(4, 2, len(tile))
+    pbar = Pbar()
+    out = comfy.utils.tiled_scale_multidim(samples, function, tile=tile, overlap=overlap, upscale_amount=2, out_channels=4, pbar=pbar, max_tile_batch=max_tile_batch)
+    assert max(function.batches) <= max_tile_batch
+    expected = torch.cat([reference_tiled_scale(samples[b:b + 1], function, tile, overlap, 2, 4) for b in range(shape[0])])
+    assert torch.allclose(out, expected, atol=1e-5)
+    if len(tile) == 2:
+        assert pbar.current == shape[0] * comfy.utils.get_tiled_scale_steps(shape[3], shape[2], tile[1], tile[0], overlap)
+
+
+def test_feather_mask_cached():
+    mask = comfy.utils.feather_mask((8, 6), (3, 3), torch.device("cpu"))
+    assert mask.shape == (1, 1, 8, 6)
+    assert mask is comfy.utils.feather_mask((8, 6), (3, 3), torch.device("cpu"))
+    ramp = comfy.utils.feather_ramp(8, 3)
+    assert torch.allclose(ramp, torch.tensor([1 / 3, 2 / 3, 1, 1, 1, 1, 2 / 3, 1 / 3]))
+    assert torch.allclose(mask[0, 0], ramp[:, None] * comfy.utils.feather_ramp(6, 3)[None, :])
+
+
+def test_oom_halves_the_batch(monkeypatch):
+    monkeypatch.setattr(comfy.utils, "OOM_EXCEPTION", MemoryError)
+    upscaler = Upscaler(3, 1, 2)
+
+    def function(x):
+        if x.shape[0] > 2:
+            raise MemoryError()
+        return upscaler(x)
+
+    samples = torch.randn(1, 3, 40, 40)
+    out = comfy.utils.tiled_scale(samples, function, tile_x=16, tile_y=16, overlap=4, upscale_amount=1, max_tile_batch=8)
+    assert max(upscaler.batches) == 2
+    assert torch.allclose(out, reference_tiled_scale(samples, upscaler, (16, 16), 4, 1, 3), atol=1e-5)
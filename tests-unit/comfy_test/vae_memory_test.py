@@ -0,0 +1,42 @@
+from comfy.vae_memory import MEMORY_MARGIN, MemoryProfile, tile_size_3d
+
+
+def test_estimate_uses_measurements(tmp_path):
+    profile = MemoryProfile(str(tmp_path / "cache" / "vae_memory_profile.json"))
+    assert profile.estimate("vae|decode", 1000) == 1000
+
+    profile.record("vae|decode", 400)
+    assert profile.estimate("vae|decode", 1000) == 400 * MEMORY_MARGIN
+
+    # Small changes aren't written
+    profile.record("vae|decode", 401)
+    assert profile.get("vae|decode")["peak"] == 400
+
+    reloaded = MemoryProfile(profile.path)
+    assert reloaded.estimate("vae|decode", 1000) == 400 * MEMORY_MARGIN
+
+
+def test_out_of_memory_bound():
+    profile = MemoryProfile()
+    profile.record_oom("vae|decode", 2000)
+    assert profile.estimate("vae|decode", 1000) == 2000
+    profile.record_oom("vae|decode", 1500)
+    assert profile.estimate("vae|decode", 1000) == 2000
+
+    # A measurement lower than the bound wins
+    profile.record("vae|decode", 1000)
+    assert profile.estimate("vae|decode", 5000) == 1000 * MEMORY_MARGIN
+
+    # Running out of memory with more than the measured peak available makes the measurement stale
+    profile.record_oom("vae|decode", 3000)
+    assert profile.get("vae|decode").get("peak", None) is None
+    assert profile.estimate("vae|decode", 1000) == 3000
+
+
+def test_tile_size_3d():
+    # Everything fits
+    assert tile_size_3d(1, 16 * 31 * 96 * 96, 16, 31, 68, 96, 8) == (96, 31)
+    # The spatial size is reduced first
+    assert tile_size_3d(1, 16 * 31 * 48 * 48, 16, 31, 68, 96, 8) == (48, 31)
+    # Then the number of frames
+    assert tile_size_3d(1, 16 * 8 * 8 * 8, 16, 31, 68, 96, 8) == (8, 8)
@@ -0,0 +1,103 @@
+import torch
+
+import comfy.model_management
+from comfy_execution import batch_fusion
+from comfy_execution.batch_fusion import FusionGroup, concat_conditioning, fusion_plan
+
+
+def make_prompt(seed=1, text="a cat", sampler_name="euler", prefix="out"):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["1", 1], "text": text}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["1", 1], "text": "blurry"}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "5": {"class_type": "KSampler", "inputs": {"model": ["1", 0], "seed": seed, "steps": 20, "cfg": 7.0, "sampler_name": sampler_name,
+                                                 "scheduler": "normal", "positive": ["2", 0], "negative": ["3", 0], "latent_image": ["4", 0], "denoise": 1.0}},
+        "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+        "7": {"class_type": "SaveImage", "inputs": {"images": ["6", 0], "filename_prefix": prefix}},
+    }
+
+
+def make_item(number, prompt, client_id="script"):
+    return (number, "prompt-{}".format(number), prompt, {"client_id": client_id}, ["7"], {})
+
+
+def test_seed_and_output_differences_are_fused():
+    plan = fusion_plan(make_prompt(seed=1), make_prompt(seed=2, prefix="other"))
+    assert list(plan) == ["5"]
+    assert plan["5"].seed == 2
+    assert plan["5"].texts == {}
+
+
+def test_text_differences_are_fused():
+    plan = fusion_plan(make_prompt(), make_prompt(text="a dog"))
+    assert plan["5"].texts == {"positive": "a dog"}
+
+
+def test_identical_and_incompatible_prompts_are_not_fused():
+    assert fusion_plan(make_prompt(), make_prompt()) == {}
+    assert fusion_plan(make_prompt(sampler_name="euler_ancestral"), make_prompt(seed=2, sampler_name="euler_ancestral")) == {}
+
+    other_steps = make_prompt(seed=2)
+    other_steps["5"]["inputs"]["steps"] = 30
+    assert fusion_plan(make_prompt(), other_steps) == {}
+
+    other_model = make_prompt(seed=2)
+    other_model["1"]["inputs"]["ckpt_name"] = "other.safetensors"
+    assert fusion_plan(make_prompt(), other_model) == {}
+
+
+def test_group_only_takes_the_same_client():
+    group = FusionGroup(make_item(0, make_prompt(seed=1)), 3)
+    try:
+        assert group.add(make_item(1, make_prompt(seed=2)))
+        assert not group.add(make_item(2, make_prompt(seed=3), client_id="user"))
+        assert not group.add(make_item(3, make_prompt(seed=1)))
+        assert group.add(make_item(4, make_prompt(seed=4)))
+        assert not group.add(make_item(5, make_prompt(seed=5)))
+        assert [prompt_id for prompt_id, _ in group.members["5"]] == ["prompt-1", "prompt-4"]
+    finally:
+        group.close()
+
+
+def test_concat_conditioning():
+    a = [[torch.zeros(1, 77, 8), {"pooled_output": torch.zeros(1, 8)}]]
+    b = [[torch.ones(1, 77, 8), {"pooled_output": torch.ones(1, 8)}]]
+    assert concat_conditioning([a, a], 2) is a
+
+    out = concat_conditioning([a, b], 2)
+    assert out[0][0].shape == (4, 77, 8)
+    assert out[0][1]["pooled_output"].shape == (4, 8)
+    assert out[0][0][:2].sum() == 0 and out[0][0][2:].min() == 1
+
+    longer = [[torch.ones(1, 154, 8), {"pooled_output": torch.ones(1, 8)}]]
+    assert concat_conditioning([a, longer], 1) is None
+
+
+def test_out_of_memory_samples_separately(monkeypatch):
+    batches = []
+    def ksampler_batched(seeds, **kwargs):
+        batches.append(seeds)
+        raise comfy.model_management.OOM_EXCEPTION("out of memory")
+    monkeypatch.setattr(batch_fusion, "ksampler_batched", ksampler_batched)
+    monkeypatch.setattr(batch_fusion, "out_of_memory", {})
+
+    cond = [[torch.zeros(1, 77, 8), {}]]
+    inputs = {"model": None, "seed": 1, "steps": 20, "cfg": 7.0, "sampler_name": "euler", "scheduler": "normal",
+              "positive": cond, "negative": cond, "latent_image": {"samples": torch.zeros(1, 4, 8, 8)}, "denoise": 1.0}
+    input_data_all = {k: [v] for k, v in inputs.items()}
+
+    # prompt-2 was deleted from the queue
+    group = FusionGroup(make_item(0, make_prompt(seed=1)), 4, is_queued=lambda prompt_id: prompt_id != "prompt-2")
+    try:
+        for i in range(1, 4):
+            assert group.add(make_item(i, make_prompt(seed=i + 1)))
+        assert group.output("prompt-0", "5", input_data_all, None) is None
+        assert batches == [[1, 2, 4]]
+        assert group.results == {}
+
+        # The next batches stay below the size that ran out of memory
+        assert group.output("prompt-0", "5", input_data_all, None) is None
+        assert batches == [[1, 2, 4], [1, 2]]
+    finally:
+        group.close()
@@ -0,0 +1,71 @@
+import os
+from typing import NamedTuple
+
+import pytest
+import torch
+from unittest.mock import MagicMock, patch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.caching import DiskSpillStore, get_spill_store
+
+
+class Entry(NamedTuple):
+    ui: dict
+    outputs: list
+
+
+def make_store(directory, max_size=1024 ** 2):
+    return DiskSpillStore(str(directory), max_size, Entry)
+
+
+def test_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    image = torch.rand(1, 8, 8, 3)
+    entry = Entry(ui={"images": [{"filename": "a.png"}]}, outputs=[[image], [{"samples": image[:, :4]}], [1.5, "text", None, (2, True)]])
+    store.put(b"\x01" * 32, entry)
+    # Entries are readable while they are being written
+    assert store.get(b"\x01" * 32).ui == entry.ui
+    store.flush()
+
+    loaded = make_store(tmp_path).get(b"\x01" * 32)
+    assert loaded.ui == entry.ui
+    assert torch.equal(loaded.outputs[0][0], image)
+    assert torch.equal(loaded.outputs[1][0]["samples"], image[:, :4])
+    assert loaded.outputs[2] == [1.5, "text", None, (2, True)]
+
+
+def test_unspillable_entries_are_skipped(tmp_path):
+    store = make_store(tmp_path)
+    store.put(b"\x01" * 32, Entry(ui={}, outputs=[[object()]]))
+    store.put("not a digest", Entry(ui={}, outputs=[[1]]))
+    store.flush()
+    assert store.get(b"\x01" * 32) is None
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("reload", [False, True])
+def test_least_recently_used_is_evicted(tmp_path, reload):
+    tensor_size = 64 * 1024
+    # Room for three entries including their headers, but not four
+    max_size = tensor_size * 3 + 4096
+    store = make_store(tmp_path, max_size=max_size)
+    keys = [bytes([i]) * 32 for i in range(3)]
+    for key in keys:
+        store.put(key, Entry(ui={}, outputs=[[torch.zeros(tensor_size // 4)]]))
+    store.flush()
+    if reload:
+        store = make_store(tmp_path, max_size=max_size)
+    assert store.get(keys[0]) is not None
+
+    store.put(b"\x09" * 32, Entry(ui={}, outputs=[[torch.zeros(tensor_size // 4)]]))
+    store.flush()
+    assert store.get(keys[0]) is not None
+    assert store.get(keys[1]) is None
+    assert store.total_size <= max_size
+
+
+def test_store_is_shared_per_directory(tmp_path):
+    store = get_spill_store(str(tmp_path / "a"), 1024 ** 2, Entry)
+    assert get_spill_store(str(tmp_path / "a"), 1024 ** 2, Entry) is store
+    assert get_spill_store(str(tmp_path / "b"), 1024 ** 2, Entry) is not store
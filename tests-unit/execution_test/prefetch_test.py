@@ -0,0 +1,61 @@
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.state_dict_cache
+import comfy_execution.prefetch as prefetch
+from comfy.state_dict_cache import StateDictCache
+
+
+class FakeQueue:
+    def __init__(self, items):
+        self.items = items
+
+    def upcoming(self, limit):
+        return self.items[:limit]
+
+
+def make_item(number, prompt):
+    return (number, "prompt-{}".format(number), prompt, {}, [], {})
+
+
+def test_prefetch_next_prompts(tmp_path, monkeypatch):
+    files = {}
+    for folder, name in (("checkpoints", "model.safetensors"), ("text_encoders", "t5.safetensors"), ("loras", "style.safetensors"), ("checkpoints", "later.safetensors")):
+        path = str(tmp_path / name)
+        safetensors.torch.save_file({"w": torch.randn(64, 64)}, path)
+        files[(folder, name)] = path
+    monkeypatch.setattr(prefetch.folder_paths, "get_full_path", lambda folder, name: files.get((folder, name), None))
+    cache = StateDictCache(1024 ** 2)
+    monkeypatch.setattr(comfy.state_dict_cache, "cache", cache)
+    read = []
+    monkeypatch.setattr(prefetch, "readahead", read.append)
+
+    queue = FakeQueue([
+        make_item(1, {
+            "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+            "2": {"class_type": "CLIPLoader", "inputs": {"clip_name": "t5.safetensors", "type": "sd3"}},
+            "3": {"class_type": "LoraLoader", "inputs": {"lora_name": "style.safetensors", "model": ["1", 0]}},
+            "4": {"class_type": "VAELoader", "inputs": {"vae_name": "missing.safetensors"}},
+        }),
+        make_item(2, {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "later.safetensors"}}}),
+    ])
+    prefetcher = prefetch.ModelPrefetcher(queue, 1)
+    assert prefetcher.prefetch() == [files[("checkpoints", "model.safetensors")], files[("text_encoders", "t5.safetensors")], files[("loras", "style.safetensors")]]
+    assert read == [files[("loras", "style.safetensors")]]
+    assert len(cache.entries) == 2
+    assert prefetcher.prefetch() == []
+
+    # The loader nodes get the prefetched state dicts from the cache
+    comfy.state_dict_cache.load_torch_file(files[("checkpoints", "model.safetensors")])
+    comfy.state_dict_cache.load_torch_file(files[("text_encoders", "t5.safetensors")], safe_load=True)
+    assert cache.hits == 2 and cache.misses == 0
+
+    # Files that don't fit in the cache are read into the page cache
+    cache.max_size = 1
+    prefetcher.depth = 2
+    assert prefetcher.prefetch() == [files[("checkpoints", "later.safetensors")]]
+    assert read[-1] == files[("checkpoints", "later.safetensors")]
@@ -0,0 +1,103 @@
+from comfy_execution.scheduler import FairShareScheduler, QueueStats
+
+
+def make_item(number, client_id, priority=None):
+    extra_data = {"client_id": client_id}
+    if priority is not None:
+        extra_data["priority"] = priority
+    return (number, "{}-{}".format(client_id, number), {}, extra_data, [], {})
+
+
+def drain(scheduler):
+    out = []
+    while len(scheduler) > 0:
+        out.append(scheduler.pop()[1])
+    return out
+
+
+def test_clients_are_served_round_robin():
+    scheduler = FairShareScheduler()
+    for i in range(4):
+        scheduler.put(make_item(i, "batch-script"))
+    scheduler.put(make_item(4, "user"))
+    scheduler.put(make_item(5, "user"))
+    assert drain(scheduler) == ["batch-script-0", "user-4", "batch-script-1", "user-5", "batch-script-2", "batch-script-3"]
+
+
+def test_client_weights():
+    scheduler = FairShareScheduler({"a": 2.0})
+    for i in range(4):
+        scheduler.put(make_item(i, "a"))
+        scheduler.put(make_item(10 + i, "b"))
+    assert drain(scheduler)[:6] == ["a-0", "b-10", "a-1", "a-2", "b-11", "a-3"]
+
+
+def test_priority_classes_and_front():
+    scheduler = FairShareScheduler()
+    scheduler.put(make_item(0, "script", "batch"))
+    scheduler.put(make_item(1, "script", "batch"))
+    scheduler.put(make_item(2, "user"))
+    scheduler.put(make_item(-3, "script", "batch"))
+    scheduler.put(make_item(4, "user", "unknown"))
+    assert drain(scheduler) == ["user-2", "user-4", "script--3", "script-0", "script-1"]
+
+
+def test_idle_client_does_not_bank_credit():
+    scheduler = FairShareScheduler()
+    for i in range(3):
+        scheduler.put(make_item(i, "a"))
+    assert scheduler.pop()[1] == "a-0"
+    assert scheduler.pop()[1] == "a-1"
+    for i in range(3):
+        scheduler.put(make_item(10 + i, "b"))
+    assert drain(scheduler) == ["a-2", "b-10", "b-11", "b-12"]
+
+
+def test_remove_and_stats():
+    scheduler = FairShareScheduler()
+    stats = QueueStats()
+    items = [make_item(0, "a"), make_item(1, "a", "batch"), make_item(2, "b")]
+    for item in items:
+        scheduler.put(item)
+        stats.queued(item)
+    assert scheduler.remove(lambda x: x[1] == "a-0")
+    assert [x[1] for x in scheduler.items()] == ["a-1", "b-2"]
+
+    item = scheduler.pop()
+    stats.started(item)
+    stats.done(item)
+    out = stats.get(scheduler.pending_counts(), {})
+    assert out["interactive"]["completed"] == 1
+    assert out["batch"]["pending"] == 1
+
+
+def make_loader_item(number, ckpt_name):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}}}
+    return (number, "{}-{}".format(ckpt_name, number), prompt, {"client_id": "a"}, [], {})
+
+
+def test_model_affinity_groups_prompts():
+    scheduler = FairShareScheduler(affinity_window=4)
+    for i, ckpt_name in enumerate(["flux", "ltx", "flux", "ltx", "flux"]):
+        scheduler.put(make_loader_item(i, ckpt_name))
+    assert drain(scheduler) == ["flux-0", "flux-2", "flux-4", "ltx-1", "ltx-3"]
+
+
+def test_model_affinity_starvation_guard():
+    scheduler = FairShareScheduler(affinity_window=2)
+    scheduler.put(make_loader_item(0, "flux"))
+    scheduler.put(make_loader_item(1, "ltx"))
+    for i in range(2, 8):
+        scheduler.put(make_loader_item(i, "flux"))
+    order = drain(scheduler)
+    assert order.index("ltx-1") <= 3
+
+
+def test_upcoming_follows_run_order():
+    scheduler = FairShareScheduler()
+    scheduler.put(make_item(0, "script", "batch"))
+    for i in range(1, 4):
+        scheduler.put(make_item(i, "a"))
+    scheduler.put(make_item(4, "b"))
+    assert [item[1] for item in scheduler.upcoming(4)] == ["a-1", "b-4", "a-2", "a-3"]
+    assert [item[1] for item in scheduler.upcoming(10)] == drain(scheduler)
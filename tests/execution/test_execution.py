@@ -74,6 +74,10 @@ class ComfyClient:
         req =  urllib.request.Request("http://{}/prompt".format(self.server_address), data=data)
         return json.loads(urllib.request.urlopen(req).read())
 
+    def get_queue(self):
+        with urllib.request.urlopen("http://{}/queue".format(self.server_address)) as response:
+            return json.loads(response.read())
+
     def get_image(self, filename, subfolder, folder_type):
         data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
         url_values = urllib.parse.urlencode(data)
@@ -157,14 +161,17 @@ class TestExecution:
         { "extra_args" : ["--cache-lru", 100], "should_cache_results" : True },
         { "extra_args" : ["--cache-none"], "should_cache_results" : False },
     ])
-    def server(self, args_pytest, request):
+    def server(self, args_pytest, request, tmp_path_factory):
         # Start server
+        # History is persisted in the database, give every server a fresh one
+        database_path = tmp_path_factory.mktemp("database") / "comfyui.db"
         pargs = [
             'python','main.py',
             '--output-directory', args_pytest["output_dir"],
             '--listen', args_pytest["listen"],
             '--port', str(args_pytest["port"]),
             '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+            '--database-url', f'sqlite:///{database_path}',
             '--cpu',
         ]
         pargs += [ str(param) for param in request.param["extra_args"] ]
@@ -259,6 +266,21 @@ class TestExecution:
             assert result2.did_run(input1), "Input1 should have been rerun"
             assert result2.did_run(input2), "Input2 should have been rerun"
 
+    def test_tensor_constant_cache(self, client: ComfyClient, builder: GraphBuilder, server):
+        g = builder
+        expansion = g.node("TestTensorConstantExpansion", value=0.5)
+        g.node("SaveImage", images=expansion.out(0))
+
+        client.run(g)
+        result2 = client.run(g)
+        assert result2.did_run(expansion), "Expansion node should run every time"
+        expanded_runs = [node_id for node_id in result2.runs if node_id.startswith(expansion.id + ".")]
+        if server["extra_args"] == []:
+            # The expanded node only has a tensor constant as input
+            assert len(expanded_runs) == 0, "Expanded node should have been cached"
+        elif not server["should_cache_results"]:
+            assert len(expanded_runs) > 0, "Expanded node should have been rerun"
+
     def test_error(self, client: ComfyClient, builder: GraphBuilder):
         g = builder
         input1 = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
@@ -877,3 +899,12 @@ class TestExecution:
         result = client.get_all_history(max_items=5, offset=len(all_history) - 1)
 
         assert len(result) <= 1, "Should return at most 1 item when offset is near end"
+
+    def test_queue_stats(self, client: ComfyClient, builder: GraphBuilder):
+        before = client.get_queue()["queue_stats"]["interactive"]["completed"]
+        self._create_history_item(client, builder)
+
+        stats = client.get_queue()["queue_stats"]
+        assert set(stats) == {"interactive", "batch"}
+        assert stats["interactive"]["completed"] == before + 1
+        assert stats["interactive"]["avg_service_time"] > 0
@@ -463,6 +463,32 @@ class TestParallelSleep(ComfyNodeABC):
             "expand": g.finalize(),
         }
 
+class TestTensorConstantExpansion:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "value": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0}),
+            },
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "expand_with_tensor"
+
+    CATEGORY = "Testing/Nodes"
+
+    @classmethod
+    def IS_CHANGED(cls, *args, **kwargs):
+        return float("NaN")
+
+    def expand_with_tensor(self, value):
+        g = GraphBuilder()
+        average = g.node("TestVariadicAverage", input1=torch.ones([1, 64, 64, 3]) * value)
+        return {
+            "result": (average.out(0),),
+            "expand": g.finalize(),
+        }
+
 class TestOutputNodeWithSocketOutput:
     @classmethod
     def INPUT_TYPES(cls):
@@ -497,6 +523,7 @@ TEST_NODE_CLASS_MAPPINGS = {
     "TestSamplingInExpansion": TestSamplingInExpansion,
     "TestSleep": TestSleep,
     "TestParallelSleep": TestParallelSleep,
+    "TestTensorConstantExpansion": TestTensorConstantExpansion,
     "TestOutputNodeWithSocketOutput": TestOutputNodeWithSocketOutput,
 }
 
@@ -515,5 +542,6 @@ TEST_NODE_DISPLAY_NAME_MAPPINGS = {
     "TestSamplingInExpansion": "Sampling In Expansion",
     "TestSleep": "Test Sleep",
     "TestParallelSleep": "Test Parallel Sleep",
+    "TestTensorConstantExpansion": "Test Tensor Constant Expansion",
     "TestOutputNodeWithSocketOutput": "Test Output Node With Socket Output",
 }
@@ -115,7 +115,7 @@ class ComfyUIClient:
         try:
             response = requests.post(
                 f"{self.url}/prompt",
-                json={"prompt": workflow, "client_id": self.client_id}
+                json={"prompt": workflow, "client_id": self.client_id, "priority": "batch"}
             )
             response.raise_for_status()
             return response.json()